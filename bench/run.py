@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmarks each stage of the pipeline.
+
+Usage:
+  run.py [options] [<js-file>...]
+  run.py -h | --help
+
+Options:
+       --repeat=<n>  Time each stage <n> times and keep the fastest time.
+                     [default: 3]
+  --baseline=<path>  The baseline to compare against. [default: {0}]
+             --save  Store the results as the new baseline instead.
+  --tolerance=<pct>  Report stages that are more than <pct> percent slower
+                     (or use more memory) than the baseline. [default: {1}]
+          --no-node  Don't benchmark codegen.js or parse.js.
+
+The inputs are the files in bench/corpus, synthetic code generated by
+bench/synthetic.py at several sizes, and any files given as arguments. For
+each input, the time, throughput, and peak traced memory of each stage are
+reported, as is the size of the JSON and binary representations sent to
+codegen.js. Exits with status 1 if any regressions are found.
+"""
+
+import os.path
+import sys
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+from opener.codegen import CodegenWorker  # noqa: E402
+from opener.node_parser import ParseWorker  # noqa: E402
+from opener.nodes import parse  # noqa: E402
+from opener.printer import generate as generate_python  # noqa: E402
+from opener.to_dict import to_dict  # noqa: E402
+from opener.to_binary import write_binary  # noqa: E402
+from opener.to_json import write_json  # noqa: E402
+from opener.transformations import transform  # noqa: E402
+from synthetic import generate as generate_synthetic  # noqa: E402
+from typing import Optional  # noqa: E402
+import gc  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 20
+
+# Sizes of the synthetic inputs, in KiB.
+SYNTHETIC_SIZES = [16, 64, 256]
+
+# Differences smaller than these are ignored as noise.
+MIN_TIME_DIFFERENCE = 0.005
+MIN_MEMORY_DIFFERENCE = 64 * 1024
+
+USAGE = __doc__.format(
+    os.path.relpath(DEFAULT_BASELINE), DEFAULT_TOLERANCE,
+).split("\n\n", 1)[1]
+
+
+def iter_inputs(args: list[str]):
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".js"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf8") as f:
+                yield name, f.read()
+    for size in SYNTHETIC_SIZES:
+        yield f"synthetic-{size}k", generate_synthetic(size * 1024)
+    for path in args:
+        with open(path, encoding="utf8") as f:
+            yield path, f.read()
+
+
+class Stages:
+    """Runs each stage of the pipeline once, in order, calling `measure`
+    with the name of each stage and a function that runs it.
+    """
+    def __init__(
+        self,
+        worker: Optional[CodegenWorker],
+        parse_worker: Optional[ParseWorker],
+    ):
+        self.worker = worker
+        self.parse_worker = parse_worker
+        # The size of each representation of the last transformed AST.
+        self.payload_bytes: dict[str, int] = {}
+
+    def run(self, source: str, measure):
+        ast = measure("parse", lambda: parse(source))
+        if self.parse_worker is not None:
+            measure("parse_node", lambda: self.parse_worker.parse(source))
+        measure("transform", lambda: transform(ast))
+        measure("to_dict", lambda: to_dict(ast))
+
+        def encode():
+            out = io.StringIO()
+            write_json(ast, out)
+            return out.getvalue()
+        text = measure("json", encode)
+
+        def encode_binary():
+            out = io.BytesIO()
+            write_binary(ast, out)
+            return out.getvalue()
+        data = measure("binary", encode_binary)
+        self.payload_bytes = {
+            "json": len(text.encode("utf8")),
+            "binary": len(data),
+        }
+        if self.worker is not None:
+            measure(
+                "codegen_js",
+                lambda: self.worker.generate(lambda f: f.write(text)),
+            )
+            measure(
+                "codegen_binary",
+                lambda: self.worker.generate(lambda f: f.write(data)),
+            )
+        measure("codegen_python", lambda: generate_python(ast))
+
+
+def benchmark(source: str, stages: Stages, repeat: int) -> dict:
+    results = {}
+
+    def measure_time(name: str, func):
+        gc.collect()
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        stats = results.setdefault(name, {"seconds": seconds})
+        stats["seconds"] = min(stats["seconds"], seconds)
+        return value
+
+    def measure_memory(name: str, func):
+        gc.collect()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        value = func()
+        _, peak = tracemalloc.get_traced_memory()
+        # The most memory allocated at any point during the stage. codegen.js
+        # runs in another process, so only the memory used to communicate
+        # with it is measured.
+        results[name]["peak_memory"] = peak - start
+        return value
+
+    for _ in range(repeat):
+        stages.run(source, measure_time)
+    tracemalloc.start()
+    try:
+        stages.run(source, measure_memory)
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of each regression in `current`."""
+    regressions = []
+    for name, result in current.items():
+        base_result = baseline.get(name)
+        if base_result is None:
+            continue
+        for stage, stats in result["stages"].items():
+            base = base_result["stages"].get(stage)
+            if base is None:
+                continue
+            seconds = stats["seconds"]
+            base_seconds = base["seconds"]
+            if (
+                seconds > base_seconds * (1 + tolerance) and
+                seconds - base_seconds > MIN_TIME_DIFFERENCE
+            ):
+                regressions.append(
+                    f"{name} {stage}: {seconds:.3f} s "
+                    f"(baseline {base_seconds:.3f} s)",
+                )
+            memory = stats["peak_memory"]
+            base_memory = base["peak_memory"]
+            if (
+                memory > base_memory * (1 + tolerance) and
+                memory - base_memory > MIN_MEMORY_DIFFERENCE
+            ):
+                regressions.append(
+                    f"{name} {stage}: {memory} bytes peak "
+                    f"(baseline {base_memory} bytes)",
+                )
+    return regressions
+
+
+def format_change(value: float, base: Optional[float]) -> str:
+    if not base:
+        return ""
+    return f"{(value / base - 1) * 100:+7.1f}%"
+
+
+def print_results(name: str, result: dict, baseline: Optional[dict]):
+    size = result["bytes"]
+    print(f"{name} ({size} bytes)")
+    for stage, stats in result["stages"].items():
+        base = (baseline or {}).get("stages", {}).get(stage, {})
+        seconds = stats["seconds"]
+        memory = stats["peak_memory"]
+        throughput = size / seconds / 1024 if seconds else float("inf")
+        print((
+            f"  {stage:<16}{seconds:9.3f} s"
+            f"{format_change(seconds, base.get('seconds')):>9}"
+            f"{throughput:11.1f} KiB/s"
+            f"{memory / 1024 / 1024:9.1f} MiB peak"
+            f"{format_change(memory, base.get('peak_memory')):>9}"
+        ).rstrip())
+    payload = result["payload_bytes"]
+    print(
+        f"  payload: {payload['json']} bytes of JSON, "
+        f"{payload['binary']} bytes of binary "
+        f"({format_change(payload['binary'], payload['json']).strip()})",
+    )
+
+
+def main():
+    repeat = DEFAULT_REPEAT
+    baseline_path = DEFAULT_BASELINE
+    save = False
+    tolerance = DEFAULT_TOLERANCE
+    use_node = True
+    paths = []
+
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            args += arg.split("=", 1)
+        else:
+            args.append(arg)
+
+    iterator = iter(args)
+    for arg in iterator:
+        try:
+            if arg in ["-h", "--help"]:
+                print(USAGE, end="")
+                return
+            elif arg == "--repeat":
+                repeat = int(next(iterator))
+                if repeat < 1:
+                    raise ValueError
+            elif arg == "--baseline":
+                baseline_path = next(iterator)
+            elif arg == "--save":
+                save = True
+            elif arg == "--tolerance":
+                tolerance = float(next(iterator))
+            elif arg == "--no-node":
+                use_node = False
+            elif arg.startswith("-"):
+                print(f"Unrecognized option: {arg}", file=sys.stderr)
+                sys.exit(1)
+            else:
+                paths.append(arg)
+        except (StopIteration, ValueError):
+            print(f"Expected a value after {arg}", file=sys.stderr)
+            sys.exit(1)
+
+    baseline = {}
+    if not save and os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf8") as f:
+            baseline = json.load(f)["inputs"]
+
+    worker = CodegenWorker() if use_node else None
+    parse_worker = ParseWorker() if use_node else None
+    stages = Stages(worker, parse_worker)
+    current = {}
+    try:
+        if use_node:
+            # Start the workers before anything is timed.
+            worker.generate(lambda f: write_json(parse(""), f))
+            parse_worker.parse("")
+        for name, source in iter_inputs(paths):
+            result = {
+                "bytes": len(source.encode("utf8")),
+                "stages": benchmark(source, stages, repeat),
+                "payload_bytes": stages.payload_bytes,
+            }
+            current[name] = result
+            print_results(name, result, baseline.get(name))
+    finally:
+        if use_node:
+            worker.close()
+            parse_worker.close()
+
+    if save:
+        with open(baseline_path, "w", encoding="utf8") as f:
+            json.dump({"inputs": current}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {baseline_path}")
+        return
+    if not baseline:
+        print("No baseline to compare against (use --save to create one)")
+        return
+    regressions = compare(current, baseline, tolerance / 100)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Checks that transforming the worst cases of Unsequence scales linearly.
+
+Usage:
+  scaling.py [options] [<case>...]
+  scaling.py -h | --help
+
+Options:
+        --repeat=<n>  Time each transformation <n> times and keep the fastest
+                      time. [default: {0}]
+         --steps=<n>  Measure each case at <n> sizes, each twice the last.
+                      [default: {1}]
+  --max-exponent=<x>  Fail if the time or memory used by any case grows
+                      faster than n^<x>. [default: {2}]
+
+Each case from bench/stress.py (or only the given cases) is generated at
+several sizes, and the time and peak traced memory used to transform it are
+measured. The exponent k of the best fit of each to c * n^k is reported; a
+linear transformation has an exponent of about 1, and a quadratic one, about
+2. Exits with status 1 if any exponent is greater than the maximum.
+"""
+
+import os.path
+import sys
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+from opener.nodes import parse  # noqa: E402
+from opener.transformations import transform  # noqa: E402
+from stress import CASES, generate  # noqa: E402
+import gc  # noqa: E402
+import math  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+
+DEFAULT_REPEAT = 5
+DEFAULT_STEPS = 4
+DEFAULT_MAX_EXPONENT = 1.3
+
+# The smallest size of each case, chosen so that it takes long enough to time
+# reliably.
+BASE_SIZES = {
+    "comma": 1000,
+    "ternary": 250,
+    "arguments": 500,
+    "and-chain": 250,
+}
+
+# Parsing and transforming the nested cases is recursive, so they're run in a
+# thread with a larger stack and recursion limit.
+STACK_SIZE = 512 * 1024 * 1024
+RECURSION_LIMIT = 100000
+
+USAGE = __doc__.format(
+    DEFAULT_REPEAT, DEFAULT_STEPS, DEFAULT_MAX_EXPONENT,
+).split("\n\n", 1)[1]
+
+
+def measure(source: str, repeat: int) -> tuple[float, int]:
+    """Returns the fastest time and the peak traced memory used to transform
+    `source`.
+    """
+    seconds = math.inf
+    for _ in range(repeat):
+        ast = parse(source)
+        gc.collect()
+        # Collections take longer as the heap grows, which would make the
+        # growth look superlinear.
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            transform(ast)
+            seconds = min(seconds, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    ast = parse(source)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        transform(ast)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak - start
+
+
+def fit_exponent(sizes: list[int], values: list[float]) -> float:
+    """Returns the exponent k of the least-squares fit of
+    log(value) = k * log(size) + c.
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, 1e-9)) for value in values]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    return numerator / denominator
+
+
+def run_case(case: str, steps: int, repeat: int) -> tuple[float, float]:
+    """Prints the measurements for each size of `case`, and returns the time
+    and memory exponents.
+    """
+    sizes = [BASE_SIZES[case] * 2 ** i for i in range(steps)]
+    times = []
+    peaks = []
+    print(case)
+    for size in sizes:
+        seconds, peak = measure(generate(case, size), repeat)
+        times.append(seconds)
+        peaks.append(peak)
+        print(
+            f"  n = {size:<8}{seconds:9.3f} s"
+            f"{peak / 1024 / 1024:9.1f} MiB peak",
+        )
+    return fit_exponent(sizes, times), fit_exponent(sizes, peaks)
+
+
+def main():
+    repeat = DEFAULT_REPEAT
+    steps = DEFAULT_STEPS
+    max_exponent = DEFAULT_MAX_EXPONENT
+    cases = []
+
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            args += arg.split("=", 1)
+        else:
+            args.append(arg)
+
+    iterator = iter(args)
+    for arg in iterator:
+        try:
+            if arg in ["-h", "--help"]:
+                print(USAGE, end="")
+                return
+            elif arg == "--repeat":
+                repeat = int(next(iterator))
+                if repeat < 1:
+                    raise ValueError
+            elif arg == "--steps":
+                steps = int(next(iterator))
+                if steps < 2:
+                    raise ValueError
+            elif arg == "--max-exponent":
+                max_exponent = float(next(iterator))
+            elif arg.startswith("-"):
+                print(f"Unrecognized option: {arg}", file=sys.stderr)
+                sys.exit(1)
+            elif arg not in CASES:
+                print(f"Unknown case: {arg}", file=sys.stderr)
+                sys.exit(1)
+            else:
+                cases.append(arg)
+        except (StopIteration, ValueError):
+            print(f"Expected a value after {arg}", file=sys.stderr)
+            sys.exit(1)
+
+    failures = []
+
+    def run():
+        for case in cases or CASES:
+            time_exponent, memory_exponent = run_case(case, steps, repeat)
+            print(
+                f"  exponent: {time_exponent:.2f} (time), "
+                f"{memory_exponent:.2f} (memory)",
+            )
+            for name, exponent in [
+                ("time", time_exponent),
+                ("memory", memory_exponent),
+            ]:
+                if exponent > max_exponent:
+                    failures.append(
+                        f"{case}: {name} grows as n^{exponent:.2f}",
+                    )
+
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    threading.stack_size(STACK_SIZE)
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+    if failures:
+        print("\nSuperlinear growth:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nAll cases scale linearly")
+
+
+if __name__ == "__main__":
+    main()
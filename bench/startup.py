@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Benchmarks Opener's startup time.
+
+Usage:
+  startup.py [options]
+  startup.py -h | --help
+
+Options:
+       --repeat=<n>  Run each command <n> times and keep the fastest time.
+                     [default: 5]
+  --baseline=<path>  The baseline to compare against. [default: {0}]
+             --save  Store the results as the new baseline instead.
+  --tolerance=<pct>  Report commands that are more than <pct> percent slower
+                     than the baseline. [default: {1}]
+          --no-node  Don't run the command that uses codegen.js.
+
+Each command (displaying the help message, and deobfuscating a tiny input)
+is run in a new process. For each, the wall time of the whole process and the
+total time spent importing modules (according to ``python -X importtime``)
+are reported, along with the modules that took the longest to import
+themselves. Exits with status 1 if any regressions are found.
+"""
+
+import os.path
+import sys
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+OPENER = os.path.join(BENCH_DIR, os.pardir, "opener.py")
+
+import json  # noqa: E402
+import subprocess  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "startup-baseline.json")
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 20
+
+# Differences smaller than this are ignored as noise.
+MIN_TIME_DIFFERENCE = 0.01
+
+# The number of slowest imports to show.
+NUM_SLOWEST = 5
+
+TINY_INPUT = "a = (b(), c && d(), e ? f : g);\n"
+
+USAGE = __doc__.format(
+    os.path.relpath(DEFAULT_BASELINE), DEFAULT_TOLERANCE,
+).split("\n\n", 1)[1]
+
+
+def get_commands(tiny_path: str, use_node: bool) -> dict[str, list[str]]:
+    commands = {
+        "help": ["--help"],
+        "tiny-python": ["--codegen=python", tiny_path],
+    }
+    if use_node:
+        commands["tiny-escodegen"] = [tiny_path]
+    return commands
+
+
+def parse_importtime(stderr: str) -> tuple[float, list[tuple[str, float]]]:
+    """Returns the total import time and the time spent importing each
+    module (excluding the modules it imports), in seconds, from the output of
+    ``-X importtime``.
+    """
+    total = 0
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us = int(fields[0])
+        except ValueError:
+            # The header line.
+            continue
+        total += self_us
+        modules.append((fields[2].strip(), self_us / 1e6))
+    return total / 1e6, modules
+
+
+def benchmark(args: list[str], repeat: int) -> dict:
+    command = [sys.executable, OPENER] + args
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    import_seconds = None
+    slowest = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime"] + command[1:],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+            encoding="utf8",
+        )
+        total, modules = parse_importtime(proc.stderr)
+        if import_seconds is None or total < import_seconds:
+            import_seconds = total
+            slowest = sorted(modules, key=lambda item: -item[1])
+    return {
+        "seconds": seconds,
+        "import_seconds": import_seconds,
+        "slowest_imports": slowest[:NUM_SLOWEST],
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of each regression in `current`."""
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key, label in [
+            ("seconds", "wall time"),
+            ("import_seconds", "import time"),
+        ]:
+            value = result[key]
+            base_value = base[key]
+            if (
+                value > base_value * (1 + tolerance) and
+                value - base_value > MIN_TIME_DIFFERENCE
+            ):
+                regressions.append(
+                    f"{name} {label}: {value:.3f} s "
+                    f"(baseline {base_value:.3f} s)",
+                )
+    return regressions
+
+
+def format_change(value: float, base) -> str:
+    if not base:
+        return ""
+    return f"{(value / base - 1) * 100:+7.1f}%"
+
+
+def print_results(name: str, result: dict, baseline):
+    base = baseline or {}
+    seconds = result["seconds"]
+    import_seconds = result["import_seconds"]
+    print(name)
+    print((
+        f"  {'wall time':<16}{seconds:9.3f} s"
+        f"{format_change(seconds, base.get('seconds')):>9}"
+    ).rstrip())
+    print((
+        f"  {'import time':<16}{import_seconds:9.3f} s"
+        f"{format_change(import_seconds, base.get('import_seconds')):>9}"
+    ).rstrip())
+    for module, module_seconds in result["slowest_imports"]:
+        print(f"    {module:<30}{module_seconds:9.3f} s")
+
+
+def main():
+    repeat = DEFAULT_REPEAT
+    baseline_path = DEFAULT_BASELINE
+    save = False
+    tolerance = DEFAULT_TOLERANCE
+    use_node = True
+
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            args += arg.split("=", 1)
+        else:
+            args.append(arg)
+
+    iterator = iter(args)
+    for arg in iterator:
+        try:
+            if arg in ["-h", "--help"]:
+                print(USAGE, end="")
+                return
+            elif arg == "--repeat":
+                repeat = int(next(iterator))
+                if repeat < 1:
+                    raise ValueError
+            elif arg == "--baseline":
+                baseline_path = next(iterator)
+            elif arg == "--save":
+                save = True
+            elif arg == "--tolerance":
+                tolerance = float(next(iterator))
+            elif arg == "--no-node":
+                use_node = False
+            else:
+                print(f"Unrecognized argument: {arg}", file=sys.stderr)
+                sys.exit(1)
+        except (StopIteration, ValueError):
+            print(f"Expected a value after {arg}", file=sys.stderr)
+            sys.exit(1)
+
+    baseline = {}
+    if not save and os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf8") as f:
+            baseline = json.load(f)["commands"]
+
+    current = {}
+    with tempfile.TemporaryDirectory() as directory:
+        tiny_path = os.path.join(directory, "tiny.js")
+        with open(tiny_path, "w", encoding="utf8") as f:
+            f.write(TINY_INPUT)
+        for name, command in get_commands(tiny_path, use_node).items():
+            result = benchmark(command, repeat)
+            current[name] = result
+            print_results(name, result, baseline.get(name))
+
+    if save:
+        with open(baseline_path, "w", encoding="utf8") as f:
+            json.dump({"commands": current}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {baseline_path}")
+        return
+    if not baseline:
+        print("No baseline to compare against (use --save to create one)")
+        return
+    regressions = compare(current, baseline, tolerance / 100)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Generates minified JavaScript that stresses the worst cases of Unsequence.
+
+Usage: stress.py <case> <n>
+
+Writes the code for <case> with <n> repetitions of its construct to standard
+output. The cases are:
+
+  comma      A sequence expression of <n> calls.
+  ternary    <n> nested conditional expressions, which `conditional_to_if()`
+             turns into nested if statements.
+  arguments  A call with <n> arguments, the last of which is a sequence
+             expression, so every earlier argument goes through
+             `pre_eval_expression()`.
+  and-chain  <n> nested && expressions ending in a sequence expression, so
+             each operand goes through `store_in_temporary()`.
+"""
+
+import sys
+
+
+def comma(n: int) -> str:
+    return "x=(" + ",".join(f"a{i}()" for i in range(n)) + ");\n"
+
+
+def ternary(n: int) -> str:
+    return "x=" + "".join(f"a{i}?b{i}:" for i in range(n)) + "c;\n"
+
+
+def arguments(n: int) -> str:
+    return "f(" + "".join(f"a{i}.b," for i in range(n)) + "(c(),d));\n"
+
+
+def and_chain(n: int) -> str:
+    return (
+        "x=" + "".join(f"a{i}&&(" for i in range(n)) + "b(),c" + ")" * n +
+        ";\n"
+    )
+
+
+CASES = {
+    "comma": comma,
+    "ternary": ternary,
+    "arguments": arguments,
+    "and-chain": and_chain,
+}
+
+
+def generate(case: str, n: int) -> str:
+    return CASES[case](n)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) != 2 or args[0] not in CASES:
+        print(__doc__.split("\n\n", 1)[1], file=sys.stderr, end="")
+        sys.exit(1)
+    sys.stdout.write(generate(args[0], int(args[1])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Generates synthetic minified JavaScript for benchmarks.
+
+Usage: synthetic.py <size> [<seed>]
+
+Writes roughly <size> bytes of code to standard output. The code resembles
+the output of Closure Compiler (sequence expressions, short-circuiting
+statements, conditional statements, and so on), so it exercises every
+transformation. The same size and seed always produce the same code.
+"""
+
+import random
+import sys
+
+DEFAULT_SEED = 1
+
+
+class Generator:
+    def __init__(self, seed=DEFAULT_SEED):
+        self.rng = random.Random(seed)
+        self.num_functions = 0
+
+    def name(self) -> str:
+        return self.rng.choice("abcdefghijklmnopqrstuvwxyz")
+
+    def atom(self) -> str:
+        rng = self.rng
+        return rng.choice([
+            self.name,
+            lambda: str(rng.randrange(100)),
+            lambda: f'"{self.name()}{self.name()}"',
+            lambda: f"{self.name()}.{self.name()}",
+            lambda: f"{self.name()}[{self.name()}]",
+            lambda: "void 0",
+            lambda: rng.choice(["!0", "!1"]),
+        ])()
+
+    def expr(self, depth=0) -> str:
+        rng = self.rng
+        if depth >= 3:
+            return self.atom()
+        d = depth + 1
+        return rng.choice([
+            self.atom,
+            self.atom,
+            lambda: f"{self.atom()}{rng.choice('+-*<')}{self.expr(d)}",
+            lambda: f"{self.name()}({self.args(d)})",
+            lambda: f"{self.name()}.{self.name()}({self.args(d)})",
+            lambda: f"({self.name()}={self.expr(d)})",
+            lambda: f"{self.expr(d)}?{self.expr(d)}:{self.expr(d)}",
+            lambda: f"({self.expr(d)},{self.expr(d)})",
+            lambda: f"(function(){{return {self.expr(d)}}})()",
+            lambda: f"({{{self.name()}:{self.expr(d)}}})",
+        ])()
+
+    def args(self, depth: int) -> str:
+        return ",".join(
+            self.expr(depth) for _ in range(self.rng.randrange(3))
+        )
+
+    def sequence(self, depth: int) -> str:
+        return ",".join(
+            f"{self.name()}={self.expr(depth)}"
+            for _ in range(self.rng.randrange(1, 5))
+        )
+
+    def statement(self, depth=0, *, declarations=False) -> str:
+        rng = self.rng
+        d = depth + 1
+        choices = [
+            lambda: f"{self.sequence(d)};",
+            lambda: f"{self.expr(d)}&&{self.name()}({self.args(d)});",
+            lambda: f"{self.expr(d)}||({self.sequence(d)});",
+            lambda: f"{self.expr(d)}?{self.name()}():({self.sequence(d)});",
+            lambda: f"var {self.sequence(d)};",
+            lambda: f"return {self.sequence(d)},{self.expr(d)};",
+            lambda: f"if({self.sequence(d)},{self.expr(d)})"
+            f"{self.statement(d)}",
+        ]
+        if depth < 3:
+            choices += [
+                lambda: f"for({self.sequence(d)};{self.expr(d)};"
+                f"{self.sequence(d)}){{{self.statements(d)}}}",
+                lambda: f"if({self.expr(d)}){{{self.statements(d)}}}else "
+                f"{self.statement(d)}",
+            ]
+        if depth < 3 and declarations:
+            choices.append(lambda: self.function(d))
+        return rng.choice(choices)()
+
+    def statements(self, depth: int) -> str:
+        return "".join(
+            self.statement(depth, declarations=True)
+            for _ in range(self.rng.randrange(1, 6))
+        )
+
+    def function(self, depth=0) -> str:
+        self.num_functions += 1
+        params = ",".join(self.name() for _ in range(self.rng.randrange(4)))
+        return (
+            f"function f{self.num_functions}({params})"
+            f"{{{self.statements(depth)}}}"
+        )
+
+    def module(self, size: int) -> str:
+        """Returns about `size` bytes of code, wrapped in an IIFE."""
+        parts = []
+        total = 0
+        while total < size:
+            part = self.function()
+            parts.append(part)
+            total += len(part)
+        functions = ",".join(
+            f"function(){{return f{i}}}"
+            for i in range(1, min(self.num_functions, 32) + 1)
+        )
+        return (
+            f"(function(){{{''.join(parts)}var q=[{functions}];"
+            f"window.q=q}})();\n"
+        )
+
+
+def generate(size: int, seed=DEFAULT_SEED) -> str:
+    return Generator(seed).module(size)
+
+
+def main():
+    args = sys.argv[1:]
+    if not 1 <= len(args) <= 2 or args[0] in ["-h", "--help"]:
+        print(__doc__.split("\n\n")[1], file=sys.stderr)
+        sys.exit(1)
+    size = int(args[0])
+    seed = int(args[1]) if len(args) > 1 else DEFAULT_SEED
+    sys.stdout.write(generate(size, seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,29 @@ from .__main__ import main
 # Wrapper that calls `.transformations.transform`. We avoid importing
 # `.transformations` directly since it would negatively impact startup time,
 # even if we just need to display the help message.
-def transform(*args, **kwargs):
+#
+# `ast` is deobfuscated in place. It can be a tree of compact nodes
+# (`opener.nodes.Node`, as returned by `opener.nodes.parse()`) or of esprima
+# nodes (as returned by `esprima.parseScript()`); esprima trees are converted
+# to compact nodes to be transformed, and the result is converted back into
+# the same root node.
+def transform(ast, *args, **kwargs):
+    from .nodes import EsprimaNode, Node, from_esprima, to_esprima
     from .transformations import transform
-    return transform(*args, **kwargs)  # Currently returns `None`
+    if isinstance(ast, Node):
+        return transform(ast, *args, **kwargs)  # Returns a `State`
+    if not isinstance(ast, EsprimaNode):
+        raise TypeError(
+            "expected an opener.nodes.Node or esprima.nodes.Node, not "
+            + type(ast).__name__,
+        )
+    root = from_esprima(ast)
+    state = transform(root, *args, **kwargs)
+    to_esprima(root, ast)
+    return state
+
+
+# Wrapper that calls `.api.deobfuscate`, for the same reason.
+def deobfuscate(*args, **kwargs):
+    from .api import deobfuscate
+    return deobfuscate(*args, **kwargs)  # Returns a `str`
@@ -15,18 +15,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Opener. If not, see <https://www.gnu.org/licenses/>.
 
-from .defaults import DEFAULT_TEMP_PREFIX
+from .defaults import (
+    CODEGEN_FORMATS, CODEGEN_PYTHON, CODEGENS, DEFAULT_CACHE_SIZE_MIB,
+    DEFAULT_CODEGEN, DEFAULT_CODEGEN_FORMAT, DEFAULT_MAX_SIZE_MIB,
+    DEFAULT_PARSER, DEFAULT_TEMP_PREFIX, DEFAULT_TIMEOUT, PARSER_NODE,
+    PARSER_PYTHON, PARSERS, PROFILE_FORMATS,
+)
 
-import json
+# `typing` isn't imported, as it's slow to import and not needed to display
+# the help message.
+import io
 import os
 import os.path
-import re
-import subprocess
 import sys
 
 USAGE = """\
 Usage:
   {0} [options] <js-file>
+  {0} [options] -o <dir> <input>...
+  {0} [options] --watch -o <dir> <input>...
+  {0} [options] --serve=<address>
   {0} -h | --help
 
 Options:
@@ -35,26 +43,77 @@ Options:
                         prefix followed by a sequence of digits in the input
                         code. [default: {1}]
               -a --ast  Output a JSON representation of the AST instead of JS.
+   -g --codegen=<name>  The code generator: "escodegen" (runs escodegen in
+                        Node.js) or "python" (a built-in port of escodegen
+                        that doesn't require Node.js). [default: {2}]
+  --codegen-format=<f>  How ASTs are sent to codegen.js: "json" or "binary" (a
+                        compact format that codegen.js decodes while it's
+                        being sent). [default: {7}]
+       --parser=<name>  The parser: "python" (esprima-python) or "node" (runs
+                        esprima in Node.js, which is faster for large
+                        inputs). [default: {6}]
+     -o --output=<dir>  Batch mode: process every input (a file, a directory
+                        to search for .js files, or a glob pattern) and write
+                        the results to a mirrored tree under <dir>.
+         -j --jobs=<n>  The number of worker processes to use. In batch mode,
+                        inputs are processed in parallel; otherwise, large
+                        function bodies are transformed in parallel.
+                        [default: number of CPUs in batch mode and with
+                        --serve, otherwise 1]
+     -c --cache=<path>  Cache finished outputs, and transformed function
+                        bodies for reuse in other inputs (such as new versions
+                        of a bundle), in the SQLite database at <path>. The
+                        cache can be shared by several processes.
+    --cache-size=<mib>  The maximum size of the cache. The least recently used
+                        entries are evicted first. [default: {3}]
+    --profile=<format>  Output the time and memory used by each phase and
+                        pass, and statistics about the AST, to standard error
+                        as "text" or "json" (one line per input). The cache
+                        isn't used when profiling.
+     --serve=<address>  Run a server that deobfuscates code sent to it over
+                        HTTP, listening on <address>: a host and port
+                        separated by a colon, or the path of a Unix socket
+                        (containing a slash). See opener/server.py for the
+                        protocol. Requests are handled by the number of
+                        worker processes given by --jobs, with the given
+                        --codegen, --codegen-format, --parser, --cache, and
+                        budget options.
+      --max-size=<mib>  The largest input the server accepts. [default: {4}]
+   --timeout=<seconds>  The longest the server spends on a request before
+                        giving up. [default: {5}]
+              --stream  Parse, deobfuscate, and output the top-level
+                        statements of <js-file> a chunk at a time, so that
+                        output starts sooner and large scripts with many
+                        top-level statements use less memory. Temporaries
+                        are numbered one top-level statement at a time, so
+                        the output doesn't depend on the chunk size. Only
+                        function bodies are cached.
+    --budget=<seconds>  Stop splitting up sequences and conditionals (the
+                        most expensive transformation) after transforming
+                        for <seconds> seconds, so that inputs that would take
+                        too long still produce output. The rest of the code
+                        is only partially deobfuscated, and is preceded by a
+                        comment saying so in the JS output (with --ast, the
+                        Program has "budgetExhausted": true instead). Large
+                        function bodies aren't transformed in parallel.
+     --work-budget=<n>  The same, but after <n> units of work (nodes visited
+                        and statements processed).
+               --watch  Batch mode: keep running, and whenever an input
+                        changes (or a new one appears), process it again.
+                        Only the top-level statements that changed are
+                        deobfuscated again; the output is the same as with
+                        --stream. Requires --parser=python.
           -v --verbose  Output additional messages to standard error.
-""".format(os.path.basename(sys.argv[0]), DEFAULT_TEMP_PREFIX)
+""".format(
+    os.path.basename(sys.argv[0]), DEFAULT_TEMP_PREFIX, DEFAULT_CODEGEN,
+    DEFAULT_CACHE_SIZE_MIB, DEFAULT_MAX_SIZE_MIB, DEFAULT_TIMEOUT,
+    DEFAULT_PARSER, DEFAULT_CODEGEN_FORMAT,
+)
 
 
 def _import():
-    global to_dict, transform
-    from .to_dict import to_dict
-    from .transformations import transform
-    global esprima, pkg_resources
-    import esprima
-    import pkg_resources
-
-
-class JsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        # Regex patterns aren't JSON-serializable, but escodegen shouldn't
-        # need them.
-        if isinstance(obj, re.Pattern):
-            return "THIS_SHOULD_NOT_APPEAR_IN_GENERATED_CODE!"
-        return super().default(obj)
+    global process, process_stream
+    from .pipeline import process, process_stream
 
 
 def usage(*, exit: bool, error: bool):
@@ -63,22 +122,25 @@ def usage(*, exit: bool, error: bool):
         sys.exit(int(error))
 
 
-def run_codegen_js(ast_dict: dict):
-    path = pkg_resources.resource_filename(__name__, "codegen.js")
-    proc = subprocess.Popen(
-        ["node", path],
-        stdin=subprocess.PIPE,
-        encoding="utf8",
-    )
-    json.dump(ast_dict, proc.stdin, cls=JsonEncoder)
-    proc.stdin.close()
-    proc.wait()
-
-
 def main():
     positional_args = []
     temp_prefix = DEFAULT_TEMP_PREFIX
     emit_ast = False
+    codegen = DEFAULT_CODEGEN
+    codegen_format = DEFAULT_CODEGEN_FORMAT
+    parser = DEFAULT_PARSER
+    output_dir = None
+    jobs = None
+    cache_path = None
+    cache_size = DEFAULT_CACHE_SIZE_MIB
+    profile = None
+    serve_address = None
+    max_size = DEFAULT_MAX_SIZE_MIB
+    timeout = DEFAULT_TIMEOUT
+    stream = False
+    budget_seconds = None
+    budget_work = None
+    watch = False
     verbose = False
 
     args = []
@@ -93,7 +155,7 @@ def main():
             next(iterator)
             for i, c in iterator:
                 args.append(f"-{c}")
-                if c in ["p"]:
+                if c in ["p", "g", "o", "j", "c"]:
                     break
             trailing = arg[i+1:]
             if trailing:
@@ -115,39 +177,303 @@ def main():
                 usage(exit=True, error=True)
         elif arg in ["-a", "--ast"]:
             emit_ast = True
+        elif arg in ["-g", "--codegen"]:
+            try:
+                codegen = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            if codegen not in CODEGENS:
+                print(f"Unknown code generator: {codegen}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--codegen-format":
+            try:
+                codegen_format = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            if codegen_format not in CODEGEN_FORMATS:
+                print(
+                    f"Unknown codegen format: {codegen_format}",
+                    file=sys.stderr,
+                )
+                usage(exit=True, error=True)
+        elif arg == "--parser":
+            try:
+                parser = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            if parser not in PARSERS:
+                print(f"Unknown parser: {parser}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg in ["-o", "--output"]:
+            try:
+                output_dir = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg in ["-j", "--jobs"]:
+            try:
+                jobs = int(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected integer after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg in ["-c", "--cache"]:
+            try:
+                cache_path = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--cache-size":
+            try:
+                cache_size = int(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected integer after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--profile":
+            try:
+                profile = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            if profile not in PROFILE_FORMATS:
+                print(f"Unknown profile format: {profile}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--serve":
+            try:
+                serve_address = next(iterator)
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--max-size":
+            try:
+                max_size = int(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected integer after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--timeout":
+            try:
+                timeout = float(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected number after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--stream":
+            stream = True
+        elif arg == "--budget":
+            try:
+                budget_seconds = float(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected number after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--work-budget":
+            try:
+                budget_work = int(next(iterator))
+            except StopIteration:
+                print(f"Expected value after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+            except ValueError:
+                print(f"Expected integer after {arg}", file=sys.stderr)
+                usage(exit=True, error=True)
+        elif arg == "--watch":
+            watch = True
         elif arg in ["-v", "--verbose"]:
             verbose = True
         else:
             print(f"Unrecognized option: {arg}", file=sys.stderr)
             usage(exit=True, error=True)
 
-    if len(positional_args) != 1:
+    if profile is not None:
+        cache_path = None
+    if stream and parser != PARSER_PYTHON:
+        print("--stream requires --parser=python", file=sys.stderr)
+        usage(exit=True, error=True)
+    if watch:
+        if parser != PARSER_PYTHON:
+            print("--watch requires --parser=python", file=sys.stderr)
+            usage(exit=True, error=True)
+        if emit_ast or profile is not None:
+            print(
+                "--watch can't be used with --ast or --profile",
+                file=sys.stderr,
+            )
+            usage(exit=True, error=True)
+        if budget_seconds is not None or budget_work is not None:
+            print("--watch can't be used with a budget", file=sys.stderr)
+            usage(exit=True, error=True)
+
+    if jobs is None:
+        # Transforming function bodies in parallel only pays off for large
+        # inputs, so it isn't the default for a single input.
+        single = serve_address is None and output_dir is None
+        jobs = 1 if single else os.cpu_count() or 1
+
+    if serve_address is not None:
+        if positional_args or output_dir is not None or watch:
+            usage(exit=True, error=True)
+        if profile is not None or stream:
+            print(
+                "--serve can't be used with --profile or --stream",
+                file=sys.stderr,
+            )
+            usage(exit=True, error=True)
+        from .server import WorkerOptions, serve
+        try:
+            serve(
+                serve_address,
+                jobs=jobs,
+                options=WorkerOptions(
+                    codegen=codegen,
+                    codegen_format=codegen_format,
+                    parser=parser,
+                    cache_path=cache_path,
+                    cache_size=cache_size * 1024 * 1024,
+                    budget_seconds=budget_seconds,
+                    budget_work=budget_work,
+                ),
+                max_size=max_size * 1024 * 1024,
+                timeout=timeout,
+                verbose=verbose,
+            )
+        except (OSError, ValueError) as e:
+            print(f"Could not start server: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if output_dir is not None:
+        if not positional_args:
+            usage(exit=True, error=True)
+        from .batch import Options, run_batch
+        options = Options(
+            output_dir=output_dir,
+            temp_prefix=temp_prefix,
+            emit_ast=emit_ast,
+            codegen=codegen,
+            codegen_format=codegen_format,
+            parser=parser,
+            cache_path=cache_path,
+            cache_size=cache_size * 1024 * 1024,
+            profile=profile,
+            budget_seconds=budget_seconds,
+            budget_work=budget_work,
+        )
+        if watch:
+            from .watch import run_watch
+            run_watch(positional_args, options, verbose=verbose)
+            return
+        success = run_batch(
+            positional_args, options,
+            jobs=jobs,
+            verbose=verbose,
+        )
+        sys.exit(int(not success))
+
+    if len(positional_args) != 1 or watch:
         usage(exit=True, error=True)
 
     with open(positional_args[0], encoding="utf8") as f:
         source = f.read()
 
+    run_options = dict(
+        temp_prefix=temp_prefix,
+        emit_ast=emit_ast,
+        codegen=codegen,
+        codegen_format=codegen_format,
+        parser=parser,
+        jobs=jobs,
+        stream=stream,
+        budget_seconds=budget_seconds,
+        budget_work=budget_work,
+        verbose=verbose,
+    )
+    if profile is not None:
+        from .profiling import Profiler, format_report
+        with Profiler() as profiler:
+            run(source, sys.stdout, profiler=profiler, **run_options)
+        print(format_report(profiler.report(), profile), file=sys.stderr)
+        return
+
+    if cache_path is None:
+        run(source, sys.stdout, **run_options)
+        return
+
+    # Check the cache before importing anything slow.
+    from .cache import ResultCache
+    with ResultCache(cache_path, cache_size * 1024 * 1024) as cache:
+        if stream:
+            # Storing the whole output would defeat the purpose of streaming
+            # it, so only function bodies are cached.
+            run(source, sys.stdout, cache=cache, **run_options)
+            return
+        output = cache.get(source, temp_prefix=temp_prefix, emit_ast=emit_ast)
+        if output is not None:
+            if verbose:
+                print("Using cached output", file=sys.stderr)
+            sys.stdout.write(output)
+            return
+        out = io.StringIO()
+        state = run(source, out, cache=cache, **run_options)
+        output = out.getvalue()
+        # Partially deobfuscated output isn't cached.
+        if not state.budget_exhausted:
+            cache.put(
+                source, output,
+                temp_prefix=temp_prefix,
+                emit_ast=emit_ast,
+            )
+    sys.stdout.write(output)
+
+
+def run(
+    source: str,
+    out: io.TextIOBase, *,
+    emit_ast: bool,
+    codegen: str,
+    codegen_format: str,
+    parser: str,
+    stream: bool,
+    budget_seconds=None,
+    budget_work=None,
+    **kwargs,
+):
     _import()
-    if verbose:
-        print("Parsing...", file=sys.stderr)
-    ast = esprima.parseScript(source)
-
-    if verbose:
-        print("Deobfuscating...", file=sys.stderr)
-    transform(ast, temp_prefix=temp_prefix)
-
-    if verbose:
-        print("Making AST JSON-serializable...", file=sys.stderr)
-    ast_dict = to_dict(ast)
-
-    if emit_ast:
-        if verbose:
-            print("Printing AST...", file=sys.stderr)
-        json.dump(ast_dict, sys.stdout, cls=JsonEncoder)
-    else:
-        if verbose:
-            print("Formatting code...", file=sys.stderr)
-        run_codegen_js(ast_dict)
+    from contextlib import ExitStack
+    func = process_stream if stream else process
+    kwargs.update(emit_ast=emit_ast, codegen=codegen)
+    if budget_seconds is not None or budget_work is not None:
+        from .budget import Budget
+        kwargs["budget"] = Budget(seconds=budget_seconds, work=budget_work)
+    with ExitStack() as stack:
+        if parser == PARSER_NODE:
+            from .node_parser import ParseWorker
+            kwargs["parse_worker"] = stack.enter_context(ParseWorker())
+        if not (emit_ast or codegen == CODEGEN_PYTHON):
+            from .codegen import CodegenWorker
+            kwargs["worker"] = stack.enter_context(
+                CodegenWorker(codegen_format),
+            )
+        state = func(source, out, **kwargs)
+    if state.budget_exhausted:
+        print(
+            "Budget exhausted; the output is only partially deobfuscated",
+            file=sys.stderr,
+        )
+    return state
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""An asyncio API for deobfuscating code.
+
+Parsing, transforming, and encoding the AST run in an executor, and
+codegen.js is run with asyncio's subprocess support, so the event loop is
+never blocked. Pass a `concurrent.futures.ProcessPoolExecutor` to run the
+CPU-bound work in parallel; only the source and the encoded AST (or the
+output) are sent between processes. With the default executor (or any
+`ThreadPoolExecutor`), the AST is encoded while it's being sent to
+codegen.js, as it is by `pipeline.process()`, rather than all at once.
+"""
+
+from .codegen import (
+    STATUS_OK, CodegenError, RequestWriter, WorkerDied, codegen_js_path,
+)
+from .defaults import (
+    CODEGENS, CODEGEN_FORMATS, CODEGEN_PYTHON, DEFAULT_CODEGEN,
+    DEFAULT_CODEGEN_FORMAT, DEFAULT_TEMP_PREFIX, OUTPUT_AST, OUTPUT_JS,
+    OUTPUTS,
+)
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+import asyncio
+import io
+import os
+import struct
+
+
+def run_pipeline(
+    source: str,
+    temp_prefix: str,
+    emit_ast: bool,
+    codegen: str,
+    budget_limits: tuple[Optional[float], Optional[int]],
+) -> str:
+    """Runs the whole pipeline, for outputs that don't need codegen.js."""
+    from .budget import make_budget
+    from .pipeline import process
+    out = io.StringIO()
+    process(
+        source, out,
+        temp_prefix=temp_prefix,
+        emit_ast=emit_ast,
+        codegen=codegen,
+        budget=make_budget(*budget_limits),
+    )
+    return out.getvalue()
+
+
+def transform_source(
+    source: str,
+    temp_prefix: str,
+    budget_limits: tuple[Optional[float], Optional[int]],
+):
+    """Parses and deobfuscates `source`, and returns its AST and whether the
+    budget ran out.
+    """
+    from .budget import make_budget
+    from .pipeline import parse_and_transform
+    ast, state = parse_and_transform(
+        source,
+        temp_prefix=temp_prefix,
+        budget=make_budget(*budget_limits),
+    )
+    return ast, state.budget_exhausted
+
+
+def write_request(ast, codegen_format: str, stream):
+    """Writes a codegen.js request for `ast` to `stream`."""
+    from .pipeline import encode_ast
+    writer = RequestWriter(stream)
+    encode_ast(ast, codegen_format, writer)
+    writer.finish()
+
+
+def make_request(
+    source: str,
+    temp_prefix: str,
+    codegen_format: str,
+    budget_limits: tuple[Optional[float], Optional[int]],
+) -> tuple[bytes, bool]:
+    """Deobfuscates `source` and returns a codegen.js request for its AST,
+    and whether the budget ran out. Used when the work is done in another
+    process.
+    """
+    ast, budget_exhausted = transform_source(
+        source, temp_prefix, budget_limits,
+    )
+    f = io.BytesIO()
+    write_request(ast, codegen_format, f)
+    return f.getvalue(), budget_exhausted
+
+
+class StreamBridge:
+    """A file-like object that can be written to from an executor thread,
+    and writes to an `asyncio.StreamWriter` in the event loop, waiting for it
+    to drain after each write.
+    """
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        stream: asyncio.StreamWriter,
+    ):
+        self.loop = loop
+        self.stream = stream
+
+    def write(self, data: bytes):
+        asyncio.run_coroutine_threadsafe(
+            self.write_async(data), self.loop,
+        ).result()
+
+    async def write_async(self, data: bytes):
+        self.stream.write(data)
+        await self.stream.drain()
+
+    def flush(self):
+        pass
+
+
+class AsyncCodegenWorker:
+    """Like `codegen.CodegenWorker`, but uses asyncio."""
+    def __init__(self):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            "node", codegen_js_path(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+
+    async def close(self):
+        if self.proc is None:
+            return
+        self.proc.stdin.close()
+        await self.proc.wait()
+        self.proc = None
+
+    def kill(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+
+    async def generate(
+        self,
+        write: Callable[[asyncio.StreamWriter], Awaitable[None]],
+    ) -> str:
+        """Generates code for a request. `write` is called with the stdin of
+        codegen.js, and should write the request to it (see
+        `write_request()`). It may be called more than once if codegen.js
+        has to be restarted.
+        """
+        try:
+            return await self.generate_once(write)
+        except WorkerDied:
+            pass
+        await self.close()
+        try:
+            return await self.generate_once(write)
+        except WorkerDied:
+            await self.close()
+            raise CodegenError("codegen.js exited unexpectedly")
+
+    async def generate_once(
+        self,
+        write: Callable[[asyncio.StreamWriter], Awaitable[None]],
+    ) -> str:
+        if self.proc is None or self.proc.returncode is not None:
+            await self.close()
+            await self.start()
+        proc = self.proc
+        try:
+            await write(proc.stdin)
+            status, length = struct.unpack(
+                ">BI", await proc.stdout.readexactly(5),
+            )
+            body = await proc.stdout.readexactly(length)
+        except (
+            BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError,
+        ):
+            raise WorkerDied()
+        except BaseException:
+            # Cancelled (or failed) partway through a request, so the worker
+            # can't be reused.
+            self.kill()
+            raise
+        text = body.decode("utf8")
+        if status != STATUS_OK:
+            raise CodegenError(text)
+        return text
+
+
+class AsyncDeobfuscator:
+    """Deobfuscates code without blocking the event loop. At most
+    `concurrency` calls to `deobfuscate()` run at once (others wait), and up
+    to that many codegen.js processes are started as needed and kept running
+    until `close()` is called. `executor` is used for CPU-bound work; if it's
+    None, the event loop's default executor is used. `codegen_format` is the
+    representation in which ASTs are sent to codegen.js (see
+    `defaults.CODEGEN_FORMATS`). `budget_seconds` and `budget_work` limit
+    the work done for each call, like in `api.Deobfuscator`.
+    """
+    def __init__(
+        self, *,
+        codegen=DEFAULT_CODEGEN,
+        codegen_format=DEFAULT_CODEGEN_FORMAT,
+        concurrency: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        budget_seconds: Optional[float] = None,
+        budget_work: Optional[int] = None,
+    ):
+        if codegen not in CODEGENS:
+            raise ValueError(f"Unknown code generator: {codegen}")
+        if codegen_format not in CODEGEN_FORMATS:
+            raise ValueError(f"Unknown codegen format: {codegen_format}")
+        concurrency = concurrency or os.cpu_count() or 1
+        self.codegen = codegen
+        self.codegen_format = codegen_format
+        self.executor = executor
+        self.budget_limits = (budget_seconds, budget_work)
+        # Whether the executor runs in this process, in which case the AST
+        # doesn't have to be encoded before it's sent to codegen.js.
+        self.in_process = (
+            executor is None or isinstance(executor, ThreadPoolExecutor)
+        )
+        self.all_workers = [AsyncCodegenWorker() for _ in range(concurrency)]
+        # Created by `init_queues()` in the running event loop, as before
+        # Python 3.10, they're bound to the event loop that's current when
+        # they're created.
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        # Idle workers. The most recently used worker is reused first, so
+        # new processes are started only when needed.
+        self.workers: Optional[asyncio.LifoQueue] = None
+
+    def init_queues(self):
+        if self.semaphore is not None:
+            return
+        self.semaphore = asyncio.Semaphore(len(self.all_workers))
+        self.workers = asyncio.LifoQueue()
+        for worker in self.all_workers:
+            self.workers.put_nowait(worker)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        for worker in self.all_workers:
+            await worker.close()
+
+    async def deobfuscate(
+        self,
+        source: str, *,
+        temp_prefix=DEFAULT_TEMP_PREFIX,
+        output=OUTPUT_JS,
+    ) -> str:
+        """Like `api.Deobfuscator.deobfuscate()`."""
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output format: {output}")
+        emit_ast = output == OUTPUT_AST
+        loop = asyncio.get_running_loop()
+        self.init_queues()
+        async with self.semaphore:
+            if emit_ast or self.codegen == CODEGEN_PYTHON:
+                return await loop.run_in_executor(
+                    self.executor, run_pipeline,
+                    source, temp_prefix, emit_ast, self.codegen,
+                    self.budget_limits,
+                )
+            if self.in_process:
+                ast, budget_exhausted = await loop.run_in_executor(
+                    self.executor, transform_source,
+                    source, temp_prefix, self.budget_limits,
+                )
+
+                async def write(stdin: asyncio.StreamWriter):
+                    await loop.run_in_executor(
+                        self.executor, write_request,
+                        ast, self.codegen_format, StreamBridge(loop, stdin),
+                    )
+            else:
+                request, budget_exhausted = await loop.run_in_executor(
+                    self.executor, make_request,
+                    source, temp_prefix, self.codegen_format,
+                    self.budget_limits,
+                )
+
+                async def write(stdin: asyncio.StreamWriter):
+                    stdin.write(request)
+                    await stdin.drain()
+            worker = await self.workers.get()
+            try:
+                code = await worker.generate(write)
+            finally:
+                self.workers.put_nowait(worker)
+        if budget_exhausted:
+            from .pipeline import BUDGET_EXHAUSTED_MARKER
+            code = BUDGET_EXHAUSTED_MARKER + code
+        return code + "\n"
@@ -0,0 +1,133 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""An in-process API for deobfuscating code, for use as a library."""
+
+from .budget import make_budget
+from .codegen import CodegenPool
+from .defaults import (
+    CODEGENS, CODEGEN_PYTHON, DEFAULT_CODEGEN, DEFAULT_TEMP_PREFIX,
+    OUTPUT_AST, OUTPUT_JS, OUTPUTS,
+)
+from .pipeline import process
+
+from typing import Optional
+import atexit
+import io
+import os
+import threading
+
+
+class Deobfuscator:
+    """Deobfuscates code in-process. Safe to use from several threads at
+    once. Up to `workers` codegen.js processes are started as needed (one per
+    concurrent call) and kept running between calls until `close()` is
+    called. `budget_seconds` and `budget_work` limit the work done for each
+    call, like ``--budget`` and ``--work-budget`` (see `budget.Budget`).
+    """
+    def __init__(
+        self, *,
+        codegen=DEFAULT_CODEGEN,
+        workers: Optional[int] = None,
+        budget_seconds: Optional[float] = None,
+        budget_work: Optional[int] = None,
+    ):
+        if codegen not in CODEGENS:
+            raise ValueError(f"Unknown code generator: {codegen}")
+        self.codegen = codegen
+        self.budget_seconds = budget_seconds
+        self.budget_work = budget_work
+        self.pool: Optional[CodegenPool] = None
+        if codegen != CODEGEN_PYTHON:
+            self.pool = CodegenPool(workers or os.cpu_count() or 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def deobfuscate(
+        self,
+        source: str, *,
+        temp_prefix=DEFAULT_TEMP_PREFIX,
+        output=OUTPUT_JS,
+    ) -> str:
+        """Returns the deobfuscated code (if `output` is "js") or the JSON
+        representation of its AST (if `output` is "ast"), exactly as the
+        command-line interface would output it. Raises `esprima.Error` if
+        `source` can't be parsed. If the budget runs out, the code starts with
+        `pipeline.BUDGET_EXHAUSTED_MARKER`, or the AST has a top-level
+        `pipeline.BUDGET_EXHAUSTED_KEY` field set to true.
+        """
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output format: {output}")
+        out = io.StringIO()
+        process(
+            source, out,
+            temp_prefix=temp_prefix,
+            emit_ast=(output == OUTPUT_AST),
+            codegen=self.codegen,
+            worker=self.pool,
+            budget=make_budget(self.budget_seconds, self.budget_work),
+        )
+        return out.getvalue()
+
+
+# Shared `Deobfuscator`s used by `deobfuscate()`, by code generator.
+_deobfuscators: dict[str, Deobfuscator] = {}
+_deobfuscators_lock = threading.Lock()
+
+
+def get_deobfuscator(codegen=DEFAULT_CODEGEN) -> Deobfuscator:
+    with _deobfuscators_lock:
+        deobfuscator = _deobfuscators.get(codegen)
+        if deobfuscator is None:
+            deobfuscator = Deobfuscator(codegen=codegen)
+            _deobfuscators[codegen] = deobfuscator
+        return deobfuscator
+
+
+@atexit.register
+def close():
+    """Stops the codegen.js processes used by `deobfuscate()`. They're
+    started again if needed.
+    """
+    with _deobfuscators_lock:
+        for deobfuscator in _deobfuscators.values():
+            deobfuscator.close()
+        _deobfuscators.clear()
+
+
+def deobfuscate(
+    source: str, *,
+    temp_prefix=DEFAULT_TEMP_PREFIX,
+    output=OUTPUT_JS,
+    codegen=DEFAULT_CODEGEN,
+) -> str:
+    """Deobfuscates `source` (see `Deobfuscator.deobfuscate()`), reusing the
+    same codegen.js processes across calls.
+    """
+    return get_deobfuscator(codegen).deobfuscate(
+        source,
+        temp_prefix=temp_prefix,
+        output=output,
+    )
@@ -0,0 +1,325 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+from .budget import Budget
+from .cache import ResultCache
+from .codegen import CodegenWorker
+from .defaults import (
+    CODEGEN_PYTHON, DEFAULT_CODEGEN_FORMAT, DEFAULT_PARSER, PARSER_NODE,
+    PROFILE_JSON,
+)
+from .pipeline import process
+from .profiling import Profiler, format_report
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+import glob
+import io
+import os
+import os.path
+import sys
+import time
+
+# Files are grouped into chunks of roughly this many bytes (or fewer files,
+# if `CHUNK_MAX_FILES` is reached first), so that small files don't spend
+# most of their time waiting on inter-process communication.
+CHUNK_BYTES = 256 * 1024
+CHUNK_MAX_FILES = 64
+
+
+@dataclass
+class Options:
+    output_dir: str
+    temp_prefix: str
+    emit_ast: bool
+    codegen: str
+    codegen_format: str = DEFAULT_CODEGEN_FORMAT
+    parser: str = DEFAULT_PARSER
+    cache_path: Optional[str] = None
+    cache_size: int = 0
+    # Report format for `profiling.Profiler` statistics, if any.
+    profile: Optional[str] = None
+    # Limits for the `budget.Budget` used for each input, if any.
+    budget_seconds: Optional[float] = None
+    budget_work: Optional[int] = None
+
+    def make_budget(self) -> Optional[Budget]:
+        if self.budget_seconds is None and self.budget_work is None:
+            return None
+        return Budget(seconds=self.budget_seconds, work=self.budget_work)
+
+
+@dataclass
+class Input:
+    path: str
+    # Path of the output file relative to the output directory.
+    relpath: str
+    size: int
+
+
+@dataclass
+class Result:
+    input: Input
+    seconds: float
+    error: Optional[str] = None
+    profile: Optional[dict] = None
+    # Whether the input was only partially deobfuscated.
+    budget_exhausted: bool = False
+
+
+def glob_base(pattern: str) -> str:
+    """Returns the longest leading directory of `pattern` that doesn't
+    contain any wildcards.
+    """
+    parts = []
+    for part in pattern.split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def find_inputs(args: Iterable[str]) -> Iterator[Input]:
+    """Expands files, directories (searched recursively for ``.js`` files),
+    and glob patterns into a list of inputs.
+    """
+    for arg in args:
+        if os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".js"):
+                        path = os.path.join(root, name)
+                        yield make_input(path, os.path.relpath(path, arg))
+        elif glob.has_magic(arg):
+            base = glob_base(arg)
+            for path in sorted(glob.glob(arg, recursive=True)):
+                if os.path.isfile(path):
+                    yield make_input(path, os.path.relpath(path, base))
+        else:
+            yield make_input(arg, os.path.basename(arg))
+
+
+def make_input(path: str, relpath: str) -> Input:
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        # Reported as a failure when the file is processed.
+        size = 0
+    return Input(path=path, relpath=relpath, size=size)
+
+
+def make_chunks(inputs: list[Input]) -> Iterator[list[Input]]:
+    chunk = []
+    size = 0
+    for item in inputs:
+        chunk.append(item)
+        size += item.size
+        if size >= CHUNK_BYTES or len(chunk) >= CHUNK_MAX_FILES:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+# Per-process codegen worker, parse worker, and result cache, reused for
+# every chunk the process handles.
+_worker: Optional[CodegenWorker] = None
+_parse_worker = None
+_cache: Optional[ResultCache] = None
+
+
+def process_chunk(chunk: list[Input], options: Options) -> list[Result]:
+    global _worker, _parse_worker, _cache
+    if _cache is None and options.cache_path is not None:
+        _cache = ResultCache(options.cache_path, options.cache_size)
+    needs_worker = not (options.emit_ast or options.codegen == CODEGEN_PYTHON)
+    if _worker is None and needs_worker:
+        _worker = CodegenWorker(options.codegen_format)
+    if _parse_worker is None and options.parser == PARSER_NODE:
+        from .node_parser import ParseWorker
+        _parse_worker = ParseWorker()
+    return [process_file(item, options) for item in chunk]
+
+
+def close_resources():
+    """Closes this process's codegen worker, parse worker, and result
+    cache.
+    """
+    global _worker, _parse_worker, _cache
+    if _worker is not None:
+        _worker.close()
+        _worker = None
+    if _parse_worker is not None:
+        _parse_worker.close()
+        _parse_worker = None
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+
+
+def init_pool_worker():
+    # Worker processes don't run `atexit` handlers when they're forked, but
+    # they do run multiprocessing's finalizers.
+    from multiprocessing.util import Finalize
+    Finalize(None, close_resources, exitpriority=0)
+
+
+def process_file(item: Input, options: Options) -> Result:
+    start = time.perf_counter()
+    relpath = item.relpath + (".json" if options.emit_ast else "")
+    out_path = os.path.join(options.output_dir, relpath)
+    error = None
+    profiler = None
+    budget_exhausted = False
+    try:
+        with open(item.path, encoding="utf8") as f:
+            source = f.read()
+        output = None
+        if _cache is not None:
+            output = _cache.get(
+                source,
+                temp_prefix=options.temp_prefix,
+                emit_ast=options.emit_ast,
+            )
+        if output is None:
+            out = io.StringIO()
+            if options.profile is not None:
+                profiler = Profiler()
+            with profiler or nullcontext():
+                state = process(
+                    source, out,
+                    temp_prefix=options.temp_prefix,
+                    emit_ast=options.emit_ast,
+                    codegen=options.codegen,
+                    worker=_worker,
+                    parse_worker=_parse_worker,
+                    cache=_cache,
+                    profiler=profiler,
+                    budget=options.make_budget(),
+                )
+            output = out.getvalue()
+            budget_exhausted = state.budget_exhausted
+            if _cache is not None and not budget_exhausted:
+                _cache.put(
+                    source, output,
+                    temp_prefix=options.temp_prefix,
+                    emit_ast=options.emit_ast,
+                )
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "w", encoding="utf8") as f:
+            f.write(output)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+    return Result(
+        input=item,
+        seconds=(time.perf_counter() - start),
+        error=error,
+        profile=(None if profiler is None else profiler.report()),
+        budget_exhausted=budget_exhausted,
+    )
+
+
+def run_batch(
+    args: list[str],
+    options: Options, *,
+    jobs: int,
+    verbose=False,
+) -> bool:
+    """Processes every input in `args`, printing a summary to standard error.
+    Returns whether all inputs were processed successfully.
+    """
+    start = time.perf_counter()
+    inputs = list(find_inputs(args))
+    seen = {}
+    for item in inputs:
+        if item.relpath in seen:
+            print(
+                f"Inputs {seen[item.relpath]} and {item.path} would both be "
+                f"written to {item.relpath}",
+                file=sys.stderr,
+            )
+            return False
+        seen[item.relpath] = item.path
+
+    chunks = list(make_chunks(inputs))
+    results = []
+
+    def report(result: Result):
+        results.append(result)
+        if result.error is not None:
+            print(
+                f"FAILED {result.input.path}: {result.error}",
+                file=sys.stderr,
+            )
+        elif result.budget_exhausted:
+            print(
+                f"partial {result.input.path}: budget exhausted",
+                file=sys.stderr,
+            )
+        elif verbose:
+            print(
+                f"ok {result.input.path} ({result.input.size} bytes, "
+                f"{result.seconds:.3f} s)",
+                file=sys.stderr,
+            )
+        if result.profile is not None:
+            profile = result.profile
+            if options.profile == PROFILE_JSON:
+                profile = dict(path=result.input.path, **profile)
+            else:
+                print(f"Profile for {result.input.path}:", file=sys.stderr)
+            print(format_report(profile, options.profile), file=sys.stderr)
+
+    if jobs <= 1 or len(chunks) <= 1:
+        try:
+            for chunk in chunks:
+                for result in process_chunk(chunk, options):
+                    report(result)
+        finally:
+            close_resources()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_pool_worker,
+        ) as executor:
+            futures = [
+                executor.submit(process_chunk, chunk, options)
+                for chunk in chunks
+            ]
+            for future in futures:
+                for result in future.result():
+                    report(result)
+
+    elapsed = time.perf_counter() - start
+    failed = sum(result.error is not None for result in results)
+    total_bytes = sum(item.size for item in inputs)
+    print(
+        f"{len(results)} files ({total_bytes} bytes) in {elapsed:.2f} s: "
+        f"{len(results) - failed} succeeded, {failed} failed; "
+        f"{len(results) / elapsed:.1f} files/s, "
+        f"{total_bytes / elapsed / 1024:.1f} KiB/s",
+        file=sys.stderr,
+    )
+    return failed == 0
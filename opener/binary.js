@@ -0,0 +1,228 @@
+/*
+ * Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+ *
+ * This file is part of Opener.
+ *
+ * Opener is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Opener is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with Opener. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+// Incremental decoder for the binary representation of ASTs described in
+// to_binary.py. Data can be passed to `push()` in pieces of any size as it's
+// received; once the whole value has been pushed, `finish()` returns it.
+
+const MAGIC = 0;
+
+const TAG_NULL = 0;
+const TAG_TRUE = 1;
+const TAG_FALSE = 2;
+const TAG_INT = 3;
+const TAG_FLOAT = 4;
+const TAG_STRING = 5;
+const TAG_STRING_UTF16 = 6;
+const TAG_NEW_STRING = 7;
+const TAG_STRING_REF = 8;
+const TAG_LIST = 9;
+const TAG_NEW_OBJECT = 10;
+const TAG_OBJECT = 11;
+
+// Thrown when the buffered data ends in the middle of a value. Decoding
+// resumes from the start of the value once more data is pushed.
+const INCOMPLETE = Symbol("incomplete");
+
+// Returned by `readValue()` when it starts decoding a non-empty list or
+// object, whose items are decoded as separate values.
+const CONTAINER = Symbol("container");
+
+class Decoder {
+    constructor() {
+        this.buffer = Buffer.alloc(0);
+        this.offset = 0;
+        this.started = false;
+        this.strings = [];
+        this.shapes = [];
+        // Lists and objects whose items are being decoded. Each frame has
+        // the list or object, its keys (null for lists), the index of the
+        // next item, and the number of items.
+        this.stack = [];
+        this.done = false;
+        this.result = undefined;
+    }
+
+    push(data) {
+        if (this.offset < this.buffer.length) {
+            this.buffer = Buffer.concat([
+                this.buffer.subarray(this.offset),
+                data,
+            ]);
+        } else {
+            this.buffer = data;
+        }
+        this.offset = 0;
+        if (!this.started && this.buffer.length > 0) {
+            if (this.buffer[0] !== MAGIC) {
+                throw new Error("Not a binary AST");
+            }
+            this.offset = 1;
+            this.started = true;
+        }
+        while (!this.done && this.offset < this.buffer.length) {
+            const start = this.offset;
+            let value;
+            try {
+                value = this.readValue();
+            } catch (e) {
+                if (e === INCOMPLETE) {
+                    this.offset = start;
+                    return;
+                }
+                throw e;
+            }
+            if (value !== CONTAINER) {
+                this.add(value);
+            }
+        }
+        if (this.done && this.offset < this.buffer.length) {
+            throw new Error("Unexpected data after binary AST");
+        }
+    }
+
+    finish() {
+        if (!this.done) {
+            throw new Error("Incomplete binary AST");
+        }
+        return this.result;
+    }
+
+    // Adds a decoded value to the innermost list or object.
+    add(value) {
+        const stack = this.stack;
+        while (stack.length > 0) {
+            const frame = stack[stack.length - 1];
+            if (frame.keys === null) {
+                frame.value[frame.index] = value;
+            } else {
+                frame.value[frame.keys[frame.index]] = value;
+            }
+            frame.index += 1;
+            if (frame.index < frame.length) {
+                return;
+            }
+            stack.pop();
+            value = frame.value;
+        }
+        this.result = value;
+        this.done = true;
+    }
+
+    // Reads a value, or the start of a list or object. Nothing is changed
+    // until the whole value (or start) has been read, so that decoding can
+    // be resumed if `INCOMPLETE` is thrown.
+    readValue() {
+        switch (this.readByte()) {
+            case TAG_NULL:
+                return null;
+            case TAG_TRUE:
+                return true;
+            case TAG_FALSE:
+                return false;
+            case TAG_INT:
+                return this.readVarint();
+            case TAG_FLOAT: {
+                this.need(8);
+                const value = this.buffer.readDoubleBE(this.offset);
+                this.offset += 8;
+                return value;
+            }
+            case TAG_STRING:
+                return this.readString("utf8");
+            case TAG_STRING_UTF16:
+                return this.readString("utf16le");
+            case TAG_NEW_STRING: {
+                const value = this.readString("utf8");
+                this.strings.push(value);
+                return value;
+            }
+            case TAG_STRING_REF:
+                return this.lookup(this.strings, this.readVarint());
+            case TAG_LIST: {
+                const length = this.readVarint();
+                return this.start(new Array(length), null, length);
+            }
+            case TAG_NEW_OBJECT: {
+                const length = this.readVarint();
+                const keys = [];
+                for (let i = 0; i < length; i++) {
+                    keys.push(this.readString("utf8"));
+                }
+                this.shapes.push(keys);
+                return this.start({}, keys, length);
+            }
+            case TAG_OBJECT: {
+                const keys = this.lookup(this.shapes, this.readVarint());
+                return this.start({}, keys, keys.length);
+            }
+            default:
+                throw new Error("Invalid tag in binary AST");
+        }
+    }
+
+    start(value, keys, length) {
+        if (length === 0) {
+            return value;
+        }
+        this.stack.push({value, keys, index: 0, length});
+        return CONTAINER;
+    }
+
+    lookup(table, index) {
+        if (index >= table.length) {
+            throw new Error("Invalid reference in binary AST");
+        }
+        return table[index];
+    }
+
+    need(length) {
+        if (this.buffer.length - this.offset < length) {
+            throw INCOMPLETE;
+        }
+    }
+
+    readByte() {
+        this.need(1);
+        return this.buffer[this.offset++];
+    }
+
+    readVarint() {
+        let value = 0;
+        let scale = 1;
+        for (;;) {
+            const byte = this.readByte();
+            value += (byte & 0x7f) * scale;
+            if (byte < 0x80) {
+                return value;
+            }
+            scale *= 0x80;
+        }
+    }
+
+    readString(encoding) {
+        const length = this.readVarint();
+        this.need(length);
+        const start = this.offset;
+        this.offset += length;
+        return this.buffer.toString(encoding, start, this.offset);
+    }
+}
+
+module.exports = {MAGIC, Decoder};
@@ -0,0 +1,91 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Limits on the work done by a transformation (``--budget``).
+
+Some inputs (like very long sequence expressions or deeply nested
+conditionals) make `transformations.Unsequence` do a lot of work. Once a
+`Budget` runs out, `Unsequence` stops at the next statement boundary, which
+always leaves a valid tree, and the rest of the tree is visited only by the
+passes that do a bounded amount of work per node (see `Pass.budgeted`). The
+result is equivalent to the input, but only partially deobfuscated.
+"""
+
+from typing import Optional
+import time
+
+# `Budget.spend()` only checks the clock after this many units of work.
+CHECK_INTERVAL = 1024
+
+
+class Budget:
+    """A limit on the wall-clock time (`seconds`) and number of units of work
+    (`work`) a transformation can use. Each node visited and each statement
+    processed by `Unsequence` (including nested statements) is one unit of
+    work. Time is counted from the first call to `start()`, so a budget can
+    span several calls to `transform()` (as in streaming mode). A budget
+    can't be reused once it's exhausted.
+    """
+    def __init__(
+        self, *,
+        seconds: Optional[float] = None,
+        work: Optional[int] = None,
+    ):
+        self.seconds = seconds
+        self.work = work
+        self.deadline: Optional[float] = None
+        self.used = 0
+        # The value of `used` at which the limits are next checked.
+        self.next_check = 0
+        self.exhausted = False
+
+    def start(self):
+        if self.deadline is None and self.seconds is not None:
+            self.deadline = time.monotonic() + self.seconds
+        self.check()
+
+    def spend(self, units=1) -> bool:
+        """Records `units` units of work. Returns whether the budget is
+        exhausted.
+        """
+        self.used += units
+        if self.used < self.next_check:
+            return self.exhausted
+        return self.check()
+
+    def check(self) -> bool:
+        """Returns whether the budget is exhausted."""
+        if self.exhausted:
+            return True
+        if self.work is not None and self.used >= self.work:
+            self.exhausted = True
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.exhausted = True
+        self.next_check = self.used + CHECK_INTERVAL
+        if self.work is not None:
+            self.next_check = min(self.next_check, self.work)
+        return self.exhausted
+
+
+def make_budget(
+    seconds: Optional[float],
+    work: Optional[int],
+) -> Optional[Budget]:
+    """Returns a `Budget` with the given limits, or None if there are none."""
+    if seconds is None and work is None:
+        return None
+    return Budget(seconds=seconds, work=work)
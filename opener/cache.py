@@ -0,0 +1,251 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""An on-disk cache of finished outputs (and of transformed function bodies,
+see `fragments`), stored in an SQLite database so that several processes can
+share it.
+"""
+
+from .defaults import DEFAULT_CACHE_SIZE_MIB
+
+from typing import Optional
+import hashlib
+import os
+import os.path
+import sqlite3
+import time
+
+DEFAULT_CACHE_SIZE = DEFAULT_CACHE_SIZE_MIB * 1024 * 1024
+
+# How long to wait for another process to release the database.
+LOCK_TIMEOUT = 30
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS fragments (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fragments_last_used ON fragments (last_used);
+CREATE TABLE IF NOT EXISTS metadata (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Both tables share the cache's size limit.
+TABLES = ["results", "fragments"]
+
+# The total size of the entries in both tables is kept in this row of
+# `metadata`, and updated by triggers (so that it stays correct when any
+# process changes the tables), rather than summed up whenever an entry is
+# stored.
+TOTAL_SIZE = "total_size"
+
+SIZE_TRIGGERS = "".join(f"""\
+CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {table} BEGIN
+    UPDATE metadata SET value = value + new.size WHERE name = '{TOTAL_SIZE}';
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {table} BEGIN
+    UPDATE metadata SET value = value - old.size WHERE name = '{TOTAL_SIZE}';
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF size ON {table}
+BEGIN
+    UPDATE metadata SET value = value + new.size - old.size
+    WHERE name = '{TOTAL_SIZE}';
+END;
+""" for table in TABLES)
+
+SUM_SIZES = " + ".join(
+    f"(SELECT COALESCE(SUM(size), 0) FROM {table})" for table in TABLES
+)
+
+# Creates the running total (for databases created before it existed) and
+# the triggers that update it, in the same transaction.
+INIT_TOTAL_SIZE = f"""\
+BEGIN IMMEDIATE;
+INSERT OR IGNORE INTO metadata VALUES ('{TOTAL_SIZE}', {SUM_SIZES});
+{SIZE_TRIGGERS}COMMIT;
+"""
+
+# The last access time of an entry is only updated when it's looked up if
+# it's older than this many seconds, so most lookups don't write to the
+# database.
+TOUCH_INTERVAL = 60
+
+_code_version: Optional[str] = None
+
+
+def code_version() -> str:
+    """Returns a hash of Opener's own code, so that cached results are
+    invalidated whenever Opener changes.
+    """
+    global _code_version
+    if _code_version is not None:
+        return _code_version
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".py", ".js")):
+            digest.update(name.encode("utf8") + b"\0")
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+    _code_version = digest.hexdigest()
+    return _code_version
+
+
+def make_key(source: str, *, temp_prefix: str, emit_ast: bool) -> str:
+    digest = hashlib.sha256()
+    for part in [
+        code_version(),
+        "ast" if emit_ast else "js",
+        temp_prefix,
+    ]:
+        digest.update(part.encode("utf8") + b"\0")
+    digest.update(source.encode("utf8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """A cache of finished outputs and fragments, bounded by `max_size` (the
+    total size of the cached data in bytes). The least recently used entries
+    are evicted first.
+    """
+    def __init__(self, path: str, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Transactions are managed explicitly.
+            self.conn = sqlite3.connect(
+                self.path,
+                timeout=LOCK_TIMEOUT,
+                isolation_level=None,
+            )
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # Rows deleted by ``INSERT OR REPLACE`` only fire delete triggers
+            # with this enabled.
+            self.conn.execute("PRAGMA recursive_triggers=ON")
+            self.conn.executescript(SCHEMA)
+            self.conn.executescript(INIT_TOTAL_SIZE)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def get(
+        self, source: str, *, temp_prefix: str, emit_ast: bool,
+    ) -> Optional[str]:
+        """Returns the cached output for `source`, or None."""
+        key = make_key(source, temp_prefix=temp_prefix, emit_ast=emit_ast)
+        return self.lookup("results", "output", key)
+
+    def put(
+        self, source: str, output: str, *, temp_prefix: str, emit_ast: bool,
+    ):
+        """Stores the output for `source`, evicting old entries if the cache
+        exceeds its maximum size.
+        """
+        key = make_key(source, temp_prefix=temp_prefix, emit_ast=emit_ast)
+        size = len(output.encode("utf8", "surrogatepass"))
+        self.store("results", [(key, output, size)])
+
+    def get_fragment(self, key: str) -> Optional[bytes]:
+        return self.lookup("fragments", "data", key)
+
+    def put_fragments(self, fragments: list[tuple[str, bytes]]):
+        """Stores several fragments (pairs of keys and data) in a single
+        transaction.
+        """
+        self.store("fragments", [
+            (key, data, len(data)) for key, data in fragments
+        ])
+
+    def lookup(self, table: str, column: str, key: str):
+        conn = self.connect()
+        row = conn.execute(
+            f"SELECT {column}, last_used FROM {table} WHERE key = ?", (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        value, last_used = row
+        now = time.time()
+        if now - last_used >= TOUCH_INTERVAL:
+            conn.execute(
+                f"UPDATE {table} SET last_used = ? WHERE key = ?",
+                (now, key),
+            )
+        return value
+
+    def store(self, table: str, rows: list[tuple]):
+        now = time.time()
+        rows = [row + (now,) for row in rows if row[2] <= self.max_size]
+        if not rows:
+            return
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)", rows,
+            )
+            self.evict(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def evict(self, conn: sqlite3.Connection):
+        total = conn.execute(
+            "SELECT value FROM metadata WHERE name = ?", (TOTAL_SIZE,),
+        ).fetchone()[0]
+        excess = total - self.max_size
+        if excess <= 0:
+            return
+        rows = conn.execute(" UNION ALL ".join(
+            f"SELECT '{table}', key, size, last_used FROM {table}"
+            for table in TABLES
+        ) + " ORDER BY last_used")
+        keys = {table: [] for table in TABLES}
+        for table, key, size, last_used in rows:
+            if excess <= 0:
+                break
+            keys[table].append((key,))
+            excess -= size
+        for table in TABLES:
+            conn.executemany(f"DELETE FROM {table} WHERE key = ?", keys[table])
@@ -18,6 +18,59 @@
  * along with Opener. If not, see <https://www.gnu.org/licenses/>.
  */
 
+// Long-lived code generation worker. Each request (framed as described in
+// worker.js) is an AST, either JSON-encoded or in the binary representation
+// described in to_binary.py, which is decoded as it's received. Each
+// successful response is the generated code. Failed responses contain an
+// error message.
+
 const escodegen = require("escodegen");
-const fs = require("fs");
-console.log(escodegen.generate(JSON.parse(fs.readFileSync(0, "utf8"))));
+const {MAGIC, Decoder} = require("./binary");
+const {STATUS_OK, STATUS_ERROR, respond, serveChunks} = require("./worker");
+
+// The state of the current request: the chunks of a JSON request, or the
+// decoder for a binary request, and the error thrown while decoding, if any.
+let chunks = [];
+let decoder = null;
+let error = null;
+
+function handleChunk(chunk) {
+    if (error !== null) {
+        return;
+    }
+    if (decoder === null && chunks.length === 0 && chunk[0] === MAGIC) {
+        decoder = new Decoder();
+    }
+    if (decoder === null) {
+        chunks.push(chunk);
+        return;
+    }
+    try {
+        decoder.push(chunk);
+    } catch (e) {
+        error = e;
+    }
+}
+
+function handleEnd() {
+    let code;
+    try {
+        if (error !== null) {
+            throw error;
+        }
+        const ast = decoder !== null ? decoder.finish() : JSON.parse(
+            Buffer.concat(chunks).toString("utf8"),
+        );
+        code = escodegen.generate(ast);
+    } catch (e) {
+        respond(STATUS_ERROR, String(e && e.stack || e));
+        return;
+    } finally {
+        chunks = [];
+        decoder = null;
+        error = null;
+    }
+    respond(STATUS_OK, code);
+}
+
+serveChunks(handleChunk, handleEnd);
@@ -0,0 +1,212 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+from .defaults import DEFAULT_CODEGEN_FORMAT
+
+from typing import Callable, Optional, TextIO, Union
+import os.path
+import queue
+import struct
+import subprocess
+
+# Size at which buffered request data is sent to the worker as a chunk.
+CHUNK_SIZE = 1 << 16
+
+STATUS_OK = 0
+
+
+def script_path(name: str) -> str:
+    # Opener isn't distributed as a zipped package, so its Node.js scripts
+    # are always ordinary files next to this one.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(directory, name)
+
+
+def codegen_js_path() -> str:
+    return script_path("codegen.js")
+
+
+class CodegenError(Exception):
+    pass
+
+
+class WorkerDied(Exception):
+    pass
+
+
+class RequestWriter:
+    """File-like object that sends text (encoded as UTF-8) or bytes written to
+    it to a Node.js worker, framed as described in ``worker.js``.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode("utf8")
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_SIZE:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        data = b"".join(self.buffer)
+        self.buffer.clear()
+        self.size = 0
+        if data:
+            self.stream.write(struct.pack(">I", len(data)))
+            self.stream.write(data)
+
+    def finish(self):
+        self.flush_chunk()
+        self.stream.write(struct.pack(">I", 0))
+        self.stream.flush()
+
+
+class NodeWorker:
+    """A long-lived Node.js process running one of Opener's scripts (see
+    ``worker.js``), which can handle many requests. The process is started
+    lazily and restarted if it exits.
+    """
+    # The name of the script.
+    script = ""
+    # The exception raised if the process keeps exiting.
+    error_class: type[Exception] = Exception
+
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            ["node", script_path(self.script)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
+
+    def request(self, write: Callable[[TextIO], None]) -> tuple[int, str]:
+        """Sends a request and returns the status and payload of the
+        response. `write` is called with a file-like object and should write
+        the payload of the request to it. It may be called more than once if
+        the worker has to be restarted.
+        """
+        try:
+            return self.request_once(write)
+        except WorkerDied:
+            pass
+        self.close()
+        try:
+            return self.request_once(write)
+        except WorkerDied:
+            self.close()
+            raise self.error_class(f"{self.script} exited unexpectedly")
+
+    def request_once(self, write: Callable[[TextIO], None]) -> tuple[int, str]:
+        if self.proc is None or self.proc.poll() is not None:
+            self.close()
+            self.start()
+        try:
+            writer = RequestWriter(self.proc.stdin)
+            write(writer)
+            writer.finish()
+        except BrokenPipeError:
+            raise WorkerDied()
+        except BaseException:
+            # The worker has received a partial request; it can't be reused.
+            self.proc.kill()
+            self.close()
+            raise
+
+        header = self.proc.stdout.read(5)
+        if len(header) < 5:
+            raise WorkerDied()
+        status, length = struct.unpack(">BI", header)
+        body = self.proc.stdout.read(length)
+        if len(body) < length:
+            raise WorkerDied()
+        return status, body.decode("utf8")
+
+
+class CodegenWorker(NodeWorker):
+    """A long-lived ``node codegen.js`` process that can generate code for
+    many ASTs. `codegen_format` is the representation in which ASTs should be
+    sent to it (see `defaults.CODEGEN_FORMATS`).
+    """
+    script = "codegen.js"
+    error_class = CodegenError
+
+    def __init__(self, codegen_format=DEFAULT_CODEGEN_FORMAT):
+        super().__init__()
+        self.codegen_format = codegen_format
+
+    def generate(self, write_ast: Callable[[TextIO], None]) -> str:
+        """Generates code for an AST. `write_ast` is called with a file-like
+        object and should write the JSON or binary representation of the AST
+        (see ``to_binary.py``) to it. It may be called more than once if the
+        worker has to be restarted.
+        """
+        status, text = self.request(write_ast)
+        if status != STATUS_OK:
+            raise CodegenError(text)
+        return text
+
+
+class CodegenPool:
+    """A thread-safe pool of `CodegenWorker` objects."""
+    def __init__(self, size: int, codegen_format=DEFAULT_CODEGEN_FORMAT):
+        self.codegen_format = codegen_format
+        self.workers = queue.LifoQueue()
+        self.all_workers = []
+        for _ in range(size):
+            worker = CodegenWorker(codegen_format)
+            self.all_workers.append(worker)
+            self.workers.put(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for worker in self.all_workers:
+            worker.close()
+
+    def generate(self, write_ast: Callable[[TextIO], None]) -> str:
+        worker = self.workers.get()
+        try:
+            return worker.generate(write_ast)
+        finally:
+            self.workers.put(worker)
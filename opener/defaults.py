@@ -16,3 +16,38 @@
 # along with Opener. If not, see <https://www.gnu.org/licenses/>.
 
 DEFAULT_TEMP_PREFIX = "_t"
+
+# Code generators that can be used to print the deobfuscated AST.
+CODEGEN_ESCODEGEN = "escodegen"
+CODEGEN_PYTHON = "python"
+CODEGENS = [CODEGEN_ESCODEGEN, CODEGEN_PYTHON]
+DEFAULT_CODEGEN = CODEGEN_ESCODEGEN
+
+# Representations in which ASTs can be sent to codegen.js.
+CODEGEN_FORMAT_JSON = "json"
+CODEGEN_FORMAT_BINARY = "binary"
+CODEGEN_FORMATS = [CODEGEN_FORMAT_JSON, CODEGEN_FORMAT_BINARY]
+DEFAULT_CODEGEN_FORMAT = CODEGEN_FORMAT_JSON
+
+# Parsers that can be used to parse the input.
+PARSER_PYTHON = "python"
+PARSER_NODE = "node"
+PARSERS = [PARSER_PYTHON, PARSER_NODE]
+DEFAULT_PARSER = PARSER_PYTHON
+
+# Maximum total size of the outputs in a result cache, in MiB.
+DEFAULT_CACHE_SIZE_MIB = 256
+
+# Formats for `--profile` reports.
+PROFILE_TEXT = "text"
+PROFILE_JSON = "json"
+PROFILE_FORMATS = [PROFILE_TEXT, PROFILE_JSON]
+
+# Output formats for `api.deobfuscate()`.
+OUTPUT_JS = "js"
+OUTPUT_AST = "ast"
+OUTPUTS = [OUTPUT_JS, OUTPUT_AST]
+
+# Limits for each request handled by the server (``--serve``).
+DEFAULT_MAX_SIZE_MIB = 16
+DEFAULT_TIMEOUT = 60
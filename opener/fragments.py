@@ -0,0 +1,145 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Caching of transformed function bodies ("fragments"), so that when a new
+version of a bundle is processed, only the functions that changed need to be
+transformed again.
+
+A function body is transformed in pre-order without affecting anything
+outside it, and the temporaries it creates are numbered consecutively,
+starting after those created before it. So while it's transformed, its
+temporaries are numbered from 1 with `transformations.TEMP_PREFIX`; when it's
+stored or loaded, they're renumbered to follow the temporaries before it. The
+output is the same as without the cache.
+
+Fragments are stored as JSON (the body in the format of `write_json()`), not
+pickled, so a cache database written by someone else can't make Opener run
+arbitrary code.
+"""
+
+from .cache import ResultCache, code_version
+from .nodes import CLASSES, Node
+from .to_json import write_json
+from .transformations import BlockStats
+
+from typing import Optional
+import hashlib
+import io
+import json
+
+# Function bodies whose JSON representation is smaller than this aren't worth
+# caching.
+MIN_FRAGMENT_SIZE = 4096
+
+
+class Fragment:
+    def __init__(
+        self,
+        body: list[Node],
+        temporaries: int,
+        block_stats: list[BlockStats],
+    ):
+        # The statements in the transformed function body.
+        self.body = body
+        # The number of temporaries created while transforming it.
+        self.temporaries = temporaries
+        self.block_stats = block_stats
+
+
+class HashWriter:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text: str):
+        self.size += len(text)
+        self.digest.update(text.encode("utf8", "surrogatepass"))
+
+
+def encode_fragment(fragment: Fragment) -> bytes:
+    out = io.StringIO()
+    write_json({
+        "temporaries": fragment.temporaries,
+        "blockStats": [vars(stats) for stats in fragment.block_stats],
+        "body": fragment.body,
+    }, out)
+    return out.getvalue().encode("ascii")
+
+
+def decode_fragment(data: bytes) -> Fragment:
+    """Decodes a fragment stored by `encode_fragment()`. Raises
+    `RecursionError` if its nodes are nested too deeply.
+    """
+    from .node_parser import fix_regex_literal, fix_template_element, make_node
+
+    # Unlike the JSON sent by parse.js, every number is written exactly, so
+    # only values JSON can't represent need to be recreated.
+    fixes = {
+        CLASSES["RegexLiteral"]: fix_regex_literal,
+        CLASSES["TemplateElement"]: fix_template_element,
+    }
+    obj = json.loads(data, object_hook=lambda obj: make_node(obj, fixes))
+    return Fragment(
+        obj["body"],
+        obj["temporaries"],
+        [BlockStats(**stats) for stats in obj["blockStats"]],
+    )
+
+
+class FragmentCache:
+    """Looks up and stores fragments in a `ResultCache`. New fragments are
+    stored when `flush()` is called.
+    """
+    def __init__(self, cache: ResultCache):
+        self.cache = cache
+        self.pending: list[tuple[str, bytes]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, body: Node) -> Optional[str]:
+        """Returns the key for a function body (before it's transformed), or
+        None if it's too small to cache.
+        """
+        writer = HashWriter()
+        writer.digest.update(code_version().encode("utf8") + b"\0")
+        write_json(body, writer)
+        if writer.size < MIN_FRAGMENT_SIZE:
+            return None
+        return writer.digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Fragment]:
+        data = self.cache.get_fragment(key)
+        if data is None:
+            self.misses += 1
+            return None
+        try:
+            fragment = decode_fragment(data)
+        except RecursionError:
+            # Too deeply nested to decode; it's transformed again instead.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fragment
+
+    def put(self, key: str, **kwargs):
+        """Stores a `Fragment`, created with the given arguments."""
+        self.pending.append((key, encode_fragment(Fragment(**kwargs))))
+
+    def flush(self):
+        if self.pending:
+            self.cache.put_fragments(self.pending)
+            self.pending.clear()
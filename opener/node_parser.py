@@ -0,0 +1,202 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Parsing in Node.js (``--parser=node``).
+
+esprima-python is a port of esprima, which runs much faster in Node.js. A
+`ParseWorker` sends the source to a long-lived ``node parse.js`` process and
+builds compact nodes from the JSON representation of the AST it sends back.
+The tree is the same as the one `nodes.parse()` returns, except for the class
+of a few nodes that esprima reinterprets in place (like an `ArrayExpression`
+that turns out to be an `ArrayPattern`), which have the same type and fields
+either way.
+"""
+
+from .codegen import STATUS_OK, NodeWorker
+from .nodes import CLASSES, Node
+from .to_json import KEY_MAP
+
+from esprima.error_handler import Error, ErrorHandler
+from esprima.nodes import TemplateElement
+from esprima.scanner import RegExp, Scanner
+import json
+import re
+
+# The JSON key of each field of each class.
+JSON_KEYS = {
+    cls: tuple((name, KEY_MAP.get(name, name)) for name in cls.fields)
+    for cls in CLASSES.values()
+}
+
+# Types whose class depends on whether the node is async.
+ASYNC_CLASSES = {
+    "FunctionDeclaration": CLASSES["AsyncFunctionDeclaration"],
+    "FunctionExpression": CLASSES["AsyncFunctionExpression"],
+    "ArrowFunctionExpression": CLASSES["AsyncArrowFunctionExpression"],
+}
+
+# Types whose class depends on other fields (see `node_class()`).
+AMBIGUOUS_TYPES = frozenset([
+    *ASYNC_CLASSES,
+    "MemberExpression",
+    "Literal",
+    "ExpressionStatement",
+])
+
+# Maps every other type to its class.
+TYPE_CLASSES = {
+    **{
+        name: cls for name, cls in CLASSES.items()
+        if name not in AMBIGUOUS_TYPES
+    },
+    "LogicalExpression": CLASSES["BinaryExpression"],
+    "Program": CLASSES["Script"],
+}
+
+# Numbers with these prefixes are integers, and esprima-python's values for
+# them are exact, even if they're too large to be represented as doubles.
+INTEGER_BASES = {"0x": 16, "0o": 8, "0b": 2}
+
+# Legacy octal literals (like ``017``), whose values are exact too.
+LEGACY_OCTAL_REGEX = re.compile(r"0[0-7]+")
+
+
+class ParserError(Exception):
+    pass
+
+
+def node_class(obj: dict) -> type:
+    node_type = obj["type"]
+    if obj.get("async"):
+        return ASYNC_CLASSES[node_type]
+    if node_type == "MemberExpression":
+        if obj["computed"]:
+            return CLASSES["ComputedMemberExpression"]
+        return CLASSES["StaticMemberExpression"]
+    if node_type == "Literal" and "regex" in obj:
+        return CLASSES["RegexLiteral"]
+    if node_type == "ExpressionStatement" and "directive" in obj:
+        return CLASSES["Directive"]
+    return CLASSES[node_type]
+
+
+def number_value(value, raw: str):
+    """Converts the value of a numeric literal to the one esprima-python
+    would produce.
+    """
+    if value is None:
+        # JSON can't represent infinity (e.g., ``1e999``).
+        return float("inf")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int) or value < 2 ** 53:
+        return value
+    base = INTEGER_BASES.get(raw[:2].lower())
+    if base is not None:
+        return int(raw[2:], base)
+    if LEGACY_OCTAL_REGEX.fullmatch(raw):
+        return int(raw, 8)
+    # Other literals are converted to doubles, and JSON contains the shortest
+    # decimal representation of the double (like ``123456789012345680000``),
+    # but esprima-python's value is the double's exact value.
+    return int(float(value))
+
+
+def regex_value(pattern: str, flags: str):
+    """Returns the value esprima-python gives a regex literal: the compiled
+    pattern, or None if Python can't compile it (in which case esprima-python
+    would have failed to parse the script).
+    """
+    scanner = Scanner("", ErrorHandler())
+    try:
+        return scanner.testRegExp(pattern, flags)
+    except Error:
+        return None
+
+
+def fix_literal(node: Node, obj: dict):
+    value = node.value
+    if type(value) in (int, float) or value is None and node.raw != "null":
+        node.value = number_value(value, node.raw)
+
+
+def fix_regex_literal(node: Node, obj: dict):
+    regex = obj["regex"]
+    node.regex = RegExp(pattern=regex["pattern"], flags=regex["flags"])
+    node.value = regex_value(regex["pattern"], regex["flags"])
+
+
+def fix_template_element(node: Node, obj: dict):
+    value = obj["value"]
+    node.value = TemplateElement.Value(value["raw"], value["cooked"])
+
+
+# Functions that convert fields of these classes to the values that
+# esprima-python would produce.
+FIXES = {
+    CLASSES["Literal"]: fix_literal,
+    CLASSES["RegexLiteral"]: fix_regex_literal,
+    CLASSES["TemplateElement"]: fix_template_element,
+}
+
+
+def make_node(obj: dict, fixes=FIXES):
+    node_type = obj.get("type")
+    if node_type is None:
+        # Not a node (e.g., the `regex` field of a regex literal).
+        return obj
+    cls = TYPE_CLASSES.get(node_type)
+    if cls is None:
+        cls = node_class(obj)
+    node = cls.__new__(cls)
+    node._analysis = None
+    for name, key in JSON_KEYS[cls]:
+        if key in obj:
+            setattr(node, name, obj[key])
+    fix = fixes.get(cls)
+    if fix is not None:
+        fix(node, obj)
+    return node
+
+
+def from_json(text: str) -> Node:
+    """Builds a compact AST from the JSON representation of an esprima AST."""
+    return json.loads(text, object_hook=make_node)
+
+
+class ParseWorker(NodeWorker):
+    """A long-lived ``node parse.js`` process that can parse many scripts."""
+    script = "parse.js"
+    error_class = ParserError
+
+    def parse(self, source: str) -> Node:
+        """Parses a script and returns its compact AST, like `nodes.parse()`.
+        Raises `esprima.Error` if the script can't be parsed.
+        """
+        status, text = self.request(lambda f: f.write(source))
+        if status == STATUS_OK:
+            return from_json(text)
+        if not text.startswith("{"):
+            raise ParserError(text)
+        error = json.loads(text)
+        raise Error(
+            error["message"],
+            index=error["index"],
+            lineNumber=error["lineNumber"],
+            column=error["column"],
+            description=error["description"],
+        )
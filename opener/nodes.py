@@ -0,0 +1,315 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""A compact representation of esprima's AST.
+
+esprima's nodes store their fields in a per-instance ``__dict__``. The nodes
+here have the same classes, names, and fields, but use ``__slots__``, which
+makes them several times smaller and faster to access. Each class also lists
+its fields in a fixed order (`fields`, the order in which esprima sets them,
+which is also the order of the keys in the JSON representation) and the
+fields that can contain child nodes (`child_fields`), along with a getter
+that reads all of those at once (`child_values`). Every traversal of a tree
+uses these tables and an explicit stack (see `child_nodes()` and `walk()`),
+so deeply nested trees don't exceed the recursion limit.
+"""
+
+from esprima import nodes as esprima_nodes
+from esprima.nodes import Node as EsprimaNode
+from esprima.parser import Parser
+from esprima.token import Token
+from operator import attrgetter
+from typing import Callable, Iterable, Iterator, Optional
+import esprima
+
+# Fields that never contain nodes.
+SCALAR_FIELDS = frozenset([
+    "type",
+    "name",
+    "operator",
+    "raw",
+    "kind",
+    "computed",
+    "shorthand",
+    "method",
+    "static",
+    "generator",
+    "isAsync",
+    "prefix",
+    "delegate",
+    "directive",
+    "sourceType",
+    "tail",
+    "regex",
+    "each",
+])
+
+# Fields that contain nodes in other classes, but not in these.
+SCALAR_CLASS_FIELDS = {
+    "Literal": ["value"],
+    "RegexLiteral": ["value"],
+    "TemplateElement": ["value"],
+    "BlockComment": ["value"],
+    "LineComment": ["value"],
+    "ArrowFunctionExpression": ["expression"],
+    "AsyncArrowFunctionExpression": ["expression"],
+}
+
+
+class Node:
+    __slots__ = ("type", "_analysis")
+    # The names of the fields, in order.
+    fields: tuple[str, ...] = ()
+    # The names of the fields that can contain nodes or lists of nodes.
+    child_fields: tuple[str, ...] = ()
+    # Returns a tuple of the values of `child_fields` (or None if there are
+    # none).
+    child_values: Optional[Callable] = None
+
+    # Like esprima's nodes, missing attributes are None.
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+    def items(self):
+        get = object.__getattribute__
+        for name in self.fields:
+            try:
+                yield name, get(self, name)
+            except AttributeError:
+                # esprima deletes fields in some cases (e.g., `operator`,
+                # when an assignment is reinterpreted as a pattern).
+                pass
+
+    def keys(self):
+        return [name for name, _ in self.items()]
+
+
+def make_class(esprima_cls: type) -> type:
+    init = esprima_cls.__init__
+    num_args = init.__code__.co_argcount - 1
+    placeholder = object()
+    # Create an instance to find the fields and the order they're set in.
+    instance = esprima_cls.__new__(esprima_cls)
+    init(instance, *([placeholder] * num_args))
+    fields = tuple(instance.__dict__)
+    name = esprima_cls.__name__
+    scalar = SCALAR_CLASS_FIELDS.get(name, [])
+    child_fields = tuple(
+        field for field, value in instance.__dict__.items()
+        # Fields set to constants aren't child fields.
+        if value is placeholder and
+        field not in SCALAR_FIELDS and
+        field not in scalar
+    )
+
+    def __init__(self, *args, **kwargs):
+        self._analysis = None
+        init(self, *args, **kwargs)
+
+    child_values = None
+    if len(child_fields) == 1:
+        get = attrgetter(child_fields[0])
+        child_values = staticmethod(lambda node: (get(node),))
+    elif child_fields:
+        child_values = staticmethod(attrgetter(*child_fields))
+
+    return type(name, (Node,), {
+        "__slots__": tuple(field for field in fields if field != "type"),
+        "__init__": __init__,
+        "__module__": __name__,
+        "fields": fields,
+        "child_fields": child_fields,
+        "child_values": child_values,
+    })
+
+
+# Maps class names to the compact class for each esprima node class.
+CLASSES: dict[str, type] = {
+    cls.__name__: make_class(cls)
+    for cls in vars(esprima_nodes).values()
+    if isinstance(cls, type) and issubclass(cls, EsprimaNode) and
+    cls is not EsprimaNode
+}
+globals().update(CLASSES)
+
+
+def child_nodes(node: Node) -> list[Node]:
+    """Returns the children of `node`, in order."""
+    get = node.child_values
+    if get is None:
+        return []
+    children = []
+    for value in get(node):
+        if isinstance(value, Node):
+            children.append(value)
+        elif isinstance(value, list):
+            children += [elem for elem in value if isinstance(elem, Node)]
+    return children
+
+
+def walk(roots: Iterable[Node], *, unique=False) -> Iterator[Node]:
+    """Yields every node in the trees rooted at `roots`, in pre-order. Nodes
+    can appear more than once in a tree (e.g., an `Identifier` referring to a
+    temporary); if `unique` is true, each is yielded (and descended into)
+    only the first time.
+    """
+    stack = list(roots)
+    stack.reverse()
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if unique:
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+        yield node
+        get = node.child_values
+        if get is None:
+            continue
+        # Pushed in reverse, so that they're popped in order.
+        for value in reversed(get(node)):
+            if isinstance(value, Node):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack += [
+                    elem for elem in reversed(value)
+                    if isinstance(elem, Node)
+                ]
+
+
+def replace_child_nodes(node: Node, replace: Callable[[Node], Node]) -> bool:
+    """Replaces each child of `node` with ``replace(child)``. Returns whether
+    any child was replaced.
+    """
+    changed = False
+    for name in node.child_fields:
+        value = getattr(node, name)
+        if isinstance(value, list):
+            for i, elem in enumerate(value):
+                if isinstance(elem, Node):
+                    new_elem = replace(elem)
+                    if new_elem is not elem:
+                        value[i] = new_elem
+                        changed = True
+        elif isinstance(value, Node):
+            new_value = replace(value)
+            if new_value is not value:
+                setattr(node, name, new_value)
+                changed = True
+    return changed
+
+
+def from_esprima(root: EsprimaNode) -> Node:
+    """Converts a tree of esprima nodes to compact nodes. Other objects (like
+    the `regex` field of regex literals) are kept as they are. The esprima
+    nodes are emptied as they're converted, so that the whole tree doesn't
+    have to be kept in memory twice.
+    """
+    def convert(node: EsprimaNode) -> Node:
+        # Nodes that appear more than once are only converted once.
+        new_node = node.__dict__.get("_compact")
+        if new_node is None:
+            cls = CLASSES[type(node).__name__]
+            new_node = node._compact = cls.__new__(cls)
+            stack.append((node, new_node))
+        return new_node
+
+    stack = []
+    result = convert(root)
+    while stack:
+        node, new_node = stack.pop()
+        new_node._analysis = None
+        attrs = node.__dict__
+        for name in new_node.fields:
+            if name not in attrs:
+                continue
+            value = attrs[name]
+            if isinstance(value, EsprimaNode):
+                value = convert(value)
+            elif isinstance(value, list):
+                value = [
+                    convert(elem) if isinstance(elem, EsprimaNode) else elem
+                    for elem in value
+                ]
+            setattr(new_node, name, value)
+        attrs.clear()
+        node._compact = new_node
+    return result
+
+
+def to_esprima(
+    root: Node,
+    target: Optional[EsprimaNode] = None,
+) -> EsprimaNode:
+    """Converts a tree of compact nodes back to esprima nodes. If `target` is
+    provided, its fields are replaced with those of `root` and it's returned
+    instead of a new node, so that an esprima tree passed to `from_esprima()`
+    can be updated in place.
+    """
+    converted: dict[int, EsprimaNode] = {}
+
+    def convert(node: Node) -> EsprimaNode:
+        # Nodes that appear more than once are only converted once.
+        new_node = converted.get(id(node))
+        if new_node is None:
+            cls = getattr(esprima_nodes, type(node).__name__)
+            new_node = converted[id(node)] = cls.__new__(cls)
+            stack.append((node, new_node))
+        return new_node
+
+    stack = []
+    if target is not None:
+        target.__dict__.clear()
+        converted[id(root)] = target
+        stack.append((root, target))
+    result = convert(root)
+    while stack:
+        node, new_node = stack.pop()
+        attrs = new_node.__dict__
+        for name, value in node.items():
+            if isinstance(value, Node):
+                value = convert(value)
+            elif isinstance(value, list):
+                value = [
+                    convert(elem) if isinstance(elem, Node) else elem
+                    for elem in value
+                ]
+            attrs[name] = value
+    return result
+
+
+def parse(source: str) -> Node:
+    """Parses a script and returns its compact AST."""
+    return from_esprima(esprima.parseScript(source))
+
+
+def parse_statements(source: str, *, directives=True):
+    """Parses a script one top-level statement at a time, like
+    `esprima.parseScript()`. Yields the compact AST of each statement and the
+    index in `source` just past its end. Only the statement being parsed is
+    kept in memory. If `directives` is false, `source` is parsed as if it
+    came after other statements, so it has no directive prologue.
+    """
+    parser = Parser(source, options={"sourceType": "script"})
+    if directives:
+        for statement in parser.parseDirectivePrologues():
+            yield from_esprima(statement), parser.lastMarker.index
+    while parser.lookahead.type is not Token.EOF:
+        statement = parser.parseStatementListItem()
+        yield from_esprima(statement), parser.lastMarker.index
@@ -0,0 +1,285 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Transforms large function bodies in a process pool.
+
+A function body is transformed in pre-order without affecting anything
+outside it, so each worker can transform one independently. Every temporary
+(in the workers and in the main process) is created with `TEMP_PREFIX` and a
+local number, and is renumbered once the numbers of temporaries in each body
+are known, so the output is the same as `transform()`'s regardless of the
+number of workers.
+"""
+
+from .fragments import FragmentCache
+from .nodes import BlockStatement, Node, child_nodes
+from .transformations import (
+    FUNCTION_TYPES, TEMP_PREFIX, BlockStats, State, Transformer,
+    invalidate, rename_temporaries, renumber, transform,
+)
+
+from contextlib import nullcontext
+from esprima.objects import Object
+from typing import TYPE_CHECKING, Optional
+import bisect
+import io
+import pickle
+
+# `concurrent.futures` is only imported if the input is large enough to be
+# transformed in parallel.
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+# Files with fewer nodes than this are transformed serially.
+MIN_PARALLEL_NODES = 20000
+
+# Function bodies with fewer nodes than this are transformed in the main
+# process, as they aren't worth sending to a worker.
+MIN_UNIT_NODES = 1000
+
+# Function bodies are sent to workers whole if they have fewer nodes than the
+# whole tree divided by the number of workers times this number; otherwise,
+# they're split into smaller function bodies if possible.
+UNITS_PER_JOB = 4
+
+
+def make_object(cls: type, attrs: dict) -> Object:
+    obj = cls.__new__(cls)
+    obj.__dict__ = attrs
+    return obj
+
+
+class Pickler(pickle.Pickler):
+    # `Object.__getattr__` returns None for missing attributes, which breaks
+    # unpickling (None is found instead of `__setstate__`), so esprima objects
+    # that remain in the tree (like the `regex` field of regex literals) are
+    # recreated with `make_object()` instead.
+    def reducer_override(self, obj):
+        if isinstance(obj, Object):
+            return make_object, (type(obj), obj.__dict__)
+        return NotImplemented
+
+
+def dumps(obj) -> bytes:
+    """Pickles an object containing nodes. Raises `RecursionError` if the
+    nodes are nested too deeply.
+    """
+    f = io.BytesIO()
+    Pickler(f, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+
+def count_function_body_nodes(root: Node) -> dict[int, tuple[Node, int]]:
+    """Returns a dict that maps the ID of each function body in `root` to the
+    body and the number of nodes in it. The ID of `root` is included too.
+    """
+    counts = {}
+    sizes = {}
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            stack.append((node, True))
+            stack += ((child, False) for child in child_nodes(node))
+            continue
+        if node.type in FUNCTION_TYPES and node.body.type == "BlockStatement":
+            body = node.body
+            counts[id(body)] = (body, sizes.get(id(body), 0))
+        sizes[id(node)] = 1 + sum(
+            sizes.pop(id(child), 0) for child in child_nodes(node)
+        )
+    counts[id(root)] = (root, sizes[id(root)])
+    return counts
+
+
+def transform_unit(data: bytes, profile: bool) -> bytes:
+    """Transforms a pickled function body in a worker process. Returns the
+    pickled transformed statements, number of temporaries, statistics,
+    number of skipped nodes, and (if `profile` is true) the time spent in
+    each pass (see `Profiler.report()`).
+    """
+    node = pickle.loads(data)
+    state = State(temp_prefix=TEMP_PREFIX)
+    profiler = None
+    if profile:
+        from .profiling import Profiler
+        profiler = Profiler()
+    with profiler or nullcontext():
+        Transformer(state, profiler=profiler).visit(node)
+    pass_stats = None if profiler is None else profiler.report()["passes"]
+    return dumps((
+        node.body, state.id_num, state.block_stats, state.skipped_nodes,
+        pass_stats,
+    ))
+
+
+class Unit:
+    """A function body that's transformed separately."""
+    def __init__(self, node: BlockStatement, id_num: int):
+        self.node = node
+        # The number of temporaries created in the main process before this
+        # body.
+        self.id_num = id_num
+        self.key: Optional[str] = None
+        self.future: Optional["Future"] = None
+        self.body: list[Node] = []
+        self.temporaries = 0
+        self.block_stats: list[BlockStats] = []
+        self.skipped_nodes = 0
+        self.pass_stats: Optional[dict] = None
+
+
+class ParallelTransformer(Transformer):
+    def __init__(
+        self,
+        state: State,
+        executor: "ProcessPoolExecutor",
+        sizes: dict[int, tuple[Node, int]],
+        max_unit_nodes: int, *,
+        fragments: Optional[FragmentCache] = None,
+        profiler=None,
+    ):
+        super().__init__(state, profiler=profiler)
+        self.profiler = profiler
+        self.executor = executor
+        self.sizes = sizes
+        self.max_unit_nodes = max_unit_nodes
+        self.unit_fragments = fragments
+        self.units: list[Unit] = []
+
+    def handles_function_bodies(self) -> bool:
+        return True
+
+    def visit_function_body(self, node: BlockStatement):
+        size_node, size = self.sizes.get(id(node), (None, 0))
+        if size_node is not node or size < MIN_UNIT_NODES:
+            yield from self.visit_small_body(node)
+            return
+        if size > self.max_unit_nodes:
+            # Transform this body here, but look for units inside it.
+            self.process_node(node)
+            yield from child_nodes(node)
+            return
+
+        unit = Unit(node, self.state.id_num)
+        self.units.append(unit)
+        fragments = self.unit_fragments
+        fragment = None
+        if fragments is not None:
+            unit.key = fragments.make_key(node)
+            if unit.key is not None:
+                fragment = fragments.get(unit.key)
+        if fragment is not None:
+            unit.body = fragment.body
+            unit.temporaries = fragment.temporaries
+            unit.block_stats = fragment.block_stats
+        else:
+            try:
+                data = dumps(node)
+            except RecursionError:
+                data = None
+            if data is None:
+                # Too deeply nested to send to a worker.
+                self.units.pop()
+                self.process_node(node)
+                yield from child_nodes(node)
+                return
+            unit.future = self.executor.submit(
+                transform_unit, data, self.profiler is not None,
+            )
+        # The body is replaced once it's transformed. Until then, it's empty
+        # so that nothing else sees its original statements.
+        node.body = []
+
+    def finish(self, temp_prefix: str):
+        """Waits for every unit to be transformed, inserts them into the
+        tree, and gives every temporary its final name.
+        """
+        state = self.state
+        for unit in self.units:
+            if unit.future is None:
+                continue
+            (
+                unit.body, unit.temporaries, unit.block_stats,
+                unit.skipped_nodes, unit.pass_stats,
+            ) = pickle.loads(unit.future.result())
+            if unit.pass_stats is not None:
+                self.profiler.add_pass_stats(unit.pass_stats)
+            if unit.key is not None:
+                self.unit_fragments.put(
+                    unit.key,
+                    body=unit.body,
+                    temporaries=unit.temporaries,
+                    block_stats=unit.block_stats,
+                )
+
+        # A temporary created in the main process is preceded by all of the
+        # temporaries in units visited before it was created.
+        unit_id_nums = [unit.id_num for unit in self.units]
+        preceding = [0]
+        for unit in self.units:
+            preceding.append(preceding[-1] + unit.temporaries)
+
+        def rename(num: int) -> str:
+            index = bisect.bisect_left(unit_id_nums, num)
+            return f"{temp_prefix}{num + preceding[index]}"
+        rename_temporaries([self.root], rename)
+
+        for i, unit in enumerate(self.units):
+            renumber(unit.body, temp_prefix, unit.id_num + preceding[i])
+            unit.node.body = unit.body
+            invalidate(unit.node)
+            state.block_stats += unit.block_stats
+            state.skipped_nodes += unit.skipped_nodes
+        state.id_num += preceding[-1]
+        state.temp_prefix = temp_prefix
+
+    def visit(self, root: Node):
+        self.root = root
+        return super().visit(root)
+
+
+def transform_parallel(
+    ast: Node,
+    temp_prefix: str, *,
+    jobs: int,
+    fragments: Optional[FragmentCache] = None,
+    profiler=None,
+) -> State:
+    """Like `transformations.transform()`, but uses up to `jobs` worker
+    processes. If `fragments` is provided, the function bodies sent to
+    workers are looked up in and stored in it.
+    """
+    sizes = count_function_body_nodes(ast)
+    _, total = sizes[id(ast)]
+    if jobs <= 1 or total < MIN_PARALLEL_NODES:
+        return transform(
+            ast, temp_prefix, fragments=fragments, profiler=profiler,
+        )
+
+    from concurrent.futures import ProcessPoolExecutor
+    state = State(temp_prefix=TEMP_PREFIX)
+    max_unit_nodes = max(MIN_UNIT_NODES, total // (jobs * UNITS_PER_JOB))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        transformer = ParallelTransformer(
+            state, executor, sizes, max_unit_nodes,
+            fragments=fragments,
+            profiler=profiler,
+        )
+        transformer.visit(ast)
+        transformer.finish(temp_prefix)
+    return state
@@ -0,0 +1,49 @@
+#!/usr/bin/env node
+/*
+ * Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+ *
+ * This file is part of Opener.
+ *
+ * Opener is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Opener is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with Opener. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+// Long-lived parsing worker. Each request (framed as described in worker.js)
+// is the source code of a script, and each successful response is the JSON
+// representation of its AST, as produced by esprima. If the script can't be
+// parsed, the response is a JSON object describing the error, with the same
+// properties as esprima's errors; other failures respond with a message.
+
+const esprima = require("esprima");
+const {STATUS_OK, STATUS_ERROR, respond, serve} = require("./worker");
+
+serve(payload => {
+    let json;
+    try {
+        json = JSON.stringify(esprima.parseScript(payload.toString("utf8")));
+    } catch (e) {
+        if (e && e.description !== undefined) {
+            respond(STATUS_ERROR, JSON.stringify({
+                message: e.message,
+                index: e.index,
+                lineNumber: e.lineNumber,
+                column: e.column,
+                description: e.description,
+            }));
+        } else {
+            respond(STATUS_ERROR, String(e && e.stack || e));
+        }
+        return;
+    }
+    respond(STATUS_OK, json);
+});
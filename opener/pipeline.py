@@ -0,0 +1,434 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+from .defaults import (
+    CODEGEN_FORMAT_BINARY, CODEGEN_PYTHON, DEFAULT_CODEGEN,
+    DEFAULT_TEMP_PREFIX,
+)
+from .nodes import (
+    EmptyStatement, Node, Script, parse, parse_statements, walk,
+)
+from .to_json import write_json
+from .transformations import TEMP_PREFIX, State, transform
+
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Optional, TextIO
+import sys
+
+# Only needed for some options, so imported when used.
+if TYPE_CHECKING:
+    from .budget import Budget
+    from .cache import ResultCache
+    from .codegen import CodegenWorker
+    from .fragments import FragmentCache
+    from .node_parser import ParseWorker
+    from .profiling import Profiler
+
+# In streaming mode, top-level statements are processed in chunks spanning at
+# least this many characters of source.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Written before JS output that was transformed after the budget ran out.
+BUDGET_EXHAUSTED_MARKER = (
+    "// opener: budget exhausted; the following code is only partially "
+    "deobfuscated\n"
+)
+
+# Set to true in the JSON representation of the `Program` when the budget ran
+# out (and absent otherwise).
+BUDGET_EXHAUSTED_KEY = "budgetExhausted"
+
+
+def encode_ast(ast: Node, codegen_format: str, f: TextIO):
+    """Writes the representation of `ast` that codegen.js expects in
+    `codegen_format` (see `defaults.CODEGEN_FORMATS`) to `f`.
+    """
+    if codegen_format == CODEGEN_FORMAT_BINARY:
+        from .to_binary import write_binary
+        write_binary(ast, f)
+    else:
+        write_json(ast, f)
+
+
+def run_codegen_js(
+    ast: Node,
+    worker: "CodegenWorker",
+    profiler: Optional["Profiler"] = None,
+) -> str:
+    def write(f: TextIO):
+        with phase(profiler, worker.codegen_format):
+            encode_ast(ast, worker.codegen_format, f)
+    return worker.generate(write)
+
+
+def run_codegen_python(ast: Node) -> str:
+    from .printer import generate
+    return generate(ast)
+
+
+def phase(profiler: Optional["Profiler"], name: str):
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+
+def run_transform(
+    ast: Node,
+    temp_prefix: str, *,
+    fragments: Optional["FragmentCache"],
+    profiler: Optional["Profiler"],
+    jobs: int,
+    budget: Optional["Budget"] = None,
+) -> State:
+    with phase(profiler, "transform"):
+        # Function bodies transformed in other processes can't share the
+        # budget, so budgeted transformations are serial.
+        if jobs > 1 and budget is None:
+            from .parallel import transform_parallel
+            return transform_parallel(
+                ast, temp_prefix,
+                jobs=jobs,
+                fragments=fragments,
+                profiler=profiler,
+            )
+        return transform(
+            ast,
+            temp_prefix=temp_prefix,
+            fragments=fragments,
+            profiler=profiler,
+            budget=budget,
+        )
+
+
+def transform_statements(
+    body: list[Node],
+    temp_prefix: str,
+    offset: int, *,
+    fragments: Optional["FragmentCache"],
+    profiler: Optional["Profiler"],
+    jobs: int,
+    budget: Optional["Budget"] = None,
+) -> tuple[Script, State]:
+    """Transforms a script containing the top-level statements in `body`,
+    and names its temporaries with `temp_prefix`, numbered after the first
+    `offset` temporaries. The temporaries of each statement are numbered
+    after those of the statements before it (in the order they were
+    created), so the result for each statement doesn't depend on which other
+    statements are transformed along with it. Returns the transformed script
+    and the state of the transformation, whose `id_num` is the number of
+    temporaries in the result.
+    """
+    # Each statement is followed by a marker, so that the statements it
+    # turns into can be found after transforming.
+    markers = [EmptyStatement() for _ in body]
+    ast = Script([node for pair in zip(body, markers) for node in pair])
+    state = run_transform(
+        ast, TEMP_PREFIX,
+        fragments=fragments,
+        profiler=profiler,
+        jobs=jobs,
+        budget=budget,
+    )
+    marker_ids = set(map(id, markers))
+    new_body = []
+    group = []
+    id_num = offset
+    for statement in ast.body:
+        if id(statement) not in marker_ids:
+            group.append(statement)
+            continue
+        # Temporaries only appear in the statements that created them.
+        temporaries = [
+            (int(node.name[len(TEMP_PREFIX):]), node)
+            for node in walk(group, unique=True)
+            if node.type == "Identifier" and node.name.startswith(TEMP_PREFIX)
+        ]
+        numbers = {}
+        for num in sorted(set(num for num, _ in temporaries)):
+            id_num += 1
+            numbers[num] = f"{temp_prefix}{id_num}"
+        for num, node in temporaries:
+            node.name = numbers[num]
+        new_body += group
+        group = []
+    ast.body = new_body
+    state.temp_prefix = temp_prefix
+    state.id_num = id_num - offset
+    return ast, state
+
+
+def run_codegen(
+    ast: Node, *,
+    codegen: str,
+    worker: Optional["CodegenWorker"],
+    profiler: Optional["Profiler"],
+) -> str:
+    # With escodegen, this includes the "json" (or "binary") phase.
+    with phase(profiler, "codegen"):
+        if codegen == CODEGEN_PYTHON:
+            return run_codegen_python(ast)
+        return run_codegen_js(ast, worker, profiler)
+
+
+def print_stats(state: State):
+    stats = state.block_stats
+    print(
+        f"Processed {sum(b.processed for b in stats)} statements in "
+        f"{len(stats)} blocks (at most "
+        f"{max((b.rounds for b in stats), default=0)} rounds per block)",
+        file=sys.stderr,
+    )
+
+
+def print_fragment_stats(fragments: "FragmentCache"):
+    print(
+        f"Reused {fragments.hits} of "
+        f"{fragments.hits + fragments.misses} cached function bodies",
+        file=sys.stderr,
+    )
+
+
+def parse_and_transform(
+    source: str, *,
+    temp_prefix=DEFAULT_TEMP_PREFIX,
+    parse_worker: Optional["ParseWorker"] = None,
+    cache: Optional["ResultCache"] = None,
+    profiler: Optional["Profiler"] = None,
+    jobs=1,
+    budget: Optional["Budget"] = None,
+    verbose=False,
+) -> tuple[Node, State]:
+    """Parses and deobfuscates `source`, as `process()` does, and returns
+    the AST and the state of the transformation.
+    """
+    if verbose:
+        print("Parsing...", file=sys.stderr)
+    with phase(profiler, "parse"):
+        if parse_worker is None:
+            ast = parse(source)
+        else:
+            ast = parse_worker.parse(source)
+    if profiler is not None:
+        profiler.record_ast("parsed", ast)
+
+    if verbose:
+        print("Deobfuscating...", file=sys.stderr)
+    fragments = None
+    if cache is not None:
+        from .fragments import FragmentCache
+        fragments = FragmentCache(cache)
+    state = run_transform(
+        ast, temp_prefix,
+        fragments=fragments,
+        profiler=profiler,
+        jobs=jobs,
+        budget=budget,
+    )
+    if fragments is not None:
+        fragments.flush()
+        if verbose:
+            print_fragment_stats(fragments)
+    if profiler is not None:
+        profiler.record_ast("transformed", ast)
+        profiler.record_state(state)
+    if verbose:
+        print_stats(state)
+    return ast, state
+
+
+def process(
+    source: str,
+    out: TextIO, *,
+    temp_prefix=DEFAULT_TEMP_PREFIX,
+    emit_ast=False,
+    codegen=DEFAULT_CODEGEN,
+    worker: Optional["CodegenWorker"] = None,
+    parse_worker: Optional["ParseWorker"] = None,
+    cache: Optional["ResultCache"] = None,
+    profiler: Optional["Profiler"] = None,
+    jobs=1,
+    budget: Optional["Budget"] = None,
+    verbose=False,
+) -> State:
+    """Deobfuscates `source` and writes the result to `out`. `worker` must be
+    provided unless `emit_ast` is true or `codegen` is `CODEGEN_PYTHON`. If
+    `parse_worker` is provided, `source` is parsed with it (in Node.js). If
+    `cache` is provided, transformed function bodies are cached in it. If
+    `profiler` is provided, statistics are recorded in it. If `jobs` is
+    greater than 1, large function bodies are transformed in that many worker
+    processes. If `budget` (a `budget.Budget`) is provided, the transformation
+    is serial, and once the budget is exhausted, the rest of the tree is only
+    partially deobfuscated; JS output then starts with
+    `BUDGET_EXHAUSTED_MARKER`, and the AST's JSON has `BUDGET_EXHAUSTED_KEY`
+    set to true. Returns the state of the transformation.
+    """
+    ast, state = parse_and_transform(
+        source,
+        temp_prefix=temp_prefix,
+        parse_worker=parse_worker,
+        cache=cache,
+        profiler=profiler,
+        jobs=jobs,
+        budget=budget,
+        verbose=verbose,
+    )
+
+    if emit_ast:
+        if verbose:
+            print("Printing AST...", file=sys.stderr)
+        with phase(profiler, "json"):
+            root = ast
+            if state.budget_exhausted:
+                root = {**dict(ast.items()), BUDGET_EXHAUSTED_KEY: True}
+            write_json(root, out)
+    else:
+        if verbose:
+            print("Formatting code...", file=sys.stderr)
+        if state.budget_exhausted:
+            out.write(BUDGET_EXHAUSTED_MARKER)
+        out.write(run_codegen(
+            ast,
+            codegen=codegen,
+            worker=worker,
+            profiler=profiler,
+        ))
+        out.write("\n")
+    return state
+
+
+def iter_chunks(source: str, chunk_size: int):
+    """Parses `source` one top-level statement at a time, and yields lists of
+    consecutive statements spanning at least `chunk_size` characters. The
+    last list may span fewer, and is empty if there are no statements.
+    """
+    chunk = []
+    start = 0
+    for statement, end in parse_statements(source):
+        chunk.append(statement)
+        if end - start >= chunk_size:
+            yield chunk
+            chunk = []
+            start = end
+    if chunk or start == 0:
+        yield chunk
+
+
+def process_stream(
+    source: str,
+    out: TextIO, *,
+    temp_prefix=DEFAULT_TEMP_PREFIX,
+    emit_ast=False,
+    codegen=DEFAULT_CODEGEN,
+    worker: Optional["CodegenWorker"] = None,
+    cache: Optional["ResultCache"] = None,
+    profiler: Optional["Profiler"] = None,
+    jobs=1,
+    budget: Optional["Budget"] = None,
+    verbose=False,
+    chunk_size=STREAM_CHUNK_SIZE,
+) -> State:
+    """Like `process()`, but parses, transforms, and outputs the top-level
+    statements of `source` in chunks of about `chunk_size` characters, so
+    only one chunk's AST is in memory at a time and `out` is written to (and
+    flushed) after each chunk.
+
+    Each top-level statement is transformed independently, so the output
+    differs from `process()`'s only in the numbering of temporaries: they're
+    numbered statement by statement (see `transform_statements()`), rather
+    than every temporary created directly in the top-level block coming
+    first. The output doesn't depend on `chunk_size`.
+
+    `budget` is shared by every chunk. `BUDGET_EXHAUSTED_MARKER` is written
+    before the output of the first chunk that isn't fully deobfuscated, and
+    `BUDGET_EXHAUSTED_KEY` is added after the body of the AST.
+    """
+    fragments = None
+    if cache is not None:
+        from .fragments import FragmentCache
+        fragments = FragmentCache(cache)
+    state = State(temp_prefix=temp_prefix, budget=budget)
+    if emit_ast:
+        # The same as `write_json()` would write for the whole `Program`.
+        out.write('{"type": "Program", "sourceType": "script", "body": [')
+
+    chunks = iter_chunks(source, chunk_size)
+    first = True
+    wrote_marker = False
+    while True:
+        with phase(profiler, "parse"):
+            body = next(chunks, None)
+        if body is None:
+            break
+        if verbose:
+            print(f"Processing {len(body)} statements...", file=sys.stderr)
+        if profiler is not None:
+            profiler.record_ast("parsed", Script(body))
+
+        ast, chunk_state = transform_statements(
+            body, temp_prefix, state.id_num,
+            fragments=fragments,
+            profiler=profiler,
+            jobs=jobs,
+            budget=budget,
+        )
+        state.id_num += chunk_state.id_num
+        state.block_stats += chunk_state.block_stats
+        state.skipped_nodes += chunk_state.skipped_nodes
+        if fragments is not None:
+            fragments.flush()
+        if profiler is not None:
+            profiler.record_ast("transformed", ast)
+
+        if emit_ast:
+            with phase(profiler, "json"):
+                for statement in ast.body:
+                    if not first:
+                        out.write(", ")
+                    first = False
+                    write_json(statement, out)
+        elif ast.body:
+            first = False
+            if state.budget_exhausted and not wrote_marker:
+                out.write(BUDGET_EXHAUSTED_MARKER)
+                wrote_marker = True
+            out.write(run_codegen(
+                ast,
+                codegen=codegen,
+                worker=worker,
+                profiler=profiler,
+            ))
+            out.write("\n")
+        out.flush()
+        # Let the chunk be freed before the next one is parsed.
+        del ast, body
+
+    if emit_ast:
+        out.write("]")
+        if state.budget_exhausted:
+            out.write(f', "{BUDGET_EXHAUSTED_KEY}": true')
+        out.write("}")
+    elif first:
+        # The whole script was removed, which leaves an empty line.
+        out.write("\n")
+    out.flush()
+    if fragments is not None and verbose:
+        print_fragment_stats(fragments)
+    if profiler is not None:
+        profiler.record_state(state)
+    if verbose:
+        print_stats(state)
+    return state
@@ -0,0 +1,138 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Finds subtrees that no transformation pass would change.
+
+Much of a typical bundle is already readable, but every pass still visits
+every node. Before a tree is transformed, `ScanIndex` visits it once, asking
+each pass whether it might change anything because of each node (see
+`transformations.Pass.may_change()`), and records the results in arrays
+indexed by each node's position in a pre-order traversal. A subtree that
+contains no such node can be skipped entirely.
+
+Transforming a subtree generally can't introduce changes in a subtree that
+the passes wouldn't otherwise change: nodes are only modified when something
+in them is marked, and nodes created during the transformation aren't in the
+index, so they're always visited. The exception is a pass that moves nodes
+into an existing unmarked subtree (like `Unsequence` moving the update of a
+``for`` loop into its body), which must call `ScanIndex.expand()` first.
+"""
+
+from .nodes import Node, child_nodes, walk
+
+from array import array
+
+# Flags for each node.
+# The node itself might be changed (or cause a change).
+MARKED = 1
+# The node or one of its descendants is marked.
+SUBTREE_MARKED = 2
+
+
+class ScanIndex:
+    """An index of the nodes in a tree and which subtrees the passes in
+    `passes` (`transformations.Pass` objects) would leave unchanged.
+    """
+    def __init__(self, root: Node, passes: list):
+        # The nodes, in pre-order. The position of each node in this list is
+        # its index in the arrays below.
+        self.nodes: list[Node] = []
+        # The position of the parent of each node (-1 for the root).
+        self.parents = array("l")
+        self.flags = bytearray()
+        # The IDs of the roots of unmarked subtrees whose parents are marked.
+        # Only these are looked up, so there's no need to store the position
+        # of every node.
+        self.unmarked_roots: set[int] = set()
+        # Maps node types to the `may_change()` methods of the passes that
+        # can return true for them. Filled in as each type is encountered.
+        self.checks: dict[str, list] = {}
+        self.passes = passes
+        self.build(root)
+
+    def get_checks(self, node_type: str) -> list:
+        checks = self.checks[node_type] = [
+            tf_pass.may_change for tf_pass in self.passes
+            if tf_pass.change_types is None or
+            node_type in tf_pass.change_types
+        ]
+        return checks
+
+    def build(self, root: Node):
+        nodes = self.nodes
+        parents = self.parents
+        flags = self.flags
+        all_checks = self.checks
+
+        # Popping from a stack visits each node's subtree before anything
+        # below the node on the stack, so every subtree occupies a
+        # contiguous range of positions.
+        stack = [root]
+        parent_stack = [-1]
+        while stack:
+            node = stack.pop()
+            parent = parent_stack.pop()
+            position = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            flags.append(0)
+            checks = all_checks.get(node.type)
+            if checks is None:
+                checks = self.get_checks(node.type)
+            for check in checks:
+                if check(node):
+                    self.mark(position)
+                    break
+            children = child_nodes(node)
+            stack += children
+            parent_stack += [position] * len(children)
+
+        self.unmarked_roots = {
+            id(node)
+            for node, flag, parent in zip(nodes, flags, parents)
+            if not flag and (parent < 0 or flags[parent])
+        }
+
+    def mark(self, position: int):
+        """Marks a node, and every subtree that contains it."""
+        flags = self.flags
+        parents = self.parents
+        flags[position] |= MARKED
+        while position >= 0 and not flags[position] & SUBTREE_MARKED:
+            flags[position] |= SUBTREE_MARKED
+            position = parents[position]
+
+    def expand(self, node: Node):
+        """Ensures `node` is visited, so that children can be added to it.
+        Its current children are still skipped if nothing in them is marked.
+        """
+        if id(node) in self.unmarked_roots:
+            self.unmarked_roots.remove(id(node))
+            self.unmarked_roots.update(map(id, child_nodes(node)))
+
+    def is_unmarked_root(self, node: Node) -> bool:
+        """Returns whether `node` is the root of a subtree that the passes
+        would leave unchanged.
+        """
+        # `self.nodes` keeps every indexed node alive, so a node with the
+        # same ID as an indexed node must be the same node.
+        return id(node) in self.unmarked_roots
+
+
+def subtree_nodes(root: Node) -> list[Node]:
+    """Returns the nodes in a subtree, in pre-order."""
+    return list(walk([root]))
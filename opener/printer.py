@@ -0,0 +1,1168 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""A Python port of the code generator of escodegen 2.1.0 (the version in
+``package-lock.json``), restricted to escodegen's default options. Given the
+same AST, `generate()` should produce exactly the same output as
+``escodegen.generate()`` (see ``scripts/compare_codegen.py``).
+"""
+
+from .es5_identifiers import is_non_ascii_identifier_part
+from .nodes import Node
+
+import sys
+
+INDENT = "    "
+
+# Precedence levels, as in escodegen.
+SEQUENCE = 0
+YIELD = 1
+ASSIGNMENT = 1
+CONDITIONAL = 2
+ARROW_FUNCTION = 2
+COALESCE = 3
+UNARY = 15
+AWAIT = 15
+POSTFIX = 16
+CALL = 18
+NEW = 19
+TAGGED_TEMPLATE = 20
+MEMBER = 21
+PRIMARY = 22
+
+BINARY_PRECEDENCE = {
+    "??": 3,
+    "||": 4,
+    "&&": 5,
+    "|": 6,
+    "^": 7,
+    "&": 8,
+    "==": 9,
+    "!=": 9,
+    "===": 9,
+    "!==": 9,
+    "<": 10,
+    ">": 10,
+    "<=": 10,
+    ">=": 10,
+    "in": 10,
+    "instanceof": 10,
+    "<<": 11,
+    ">>": 11,
+    ">>>": 11,
+    "+": 12,
+    "-": 12,
+    "*": 13,
+    "%": 13,
+    "/": 13,
+    "**": 14,
+}
+
+# Generation flags.
+F_ALLOW_IN = 1
+F_ALLOW_CALL = 1 << 1
+F_ALLOW_UNPAREN_NEW = 1 << 2
+F_FUNC_BODY = 1 << 3
+F_DIRECTIVE_CTX = 1 << 4
+F_SEMICOLON_OPT = 1 << 5
+F_FOUND_COALESCE = 1 << 6
+
+# Expression flag sets, named after F_ALLOW_IN, F_ALLOW_CALL, and
+# F_ALLOW_UNPAREN_NEW, in that order.
+E_FTT = F_ALLOW_CALL | F_ALLOW_UNPAREN_NEW
+E_TTF = F_ALLOW_IN | F_ALLOW_CALL
+E_TTT = F_ALLOW_IN | F_ALLOW_CALL | F_ALLOW_UNPAREN_NEW
+E_TFF = F_ALLOW_IN
+E_FFT = F_ALLOW_UNPAREN_NEW
+E_TFT = F_ALLOW_IN | F_ALLOW_UNPAREN_NEW
+
+# Statement flag sets, named after F_ALLOW_IN, F_FUNC_BODY, F_DIRECTIVE_CTX,
+# and F_SEMICOLON_OPT, in that order.
+S_TFFF = F_ALLOW_IN
+S_TFFT = F_ALLOW_IN | F_SEMICOLON_OPT
+S_FFFF = 0
+S_TFTF = F_ALLOW_IN | F_DIRECTIVE_CTX
+S_TTFF = F_ALLOW_IN | F_FUNC_BODY
+
+# Types of nodes generated with `generate_statement()`.
+STATEMENT_TYPES = frozenset([
+    "BlockStatement", "BreakStatement", "ContinueStatement", "ClassBody",
+    "ClassDeclaration", "DoWhileStatement", "CatchClause",
+    "DebuggerStatement", "EmptyStatement", "ExpressionStatement",
+    "VariableDeclarator", "VariableDeclaration", "ThrowStatement",
+    "TryStatement", "SwitchStatement", "SwitchCase", "IfStatement",
+    "ForStatement", "ForInStatement", "ForOfStatement", "LabeledStatement",
+    "Program", "FunctionDeclaration", "ReturnStatement", "WhileStatement",
+    "WithStatement",
+])
+
+ASCII_IDENTIFIER_PART = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$_",
+)
+
+WHITE_SPACE = frozenset(
+    "\x20\x09\x0b\x0c\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006"
+    "\u2007\u2008\u2009\u200a\u202f\u205f\u3000\ufeff",
+)
+
+LINE_TERMINATORS = frozenset("\n\r\u2028\u2029")
+
+# escodegen (like most JavaScript code) recurses once or twice per level of
+# the AST, so allow for deeper nesting than Python does by default.
+RECURSION_LIMIT = 20000
+
+
+def is_identifier_part(ch: str) -> bool:
+    if ch < "\x80":
+        return ch in ASCII_IDENTIFIER_PART
+    if ch > "\uffff":
+        # JavaScript sees a surrogate pair.
+        return False
+    return is_non_ascii_identifier_part(ch)
+
+
+def is_white_space(ch: str) -> bool:
+    return bool(ch) and ch in WHITE_SPACE
+
+
+def ends_with_line_terminator(text: str) -> bool:
+    return bool(text) and text[-1] in LINE_TERMINATORS
+
+
+def join(left: str, right: str) -> str:
+    """Concatenates two pieces of code, adding a space between them if
+    necessary (or for readability).
+    """
+    if not left:
+        return right
+    if not right:
+        return left
+    lc = left[-1]
+    rc = right[0]
+    if (
+        (lc in "+-" and lc == rc) or
+        (is_identifier_part(lc) and is_identifier_part(rc)) or
+        (lc == "/" and rc == "i")
+    ):
+        return f"{left} {right}"
+    if (
+        is_white_space(lc) or lc in LINE_TERMINATORS or
+        is_white_space(rc) or rc in LINE_TERMINATORS
+    ):
+        return left + right
+    return f"{left} {right}"
+
+
+def parenthesize(text: str, current: int, should: int) -> str:
+    if current < should:
+        return f"({text})"
+    return text
+
+
+def format_number(value) -> str:
+    """Formats a number like JavaScript's ``Number.prototype.toString``."""
+    if value != value:
+        raise ValueError("Numeric literal whose value is NaN")
+    if value < 0 or (value == 0 and str(float(value))[0] == "-"):
+        raise ValueError("Numeric literal whose value is negative")
+    try:
+        value = float(value)
+    except OverflowError:
+        value = float("inf")
+    if value == float("inf"):
+        return "1e+400"
+    if value == 0:
+        return "0"
+
+    # Get the shortest round-tripping digits and the position of the decimal
+    # point relative to them (like `k` and `n` in the ECMAScript spec).
+    mantissa, _, exponent = repr(value).partition("e")
+    whole, _, fraction = mantissa.partition(".")
+    digits = whole + fraction
+    point = len(whole) + int(exponent or 0)
+    stripped = digits.lstrip("0")
+    point -= len(digits) - len(stripped)
+    digits = stripped.rstrip("0")
+    k = len(digits)
+
+    if k <= point <= 21:
+        return digits + "0" * (point - k)
+    if 0 < point <= 21:
+        return f"{digits[:point]}.{digits[point:]}"
+    if -6 < point <= 0:
+        return f"0.{'0' * -point}{digits}"
+    exponent = point - 1
+    sign = "+" if exponent >= 0 else "-"
+    if k == 1:
+        return f"{digits}e{sign}{abs(exponent)}"
+    return f"{digits[0]}.{digits[1:]}e{sign}{abs(exponent)}"
+
+
+def escape_allowed_character(code: int, next_char: str) -> str:
+    if code == 0x08:
+        return "\\b"
+    if code == 0x0c:
+        return "\\f"
+    if code == 0x09:
+        return "\\t"
+    if code > 0xff:
+        return f"\\u{code:04X}"
+    if code == 0 and not ("0" <= next_char <= "9"):
+        return "\\0"
+    if code == 0x0b:
+        return "\\x0B"
+    return f"\\x{code:02X}"
+
+
+DISALLOWED_ESCAPES = {
+    "\\": "\\\\",
+    "\n": "\\n",
+    "\r": "\\r",
+    "\u2028": "\\u2028",
+    "\u2029": "\\u2029",
+}
+
+
+def escape_string(text: str) -> str:
+    """Quotes a string like escodegen's default settings do."""
+    pieces = []
+    single_quotes = 0
+    for i, ch in enumerate(text):
+        if " " <= ch <= "~":
+            if ch == "'":
+                single_quotes += 1
+            elif ch == "\\":
+                pieces.append("\\\\")
+                continue
+            pieces.append(ch)
+        elif ch in DISALLOWED_ESCAPES:
+            pieces.append(DISALLOWED_ESCAPES[ch])
+        elif ch > "\uffff":
+            # JavaScript sees (and escapes) a surrogate pair.
+            code = ord(ch) - 0x10000
+            pieces.append(
+                f"\\u{0xd800 + (code >> 10):04X}"
+                f"\\u{0xdc00 + (code & 0x3ff):04X}"
+            )
+        elif ch > "\x7f" and is_identifier_part(ch):
+            pieces.append(ch)
+        else:
+            next_char = text[i+1] if i + 1 < len(text) else ""
+            pieces.append(escape_allowed_character(ord(ch), next_char))
+
+    result = "".join(pieces)
+    if single_quotes:
+        result = result.replace("'", "\\'")
+    return f"'{result}'"
+
+
+class CodeGenerator:
+    def __init__(self):
+        # The current indentation.
+        self.base = ""
+
+    def generate(self, node: Node) -> str:
+        if node.type in STATEMENT_TYPES:
+            return self.generate_statement(node, S_TFFF)
+        return self.generate_expression(node, SEQUENCE, E_TTT)
+
+    def generate_statement(self, stmt: Node, flags: int) -> str:
+        method = getattr(self, f"statement_{stmt.type}", None)
+        if method is None:
+            raise ValueError(f"Unknown node type: {stmt.type}")
+        return method(stmt, flags)
+
+    def generate_expression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        method = getattr(self, f"expression_{expr.type or 'Property'}", None)
+        if method is None:
+            raise ValueError(f"Unknown node type: {expr.type}")
+        return method(expr, precedence, flags)
+
+    # Helpers.
+
+    def maybe_block(self, stmt: Node, flags: int) -> str:
+        if stmt.type == "BlockStatement":
+            return " " + self.generate_statement(stmt, flags)
+        if stmt.type == "EmptyStatement":
+            return ";"
+        previous = self.base
+        self.base += INDENT
+        result = "\n" + self.base + self.generate_statement(stmt, flags)
+        self.base = previous
+        return result
+
+    def maybe_block_suffix(self, stmt: Node, result: str) -> str:
+        ends = ends_with_line_terminator(result)
+        if stmt.type == "BlockStatement" and not ends:
+            return result + " "
+        if ends:
+            return result + self.base
+        return result + "\n" + self.base
+
+    def generate_pattern(self, node: Node, precedence: int, flags: int):
+        if node.type == "Identifier":
+            return node.name
+        return self.generate_expression(node, precedence, flags)
+
+    def generate_function_params(self, node: Node) -> str:
+        is_arrow = node.type == "ArrowFunctionExpression"
+        if (
+            is_arrow and len(node.params) == 1 and
+            node.params[0].type == "Identifier"
+        ):
+            return async_prefix(node) + node.params[0].name
+        params = ", ".join(
+            self.generate_pattern(param, ASSIGNMENT, E_TTT)
+            for param in node.params
+        )
+        return f"{async_prefix(node) if is_arrow else ''}({params})"
+
+    def generate_function_body(self, node: Node) -> str:
+        result = self.generate_function_params(node)
+        if node.type == "ArrowFunctionExpression":
+            result += " =>"
+        if node.expression:
+            expr = self.generate_expression(node.body, ASSIGNMENT, E_TTT)
+            if expr.startswith("{"):
+                expr = f"({expr})"
+            return f"{result} {expr}"
+        return result + self.maybe_block(node.body, S_TTFF)
+
+    def generate_iteration_for_statement(
+        self, operator: str, stmt: Node, flags: int,
+    ) -> str:
+        result = "for await (" if getattr(stmt, "await", None) else "for ("
+        previous = self.base
+        self.base += INDENT
+        if stmt.left.type == "VariableDeclaration":
+            self.base += INDENT
+            result += stmt.left.kind + " " + self.generate_statement(
+                stmt.left.declarations[0], S_FFFF,
+            )
+            self.base = previous + INDENT
+        else:
+            result += self.generate_expression(stmt.left, CALL, E_TTT)
+        result = join(result, operator)
+        result = join(
+            result, self.generate_expression(stmt.right, ASSIGNMENT, E_TTT),
+        ) + ")"
+        self.base = previous
+        return result + self.maybe_block(stmt.body, flags)
+
+    def generate_property_key(self, expr: Node, computed: bool) -> str:
+        result = self.generate_expression(expr, ASSIGNMENT, E_TTT)
+        return f"[{result}]" if computed else result
+
+    def generate_assignment(
+        self,
+        left: Node,
+        right: Node,
+        operator: str,
+        precedence: int,
+        flags: int,
+    ) -> str:
+        if ASSIGNMENT < precedence:
+            flags |= F_ALLOW_IN
+        return parenthesize(
+            self.generate_expression(left, CALL, flags) +
+            f" {operator} " +
+            self.generate_expression(right, ASSIGNMENT, flags),
+            ASSIGNMENT,
+            precedence,
+        )
+
+    def generate_body(self, body: list[Node], flags: int, *, last_newline):
+        """Generates each statement in `body` on its own line, indented with
+        the current indentation. The last statement may omit its semicolon.
+        """
+        pieces = []
+        for i, stmt in enumerate(body):
+            last = i == len(body) - 1
+            if last:
+                flags |= F_SEMICOLON_OPT
+            fragment = self.base + self.generate_statement(stmt, flags)
+            pieces.append(fragment)
+            if (last_newline or not last) and not (
+                ends_with_line_terminator(fragment)
+            ):
+                pieces.append("\n")
+        return "".join(pieces)
+
+    # Statements.
+
+    def statement_BlockStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        body_flags = S_TFFF
+        if flags & F_FUNC_BODY:
+            body_flags |= F_DIRECTIVE_CTX
+        body = self.generate_body(stmt.body, body_flags, last_newline=True)
+        self.base = previous
+        return "{\n" + body + self.base + "}"
+
+    def statement_BreakStatement(self, stmt: Node, flags: int) -> str:
+        if stmt.label:
+            return f"break {stmt.label.name};"
+        return "break;"
+
+    def statement_ContinueStatement(self, stmt: Node, flags: int) -> str:
+        if stmt.label:
+            return f"continue {stmt.label.name};"
+        return "continue;"
+
+    def statement_ClassBody(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        result = "{\n" + "\n".join(
+            self.base + self.generate_expression(item, SEQUENCE, E_TTT)
+            for item in stmt.body
+        )
+        self.base = previous
+        if not ends_with_line_terminator(result):
+            result += "\n"
+        return result + self.base + "}"
+
+    def statement_ClassDeclaration(self, stmt: Node, flags: int) -> str:
+        result = "class"
+        if stmt.id:
+            result = join(
+                result, self.generate_expression(stmt.id, SEQUENCE, E_TTT),
+            )
+        if stmt.superClass:
+            fragment = join("extends", self.generate_expression(
+                stmt.superClass, UNARY, E_TTT,
+            ))
+            result = join(result, fragment)
+        return result + " " + self.generate_statement(stmt.body, S_TFFT)
+
+    def statement_DoWhileStatement(self, stmt: Node, flags: int) -> str:
+        result = join("do", self.maybe_block(stmt.body, S_TFFF))
+        result = self.maybe_block_suffix(stmt.body, result)
+        test = self.generate_expression(stmt.test, SEQUENCE, E_TTT)
+        return join(result, f"while ({test});")
+
+    def statement_CatchClause(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        if stmt.param:
+            param = self.generate_expression(stmt.param, SEQUENCE, E_TTT)
+            result = f"catch ({param})"
+        else:
+            result = "catch"
+        self.base = previous
+        return result + self.maybe_block(stmt.body, S_TFFF)
+
+    def statement_DebuggerStatement(self, stmt: Node, flags: int) -> str:
+        return "debugger;"
+
+    def statement_EmptyStatement(self, stmt: Node, flags: int) -> str:
+        return ";"
+
+    def statement_ExpressionStatement(self, stmt: Node, flags: int) -> str:
+        result = self.generate_expression(stmt.expression, SEQUENCE, E_TTT)
+        # '{', 'function', 'class', and 'async function' aren't allowed at
+        # the start of an expression statement.
+        if (
+            result.startswith("{") or
+            is_keyword_prefixed(result, "class", "{") or
+            is_keyword_prefixed(result, "function", "(*") or
+            is_async_prefixed(result)
+        ):
+            return f"({result});"
+        return result + ";"
+
+    def statement_VariableDeclarator(self, stmt: Node, flags: int) -> str:
+        item_flags = E_TTT if flags & F_ALLOW_IN else E_FTT
+        if stmt.init:
+            return (
+                self.generate_expression(stmt.id, ASSIGNMENT, item_flags) +
+                " = " +
+                self.generate_expression(stmt.init, ASSIGNMENT, item_flags)
+            )
+        return self.generate_pattern(stmt.id, ASSIGNMENT, item_flags)
+
+    def statement_VariableDeclaration(self, stmt: Node, flags: int) -> str:
+        body_flags = S_TFFF if flags & F_ALLOW_IN else S_FFFF
+        previous = self.base
+        if len(stmt.declarations) > 1:
+            self.base += INDENT
+        result = stmt.kind + " " + ", ".join(
+            self.generate_statement(decl, body_flags)
+            for decl in stmt.declarations
+        )
+        self.base = previous
+        return result + ";"
+
+    def statement_ThrowStatement(self, stmt: Node, flags: int) -> str:
+        return join(
+            "throw", self.generate_expression(stmt.argument, SEQUENCE, E_TTT),
+        ) + ";"
+
+    def statement_TryStatement(self, stmt: Node, flags: int) -> str:
+        result = "try" + self.maybe_block(stmt.block, S_TFFF)
+        result = self.maybe_block_suffix(stmt.block, result)
+        if stmt.handler:
+            result = join(
+                result, self.generate_statement(stmt.handler, S_TFFF),
+            )
+            if stmt.finalizer:
+                result = self.maybe_block_suffix(stmt.handler.body, result)
+        if stmt.finalizer:
+            result = join(
+                result,
+                "finally" + self.maybe_block(stmt.finalizer, S_TFFF),
+            )
+        return result
+
+    def statement_SwitchStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        discriminant = self.generate_expression(
+            stmt.discriminant, SEQUENCE, E_TTT,
+        )
+        self.base = previous
+        cases = self.generate_body(
+            stmt.cases or [], S_TFFF, last_newline=True,
+        )
+        return f"switch ({discriminant}) {{\n{cases}{self.base}}}"
+
+    def statement_SwitchCase(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        if stmt.test:
+            result = join(
+                "case", self.generate_expression(stmt.test, SEQUENCE, E_TTT),
+            ) + ":"
+        else:
+            result = "default:"
+
+        consequent = stmt.consequent
+        start = 0
+        if consequent and consequent[0].type == "BlockStatement":
+            result += self.maybe_block(consequent[0], S_TFFF)
+            start = 1
+        if start != len(consequent) and not ends_with_line_terminator(result):
+            result += "\n"
+
+        pieces = [result]
+        body_flags = S_TFFF
+        for i in range(start, len(consequent)):
+            if i == len(consequent) - 1 and flags & F_SEMICOLON_OPT:
+                body_flags |= F_SEMICOLON_OPT
+            fragment = self.base + self.generate_statement(
+                consequent[i], body_flags,
+            )
+            pieces.append(fragment)
+            if (
+                i + 1 != len(consequent) and
+                not ends_with_line_terminator(fragment)
+            ):
+                pieces.append("\n")
+        self.base = previous
+        return "".join(pieces)
+
+    def statement_IfStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        test = self.generate_expression(stmt.test, SEQUENCE, E_TTT)
+        self.base = previous
+        result = f"if ({test})"
+        body_flags = S_TFFF | (flags & F_SEMICOLON_OPT)
+        if not stmt.alternate:
+            return result + self.maybe_block(stmt.consequent, body_flags)
+
+        result += self.maybe_block(stmt.consequent, S_TFFF)
+        result = self.maybe_block_suffix(stmt.consequent, result)
+        if stmt.alternate.type == "IfStatement":
+            return join(result, "else " + self.generate_statement(
+                stmt.alternate, body_flags,
+            ))
+        return join(result, join(
+            "else", self.maybe_block(stmt.alternate, body_flags),
+        ))
+
+    def statement_ForStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        result = "for ("
+        if not stmt.init:
+            result += ";"
+        elif stmt.init.type == "VariableDeclaration":
+            result += self.generate_statement(stmt.init, S_FFFF)
+        else:
+            # F_ALLOW_IN becomes false.
+            result += self.generate_expression(stmt.init, SEQUENCE, E_FTT)
+            result += ";"
+        if stmt.test:
+            test = self.generate_expression(stmt.test, SEQUENCE, E_TTT)
+            result += f" {test};"
+        else:
+            result += ";"
+        if stmt.update:
+            update = self.generate_expression(stmt.update, SEQUENCE, E_TTT)
+            result += f" {update})"
+        else:
+            result += ")"
+        self.base = previous
+        return result + self.maybe_block(stmt.body, semicolon_flags(flags))
+
+    def statement_ForInStatement(self, stmt: Node, flags: int) -> str:
+        return self.generate_iteration_for_statement(
+            "in", stmt, semicolon_flags(flags),
+        )
+
+    def statement_ForOfStatement(self, stmt: Node, flags: int) -> str:
+        return self.generate_iteration_for_statement(
+            "of", stmt, semicolon_flags(flags),
+        )
+
+    def statement_LabeledStatement(self, stmt: Node, flags: int) -> str:
+        return stmt.label.name + ":" + self.maybe_block(
+            stmt.body, semicolon_flags(flags),
+        )
+
+    def statement_Program(self, stmt: Node, flags: int) -> str:
+        return self.generate_body(stmt.body, S_TFTF, last_newline=False)
+
+    def statement_FunctionDeclaration(self, stmt: Node, flags: int) -> str:
+        return (
+            async_prefix(stmt) + "function" + star_suffix(stmt, " ") +
+            (stmt.id.name if stmt.id else "") +
+            self.generate_function_body(stmt)
+        )
+
+    def statement_ReturnStatement(self, stmt: Node, flags: int) -> str:
+        if stmt.argument:
+            return join("return", self.generate_expression(
+                stmt.argument, SEQUENCE, E_TTT,
+            )) + ";"
+        return "return;"
+
+    def statement_WhileStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        test = self.generate_expression(stmt.test, SEQUENCE, E_TTT)
+        self.base = previous
+        return f"while ({test})" + self.maybe_block(
+            stmt.body, semicolon_flags(flags),
+        )
+
+    def statement_WithStatement(self, stmt: Node, flags: int) -> str:
+        previous = self.base
+        self.base += INDENT
+        obj = self.generate_expression(stmt.object, SEQUENCE, E_TTT)
+        self.base = previous
+        return f"with ({obj})" + self.maybe_block(
+            stmt.body, semicolon_flags(flags),
+        )
+
+    # Expressions.
+
+    def expression_SequenceExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if SEQUENCE < precedence:
+            flags |= F_ALLOW_IN
+        return parenthesize(", ".join(
+            self.generate_expression(item, ASSIGNMENT, flags)
+            for item in expr.expressions
+        ), SEQUENCE, precedence)
+
+    def expression_AssignmentExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return self.generate_assignment(
+            expr.left, expr.right, expr.operator, precedence, flags,
+        )
+
+    def expression_ArrowFunctionExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return parenthesize(
+            self.generate_function_body(expr), ARROW_FUNCTION, precedence,
+        )
+
+    def expression_ConditionalExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if CONDITIONAL < precedence:
+            flags |= F_ALLOW_IN
+        return parenthesize(
+            self.generate_expression(expr.test, COALESCE, flags) + " ? " +
+            self.generate_expression(expr.consequent, ASSIGNMENT, flags) +
+            " : " +
+            self.generate_expression(expr.alternate, ASSIGNMENT, flags),
+            CONDITIONAL,
+            precedence,
+        )
+
+    def expression_LogicalExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if expr.operator == "??":
+            flags |= F_FOUND_COALESCE
+        return self.expression_BinaryExpression(expr, precedence, flags)
+
+    def expression_BinaryExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        operator = expr.operator
+        current = BINARY_PRECEDENCE[operator]
+        if operator == "**":
+            left_precedence = POSTFIX
+            right_precedence = current
+        else:
+            left_precedence = current
+            right_precedence = current + 1
+        if current < precedence:
+            flags |= F_ALLOW_IN
+
+        left = self.generate_expression(expr.left, left_precedence, flags)
+        if left.endswith("/") and is_identifier_part(operator[0]):
+            result = f"{left} {operator}"
+        else:
+            result = join(left, operator)
+
+        right = self.generate_expression(expr.right, right_precedence, flags)
+        if (
+            (operator == "/" and right.startswith("/")) or
+            (operator.endswith("<") and right.startswith("!--"))
+        ):
+            # Avoid creating a comment.
+            result = f"{result} {right}"
+        else:
+            result = join(result, right)
+
+        if operator == "in" and not flags & F_ALLOW_IN:
+            return f"({result})"
+        if operator in ("||", "&&") and flags & F_FOUND_COALESCE:
+            return f"({result})"
+        return parenthesize(result, current, precedence)
+
+    def expression_CallExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        # F_ALLOW_UNPAREN_NEW becomes false.
+        result = self.generate_expression(expr.callee, CALL, E_TTF)
+        if expr.optional:
+            result += "?."
+        result += f"({self.generate_arguments(expr.arguments)})"
+        if not flags & F_ALLOW_CALL:
+            return f"({result})"
+        return parenthesize(result, CALL, precedence)
+
+    def expression_NewExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        # F_ALLOW_CALL becomes false. (With escodegen's default options,
+        # parentheses are always added.)
+        result = join(
+            "new", self.generate_expression(expr.callee, NEW, E_TFF),
+        )
+        result += f"({self.generate_arguments(expr.arguments)})"
+        return parenthesize(result, NEW, precedence)
+
+    def generate_arguments(self, args: list[Node]) -> str:
+        return ", ".join(
+            self.generate_expression(arg, ASSIGNMENT, E_TTT) for arg in args
+        )
+
+    def expression_MemberExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        # F_ALLOW_UNPAREN_NEW becomes false.
+        result = self.generate_expression(
+            expr.object, CALL, E_TTF if flags & F_ALLOW_CALL else E_TFF,
+        )
+        if expr.computed:
+            if expr.optional:
+                result += "?."
+            prop = self.generate_expression(
+                expr.property, SEQUENCE,
+                E_TTT if flags & F_ALLOW_CALL else E_TFT,
+            )
+            result += f"[{prop}]"
+        else:
+            if not expr.optional and is_number_literal(expr.object):
+                # Add a space so that the dot isn't interpreted as a decimal
+                # point.
+                if (
+                    "." not in result and
+                    not any(c in result for c in "eExX") and
+                    "0" <= result[-1] <= "9" and
+                    not (len(result) >= 2 and result[0] == "0")
+                ):
+                    result += " "
+            result += ("?." if expr.optional else ".") + expr.property.name
+        return parenthesize(result, MEMBER, precedence)
+
+    def expression_MetaProperty(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        meta = expr.meta if isinstance(expr.meta, str) else expr.meta.name
+        prop = expr.property
+        prop = prop if isinstance(prop, str) else prop.name
+        return parenthesize(f"{meta}.{prop}", MEMBER, precedence)
+
+    def expression_UnaryExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        operator = expr.operator
+        fragment = self.generate_expression(expr.argument, UNARY, E_TTT)
+        if len(operator) > 2:
+            # delete, void, typeof
+            result = join(operator, fragment)
+        else:
+            lc = operator[-1]
+            rc = fragment[:1]
+            if (
+                (lc in "+-" and lc == rc) or
+                (is_identifier_part(lc) and rc and is_identifier_part(rc))
+            ):
+                result = f"{operator} {fragment}"
+            else:
+                result = operator + fragment
+        return parenthesize(result, UNARY, precedence)
+
+    def expression_YieldExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        result = "yield*" if expr.delegate else "yield"
+        if expr.argument:
+            result = join(result, self.generate_expression(
+                expr.argument, YIELD, E_TTT,
+            ))
+        return parenthesize(result, YIELD, precedence)
+
+    def expression_AwaitExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        result = join("await", self.generate_expression(
+            expr.argument, AWAIT, E_TTT,
+        ))
+        return parenthesize(result, AWAIT, precedence)
+
+    def expression_UpdateExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if expr.prefix:
+            return parenthesize(
+                expr.operator + self.generate_expression(
+                    expr.argument, UNARY, E_TTT,
+                ),
+                UNARY,
+                precedence,
+            )
+        return parenthesize(
+            self.generate_expression(expr.argument, POSTFIX, E_TTT) +
+            expr.operator,
+            POSTFIX,
+            precedence,
+        )
+
+    def expression_FunctionExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return (
+            async_prefix(expr) + "function" + star_suffix(expr, " ") +
+            (expr.id.name if expr.id else "") +
+            self.generate_function_body(expr)
+        )
+
+    def expression_ArrayPattern(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return self.expression_ArrayExpression(
+            expr, precedence, flags, is_pattern=True,
+        )
+
+    def expression_ArrayExpression(
+        self, expr: Node, precedence: int, flags: int, is_pattern=False,
+    ) -> str:
+        elements = expr.elements
+        if not elements:
+            return "[]"
+        multiline = not is_pattern and len(elements) > 1
+        previous = self.base
+        self.base += INDENT
+        pieces = ["[", "\n" if multiline else ""]
+        for i, elem in enumerate(elements):
+            if multiline:
+                pieces.append(self.base)
+            if elem is None:
+                if i + 1 == len(elements):
+                    pieces.append(",")
+            else:
+                pieces.append(
+                    self.generate_expression(elem, ASSIGNMENT, E_TTT),
+                )
+            if i + 1 < len(elements):
+                pieces.append(",\n" if multiline else ", ")
+        self.base = previous
+        result = "".join(pieces)
+        if multiline:
+            if not ends_with_line_terminator(result):
+                result += "\n"
+            result += self.base
+        return result + "]"
+
+    def expression_RestElement(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        # escodegen doesn't pass a precedence here, so the argument is never
+        # parenthesized.
+        return "..." + self.generate_pattern(expr.argument, -1, 0)
+
+    def expression_ClassExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return self.statement_ClassDeclaration(expr, flags)
+
+    def expression_MethodDefinition(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        result = "static " if expr.static else ""
+        key = self.generate_property_key(expr.key, expr.computed)
+        if expr.kind in ("get", "set"):
+            fragment = join(expr.kind, key)
+        else:
+            fragment = method_prefix(expr) + key
+        fragment += self.generate_function_body(expr.value)
+        return join(result, fragment)
+
+    def expression_Property(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if expr.kind in ("get", "set"):
+            return (
+                expr.kind + " " +
+                self.generate_property_key(expr.key, expr.computed) +
+                self.generate_function_body(expr.value)
+            )
+        if expr.shorthand:
+            if expr.value.type == "AssignmentPattern":
+                return self.expression_AssignmentPattern(
+                    expr.value, SEQUENCE, E_TTT,
+                )
+            return self.generate_property_key(expr.key, expr.computed)
+        if expr.method:
+            return (
+                method_prefix(expr) +
+                self.generate_property_key(expr.key, expr.computed) +
+                self.generate_function_body(expr.value)
+            )
+        return (
+            self.generate_property_key(expr.key, expr.computed) + ": " +
+            self.generate_expression(expr.value, ASSIGNMENT, E_TTT)
+        )
+
+    def expression_ObjectExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        properties = expr.properties
+        if not properties:
+            return "{}"
+        multiline = len(properties) > 1
+
+        previous = self.base
+        self.base += INDENT
+        fragment = self.generate_expression(properties[0], SEQUENCE, E_TTT)
+        if not multiline and not any(c in fragment for c in "\r\n"):
+            self.base = previous
+            return f"{{ {fragment} }}"
+
+        pieces = ["{\n", self.base, fragment]
+        if multiline:
+            pieces.append(",\n")
+            for i in range(1, len(properties)):
+                pieces.append(self.base)
+                pieces.append(self.generate_expression(
+                    properties[i], SEQUENCE, E_TTT,
+                ))
+                if i + 1 < len(properties):
+                    pieces.append(",\n")
+        self.base = previous
+        result = "".join(pieces)
+        if not ends_with_line_terminator(result):
+            result += "\n"
+        return result + self.base + "}"
+
+    def expression_AssignmentPattern(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return self.generate_assignment(
+            expr.left, expr.right, "=", precedence, flags,
+        )
+
+    def expression_ObjectPattern(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        properties = expr.properties
+        if not properties:
+            return "{}"
+        if len(properties) == 1:
+            prop = properties[0]
+            multiline = (
+                prop.type == "Property" and prop.value.type != "Identifier"
+            )
+        else:
+            multiline = any(
+                prop.type == "Property" and not prop.shorthand
+                for prop in properties
+            )
+
+        previous = self.base
+        self.base += INDENT
+        pieces = ["{", "\n" if multiline else ""]
+        for i, prop in enumerate(properties):
+            if multiline:
+                pieces.append(self.base)
+            pieces.append(self.generate_expression(prop, SEQUENCE, E_TTT))
+            if i + 1 < len(properties):
+                pieces.append(",\n" if multiline else ", ")
+        self.base = previous
+        result = "".join(pieces)
+        if multiline:
+            if not ends_with_line_terminator(result):
+                result += "\n"
+            result += self.base
+        return result + "}"
+
+    def expression_ThisExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return "this"
+
+    def expression_Super(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return "super"
+
+    def expression_Identifier(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return expr.name
+
+    def expression_Literal(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        if expr.regex:
+            return f"/{expr.regex.pattern}/{expr.regex.flags}"
+        value = expr.value
+        if value is None:
+            return "null"
+        if isinstance(value, str):
+            return escape_string(value)
+        if value is True:
+            return "true"
+        if value is False:
+            return "false"
+        return format_number(value)
+
+    def expression_SpreadElement(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        return "..." + self.generate_expression(
+            expr.argument, ASSIGNMENT, E_TTT,
+        )
+
+    def expression_TaggedTemplateExpression(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        item_flags = E_TTF if flags & F_ALLOW_CALL else E_TFF
+        return parenthesize(
+            self.generate_expression(expr.tag, CALL, item_flags) +
+            self.generate_expression(expr.quasi, PRIMARY, E_FFT),
+            TAGGED_TEMPLATE,
+            precedence,
+        )
+
+    def expression_TemplateElement(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        # Don't use "cooked"; tagged templates can see the raw text.
+        return expr.value.raw
+
+    def expression_TemplateLiteral(
+        self, expr: Node, precedence: int, flags: int,
+    ) -> str:
+        pieces = ["`"]
+        for i, quasi in enumerate(expr.quasis):
+            pieces.append(self.generate_expression(quasi, PRIMARY, E_TTT))
+            if i + 1 < len(expr.quasis):
+                pieces.append("${ ")
+                pieces.append(self.generate_expression(
+                    expr.expressions[i], SEQUENCE, E_TTT,
+                ))
+                pieces.append(" }")
+        pieces.append("`")
+        return "".join(pieces)
+
+
+def semicolon_flags(flags: int) -> int:
+    return S_TFFT if flags & F_SEMICOLON_OPT else S_TFFF
+
+
+def async_prefix(node: Node) -> str:
+    return "async " if node.isAsync else ""
+
+
+def star_suffix(node: Node, default: str) -> str:
+    return "* " if node.generator else default
+
+
+def method_prefix(prop: Node) -> str:
+    func = prop.value
+    return ("async " if func.isAsync else "") + ("*" if func.generator else "")
+
+
+def is_number_literal(node: Node) -> bool:
+    return (
+        node.type == "Literal" and
+        isinstance(node.value, (int, float)) and
+        not isinstance(node.value, bool)
+    )
+
+
+def is_keyword_prefixed(text: str, keyword: str, following: str) -> bool:
+    if not text.startswith(keyword):
+        return False
+    ch = text[len(keyword):len(keyword)+1]
+    return bool(ch) and (
+        ch in following or is_white_space(ch) or ch in LINE_TERMINATORS
+    )
+
+
+def is_async_prefixed(text: str) -> bool:
+    if not (text.startswith("async") and is_white_space(text[5:6])):
+        return False
+    rest = text[6:].lstrip("".join(WHITE_SPACE))
+    return bool(rest) and is_keyword_prefixed(rest, "function", "(*")
+
+
+def generate(node: Node) -> str:
+    """Generates code for an AST, formatted like escodegen's default
+    output.
+    """
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        return CodeGenerator().generate(node)
+    finally:
+        sys.setrecursionlimit(limit)
@@ -0,0 +1,228 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Timing, memory, and AST statistics for a single input (``--profile``)."""
+
+from .defaults import PROFILE_JSON
+from .nodes import Node, walk
+from .transformations import Pass, State
+
+from contextlib import contextmanager
+from collections import Counter
+import json
+import time
+import tracemalloc
+
+
+def count_nodes(root: Node) -> int:
+    return sum(1 for _ in walk([root], unique=True))
+
+
+class TimedPass(Pass):
+    """Wraps a transformation pass, recording the time spent in it and the
+    most memory allocated by a single call to it (with `profiler`).
+    """
+    def __init__(self, tf_pass: Pass, profiler: "Profiler"):
+        self.tf_pass = tf_pass
+        self.profiler = profiler
+        self.node_types = tf_pass.node_types
+        self.change_types = tf_pass.change_types
+        self.may_change = tf_pass.may_change
+        self.skip = tf_pass.skip
+        self.budgeted = tf_pass.budgeted
+        self.seconds = 0.0
+        self.calls = 0
+        # The most traced memory in use during a call, above the amount in
+        # use when the call started.
+        self.peak_memory = 0
+
+    def process_node(self, node: Node):
+        profiler = self.profiler
+        profiler.start_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        self.tf_pass.process_node(node)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        peak = profiler.end_peak() - current
+        if peak > self.peak_memory:
+            self.peak_memory = peak
+
+
+class Profiler:
+    """Collects the statistics for one input. Memory is measured with
+    `tracemalloc`, which slows everything down, so times are best compared
+    with other profiles rather than with normal runs.
+    """
+    def __init__(self):
+        # Maps phase names to [seconds, peak memory in bytes].
+        self.phases: dict[str, list] = {}
+        self.passes: list[TimedPass] = []
+        # Time spent in each pass in other processes (see
+        # `add_pass_stats()`).
+        self.other_passes: dict[str, dict] = {}
+        self.stats = {}
+        # The peak memory of each phase in progress, so far.
+        self.peaks: list[int] = []
+        self.started_tracing = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        return self
+
+    def __exit__(self, *args):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def phase(self, name: str):
+        """Records the wall time and peak traced memory of a phase. Phases
+        can be nested, in which case the outer phase includes the inner one.
+        """
+        self.start_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = self.end_peak()
+            stats = self.phases.setdefault(name, [0.0, 0])
+            stats[0] += seconds
+            stats[1] = max(stats[1], peak)
+
+    def update_peak(self):
+        if self.peaks:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peaks[-1] = max(self.peaks[-1], peak)
+
+    def start_peak(self):
+        """Starts measuring the peak traced memory, until the matching call
+        to `end_peak()`. Measurements can be nested.
+        """
+        self.update_peak()
+        tracemalloc.reset_peak()
+        self.peaks.append(0)
+
+    def end_peak(self) -> int:
+        """Returns the peak traced memory since the matching call to
+        `start_peak()`.
+        """
+        self.update_peak()
+        peak = self.peaks.pop()
+        if self.peaks:
+            self.peaks[-1] = max(self.peaks[-1], peak)
+        return peak
+
+    def wrap_passes(self, passes: list[Pass]) -> list[TimedPass]:
+        # In streaming mode, this is called once for each chunk.
+        wrapped = [TimedPass(tf_pass, self) for tf_pass in passes]
+        self.passes += wrapped
+        return wrapped
+
+    def add_pass_stats(self, passes: dict):
+        """Adds the time spent in each pass in another process (the
+        ``"passes"`` item of the other process's `report()`). With
+        ``--jobs``, the times of the passes run in parallel are added
+        together, so they can be greater than the time of the transform
+        phase.
+        """
+        for name, stats in passes.items():
+            totals = self.other_passes.setdefault(name, {
+                "seconds": 0.0,
+                "calls": 0,
+                "peak_memory": 0,
+            })
+            totals["seconds"] += stats["seconds"]
+            totals["calls"] += stats["calls"]
+            totals["peak_memory"] = max(
+                totals["peak_memory"], stats["peak_memory"],
+            )
+
+    def record_ast(self, key: str, ast: Node):
+        """Adds the number of nodes in `ast` to the count for `key`. (In
+        streaming mode, this is called once for each chunk.)
+        """
+        nodes = self.stats.setdefault("nodes", {})
+        nodes[key] = nodes.get(key, 0) + count_nodes(ast)
+
+    def record_state(self, state: State):
+        stats = state.block_stats
+        self.stats["temporaries"] = state.id_num
+        self.stats["skipped_nodes"] = state.skipped_nodes
+        self.stats["budget_exhausted"] = state.budget_exhausted
+        self.stats["blocks"] = len(stats)
+        self.stats["statements_processed"] = sum(b.processed for b in stats)
+        self.stats["max_rounds"] = max((b.rounds for b in stats), default=0)
+        # Number of blocks that needed each number of rounds.
+        rounds = Counter(b.rounds for b in stats)
+        self.stats["rounds"] = {str(n): rounds[n] for n in sorted(rounds)}
+
+    def report(self) -> dict:
+        passes = {
+            name: dict(stats) for name, stats in self.other_passes.items()
+        }
+        for timed in self.passes:
+            stats = passes.setdefault(type(timed.tf_pass).__name__, {
+                "seconds": 0.0,
+                "calls": 0,
+                "peak_memory": 0,
+            })
+            stats["seconds"] += timed.seconds
+            stats["calls"] += timed.calls
+            stats["peak_memory"] = max(
+                stats["peak_memory"], timed.peak_memory,
+            )
+        return {
+            "phases": {
+                name: {"seconds": seconds, "peak_memory": peak}
+                for name, (seconds, peak) in self.phases.items()
+            },
+            "passes": passes,
+            **self.stats,
+        }
+
+
+def format_report(report: dict, fmt: str) -> str:
+    if fmt == PROFILE_JSON:
+        return json.dumps(report)
+    lines = []
+    for name, phase in report["phases"].items():
+        lines.append(
+            f"{name:<20} {phase['seconds']:9.3f} s  "
+            f"{phase['peak_memory'] / 1024 / 1024:9.1f} MiB peak",
+        )
+    for name, tf_pass in report["passes"].items():
+        lines.append(
+            f"  {name:<18} {tf_pass['seconds']:9.3f} s  "
+            f"{tf_pass['peak_memory'] / 1024:9.1f} KiB peak  "
+            f"{tf_pass['calls']:9} nodes",
+        )
+    for key, count in report.get("nodes", {}).items():
+        lines.append(f"{'nodes (' + key + ')':<20} {count:9}")
+    if "temporaries" in report:
+        lines.append(f"{'temporaries':<20} {report['temporaries']:9}")
+        lines.append(
+            f"{'blocks':<20} {report['blocks']:9}  "
+            f"({report['statements_processed']} statements processed)",
+        )
+        lines.append("rounds per block     " + ", ".join(
+            f"{n}: {count}" for n, count in report["rounds"].items()
+        ))
+    return "\n".join(lines)
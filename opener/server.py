@@ -0,0 +1,411 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""A long-running HTTP server (``--serve``) that deobfuscates code.
+
+Requests are handled by a pool of worker processes, each of which keeps its
+own codegen.js process (and parser process, with ``--parser=node``) running,
+so a request doesn't pay for any startup. A worker that exceeds the time
+limit is killed and replaced. ``--codegen``, ``--codegen-format``,
+``--parser``, ``--cache``, and the budget options apply to every request.
+
+To deobfuscate code, POST it to any path. The optional query parameters
+``prefix`` and ``output`` ("js" or "ast") correspond to ``--prefix`` and
+``--ast``. The response is the output of ``opener.py`` (status 200), or an
+error message: 400 if the code couldn't be parsed (or the request is
+invalid), 413 if it's too large, 503 if it took too long, or 500 for any
+other error. If the budget ran out, the output is only partially
+deobfuscated, and the response has an ``Opener-Budget-Exhausted: true``
+header.
+"""
+
+from .defaults import (
+    CODEGEN_PYTHON, DEFAULT_CACHE_SIZE_MIB, DEFAULT_CODEGEN,
+    DEFAULT_CODEGEN_FORMAT, DEFAULT_PARSER, DEFAULT_TEMP_PREFIX, OUTPUT_AST,
+    OUTPUT_JS, OUTPUTS, PARSER_NODE,
+)
+
+from contextlib import ExitStack
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+import errno
+import io
+import multiprocessing
+import os
+import queue
+import signal
+import socketserver
+import stat
+import sys
+import time
+
+# Set to "true" in responses whose output is only partially deobfuscated
+# because the budget ran out.
+BUDGET_EXHAUSTED_HEADER = "Opener-Budget-Exhausted"
+
+# Kinds of results sent by worker processes.
+RESULT_OK = "ok"
+RESULT_INVALID = "invalid"
+RESULT_ERROR = "error"
+
+
+class Timeout(Exception):
+    pass
+
+
+@dataclass
+class WorkerOptions:
+    """Options that apply to every request, from the command line."""
+    codegen: str = DEFAULT_CODEGEN
+    codegen_format: str = DEFAULT_CODEGEN_FORMAT
+    parser: str = DEFAULT_PARSER
+    cache_path: Optional[str] = None
+    cache_size: int = DEFAULT_CACHE_SIZE_MIB * 1024 * 1024
+    # Limits for the `budget.Budget` used for each request, if any.
+    budget_seconds: Optional[float] = None
+    budget_work: Optional[int] = None
+
+
+def worker_main(conn: Connection, options: WorkerOptions):
+    """Runs in each worker process. Receives requests (tuples of the source,
+    temporary prefix, and output format) and sends back results (tuples of
+    one of the ``RESULT_*`` constants, the output or an error message, and
+    whether the output is only partially deobfuscated).
+    """
+    from .budget import Budget
+    from .pipeline import process
+    import esprima
+    # Interrupting the server (e.g., with Ctrl-C) shouldn't interrupt the
+    # workers, which exit once their connection is closed.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def deobfuscate(source: str, temp_prefix: str, emit_ast: bool):
+        if cache is not None:
+            output = cache.get(
+                source,
+                temp_prefix=temp_prefix,
+                emit_ast=emit_ast,
+            )
+            if output is not None:
+                return (RESULT_OK, output, False)
+        budget = None
+        if (
+            options.budget_seconds is not None or
+            options.budget_work is not None
+        ):
+            budget = Budget(
+                seconds=options.budget_seconds,
+                work=options.budget_work,
+            )
+        out = io.StringIO()
+        state = process(
+            source, out,
+            temp_prefix=temp_prefix,
+            emit_ast=emit_ast,
+            codegen=options.codegen,
+            worker=worker,
+            parse_worker=parse_worker,
+            cache=cache,
+            budget=budget,
+        )
+        output = out.getvalue()
+        # Partially deobfuscated output isn't cached.
+        if cache is not None and not state.budget_exhausted:
+            cache.put(
+                source, output,
+                temp_prefix=temp_prefix,
+                emit_ast=emit_ast,
+            )
+        return (RESULT_OK, output, state.budget_exhausted)
+
+    with ExitStack() as stack:
+        worker = parse_worker = cache = None
+        if options.codegen != CODEGEN_PYTHON:
+            from .codegen import CodegenWorker
+            worker = stack.enter_context(
+                CodegenWorker(options.codegen_format),
+            )
+        if options.parser == PARSER_NODE:
+            from .node_parser import ParseWorker
+            parse_worker = stack.enter_context(ParseWorker())
+        if options.cache_path is not None:
+            from .cache import ResultCache
+            cache = stack.enter_context(
+                ResultCache(options.cache_path, options.cache_size),
+            )
+        # Start codegen.js (and the parser) before the first request.
+        deobfuscate("", DEFAULT_TEMP_PREFIX, emit_ast=False)
+        while True:
+            try:
+                source, temp_prefix, output = conn.recv()
+            except EOFError:
+                break
+            try:
+                result = deobfuscate(
+                    source, temp_prefix, emit_ast=(output == OUTPUT_AST),
+                )
+            except esprima.Error as e:
+                result = (RESULT_INVALID, f"{type(e).__name__}: {e}", False)
+            except Exception as e:
+                result = (RESULT_ERROR, f"{type(e).__name__}: {e}", False)
+            conn.send(result)
+
+
+class Worker:
+    def __init__(self, context, options: WorkerOptions):
+        self.conn, child_conn = context.Pipe()
+        self.proc = context.Process(
+            target=worker_main,
+            args=(child_conn, options),
+            daemon=True,
+        )
+        self.proc.start()
+        child_conn.close()
+
+    def close(self):
+        self.conn.close()
+        self.proc.join()
+
+    def kill(self):
+        self.proc.kill()
+        self.close()
+
+
+class WorkerPool:
+    """A thread-safe pool of worker processes."""
+    def __init__(self, size: int, options: WorkerOptions):
+        # Workers may be replaced while other threads are running, so they
+        # aren't forked.
+        self.context = multiprocessing.get_context("spawn")
+        self.options = options
+        self.workers = queue.LifoQueue()
+        for _ in range(size):
+            self.workers.put(Worker(self.context, options))
+        self.size = size
+
+    def close(self):
+        for _ in range(self.size):
+            self.workers.get().close()
+
+    def run(self, request: tuple, timeout: float) -> tuple:
+        """Sends `request` to an idle worker and returns its result. Raises
+        `Timeout` if that takes longer than `timeout` seconds, including the
+        time spent waiting for a worker.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self.workers.get(timeout=timeout)
+        except queue.Empty:
+            raise Timeout()
+        result = None
+        try:
+            worker.conn.send(request)
+            remaining = max(0.0, deadline - time.monotonic())
+            if not worker.conn.poll(remaining):
+                raise Timeout()
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            # The worker died (`send()` raises `BrokenPipeError` if it
+            # exited before the request was sent).
+            result = (
+                RESULT_ERROR, "Worker process exited unexpectedly", False,
+            )
+        finally:
+            if result is None or not worker.proc.is_alive():
+                worker.kill()
+                worker = Worker(self.context, self.options)
+            self.workers.put(worker)
+        return result
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Allows clients to keep connections open between requests.
+    protocol_version = "HTTP/1.1"
+    server: "Server"
+
+    def do_POST(self):
+        server = self.server
+        length = self.headers.get("Content-Length")
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            self.close_connection = True
+            self.reply(HTTPStatus.LENGTH_REQUIRED, "Content-Length required")
+            return
+        if length < 0:
+            # The end of the body can't be found.
+            self.close_connection = True
+            self.reply(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+            return
+        if length > server.max_size:
+            self.close_connection = True
+            self.reply(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Input is larger than {server.max_size} bytes",
+            )
+            return
+        body = self.rfile.read(length)
+
+        params = parse_qs(urlsplit(self.path).query)
+        temp_prefix = params.get("prefix", [DEFAULT_TEMP_PREFIX])[-1]
+        output = params.get("output", [OUTPUT_JS])[-1]
+        if output not in OUTPUTS:
+            self.reply(
+                HTTPStatus.BAD_REQUEST,
+                f"Unknown output format: {output}",
+            )
+            return
+        try:
+            source = body.decode("utf8")
+        except UnicodeDecodeError as e:
+            self.reply(HTTPStatus.BAD_REQUEST, f"Invalid UTF-8: {e}")
+            return
+
+        try:
+            kind, text, budget_exhausted = server.pool.run(
+                (source, temp_prefix, output),
+                server.timeout_seconds,
+            )
+        except Timeout:
+            self.reply(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                f"Took longer than {server.timeout_seconds} seconds",
+            )
+            return
+        if kind == RESULT_INVALID:
+            self.reply(HTTPStatus.BAD_REQUEST, text)
+        elif kind == RESULT_ERROR:
+            self.reply(HTTPStatus.INTERNAL_SERVER_ERROR, text)
+        else:
+            headers = {}
+            if budget_exhausted:
+                headers[BUDGET_EXHAUSTED_HEADER] = "true"
+            content_type = "text/javascript"
+            if output == OUTPUT_AST:
+                content_type = "application/json"
+            self.reply(HTTPStatus.OK, text, content_type, headers)
+
+    def reply(
+        self,
+        status: HTTPStatus,
+        text: str,
+        content_type="text/plain",
+        headers: Optional[dict[str, str]] = None,
+    ):
+        if content_type == "text/plain" and not text.endswith("\n"):
+            text += "\n"
+        data = text.encode("utf8", "surrogatepass")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Clients of Unix sockets don't have addresses.
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "-"
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+
+class Server:
+    pool: WorkerPool
+    max_size: int
+    timeout_seconds: float
+    verbose: bool
+
+
+class TCPServer(Server, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(Server, socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        super().server_bind()
+        # Used by `BaseHTTPRequestHandler`.
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def remove_stale_socket(path: str):
+    """Removes the Unix socket at `path` left by a previous server, so that
+    a new one can be bound there. Raises `OSError` if `path` exists but isn't
+    a socket.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(
+            errno.EADDRINUSE, "Address in use (not a socket)", path,
+        )
+    os.remove(path)
+
+
+def make_server(address: str) -> Server:
+    """Creates a server listening on `address`: a path (containing a slash)
+    for a Unix socket, or a host and port separated by a colon for TCP.
+    """
+    if "/" in address:
+        remove_stale_socket(address)
+        return UnixServer(address, RequestHandler)
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        raise ValueError(f"Invalid address: {address}")
+    return TCPServer((host or "localhost", int(port)), RequestHandler)
+
+
+def serve(
+    address: str, *,
+    jobs: int,
+    options: WorkerOptions,
+    max_size: int,
+    timeout: float,
+    verbose=False,
+):
+    """Handles requests on `address` (see `make_server()`) until
+    interrupted. `options` apply to every request.
+    """
+    server = make_server(address)
+    try:
+        server.pool = WorkerPool(jobs, options)
+        server.max_size = max_size
+        server.timeout_seconds = timeout
+        server.verbose = verbose
+        print(f"Listening on {address}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.pool.close()
+    finally:
+        server.server_close()
+        if isinstance(server, UnixServer):
+            os.remove(address)
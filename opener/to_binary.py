@@ -0,0 +1,264 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""A compact binary representation of ASTs, which can be sent to codegen.js
+instead of JSON (``--codegen-format=binary``).
+
+The representation starts with `MAGIC` (a zero byte, which can't start a JSON
+document) and is followed by a single value. Each value is a tag byte,
+followed by:
+
+* `TAG_NULL`, `TAG_TRUE`, `TAG_FALSE`: nothing.
+* `TAG_INT`: a non-negative integer, as a varint (7 bits per byte, least
+  significant first, with the high bit set on every byte but the last).
+* `TAG_FLOAT`: a big-endian IEEE 754 double.
+* `TAG_STRING`: the length of the string in bytes (a varint) followed by its
+  UTF-8 encoding.
+* `TAG_STRING_UTF16`: the same, but UTF-16LE, for strings containing lone
+  surrogates, which UTF-8 can't represent. These strings are never added to
+  the string table.
+* `TAG_NEW_STRING`: the same as `TAG_STRING`, but the string is also added to
+  the string table (with the next index, starting at 0).
+* `TAG_STRING_REF`: the index of a string in the string table (a varint).
+* `TAG_LIST`: the number of items (a varint) followed by each item.
+* `TAG_NEW_OBJECT`: an object with a new shape. The number of keys (a
+  varint), followed by each key (in the same format as `TAG_STRING`),
+  followed by the value of each key. The keys are added to the shape table.
+* `TAG_OBJECT`: the index of a shape (a varint) followed by the value of each
+  of its keys.
+
+Node types and field names are thus sent once per request, as are short
+strings, such as identifier names, which tend to repeat. The decoded object
+is the same as parsing the output of `write_json()` would produce.
+"""
+
+from .nodes import Node
+from .to_json import (
+    KEY_MAP, PATTERN_PLACEHOLDER, RECURSION_ERROR_JSON, iter_dict_items,
+    iter_node_items,
+)
+
+from esprima.objects import Object
+
+from json import loads
+from typing import BinaryIO
+import re
+import struct
+
+MAGIC = b"\x00"
+
+TAG_NULL = 0
+TAG_TRUE = 1
+TAG_FALSE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING = 5
+TAG_STRING_UTF16 = 6
+TAG_NEW_STRING = 7
+TAG_STRING_REF = 8
+TAG_LIST = 9
+TAG_NEW_OBJECT = 10
+TAG_OBJECT = 11
+
+# Strings longer than this aren't added to the string table.
+MAX_INTERNED_LENGTH = 64
+
+# Integers at least this large are sent as doubles, which is how JavaScript
+# represents them anyway.
+MAX_INT = 2 ** 53
+
+# Writes to the output are batched into groups of this many pieces.
+FLUSH_PIECES = 8192
+
+NULL = bytes([TAG_NULL])
+TRUE = bytes([TAG_TRUE])
+FALSE = bytes([TAG_FALSE])
+FLOAT = struct.Struct(">Bd").pack
+SMALL_VARINTS = [bytes([n]) for n in range(0x80)]
+SMALL_INTS = [bytes([TAG_INT, n]) for n in range(0x80)]
+SMALL_STRING_REFS = [bytes([TAG_STRING_REF, n]) for n in range(0x80)]
+SMALL_OBJECTS = [bytes([TAG_OBJECT, n]) for n in range(0x80)]
+EMPTY_LIST = bytes([TAG_LIST, 0])
+
+# Written in place of an object that contains itself, like `write_json()`.
+RECURSION_ERROR = list(loads(RECURSION_ERROR_JSON).items())
+
+
+def varint(n: int) -> bytes:
+    if n < 0x80:
+        return SMALL_VARINTS[n]
+    data = bytearray()
+    while n >= 0x80:
+        data.append(n & 0x7f | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+
+def encode_string(tag: int, value: str) -> bytes:
+    """Encodes a string as a `TAG_STRING` value (or `TAG_STRING_UTF16`, if
+    necessary), but with the given tag.
+    """
+    try:
+        data = value.encode("utf8")
+    except UnicodeEncodeError:
+        data = value.encode("utf-16-le", "surrogatepass")
+        tag = TAG_STRING_UTF16
+    return bytes([tag]) + varint(len(data)) + data
+
+
+PATTERN = encode_string(TAG_STRING, loads(PATTERN_PLACEHOLDER))
+
+
+def encode_number(value) -> bytes:
+    if isinstance(value, int) and 0 <= value < MAX_INT:
+        if value < 0x80:
+            return SMALL_INTS[value]
+        return bytes([TAG_INT]) + varint(value)
+    try:
+        return FLOAT(TAG_FLOAT, value)
+    except OverflowError:
+        # An integer too large to be a double; JSON.parse() would produce
+        # infinity.
+        return FLOAT(TAG_FLOAT, float("inf") if value > 0 else -float("inf"))
+
+
+def encode_shape(index: int) -> bytes:
+    if index < 0x80:
+        return SMALL_OBJECTS[index]
+    return bytes([TAG_OBJECT]) + varint(index)
+
+
+def encode_new_shape(keys: tuple[str, ...]) -> bytes:
+    return b"".join([
+        bytes([TAG_NEW_OBJECT]),
+        varint(len(keys)),
+        *(encode_string(TAG_STRING, key)[1:] for key in keys),
+    ])
+
+
+def write_binary(root, out: BinaryIO):
+    """Writes the binary representation of an AST to `out`."""
+    strings: dict[str, int] = {}
+    shapes: dict[tuple[str, ...], int] = {}
+    # The encoded shape of each class of node whose fields are all present.
+    class_shapes: dict[type, bytes] = {}
+    pieces = [MAGIC]
+    append = pieces.append
+    get = object.__getattribute__
+
+    def shape(keys: tuple[str, ...]) -> bytes:
+        index = shapes.get(keys)
+        if index is not None:
+            return encode_shape(index)
+        shapes[keys] = len(shapes)
+        return encode_new_shape(keys)
+
+    def object_items(items: list) -> tuple[bytes, list]:
+        """Returns the encoded shape and the values of an object, given its
+        (key, value) pairs.
+        """
+        return shape(tuple(key for key, _ in items)), [v for _, v in items]
+
+    def node_items(node: Node) -> tuple[bytes, list]:
+        cls = type(node)
+        try:
+            values = [get(node, name) for name in cls.fields]
+        except AttributeError:
+            # A field has been deleted (see `Node.items()`).
+            return object_items(list(iter_node_items(node)))
+        encoded = class_shapes.get(cls)
+        if encoded is not None:
+            return encoded, values
+        keys = tuple(KEY_MAP.get(name, name) for name in cls.fields)
+        encoded = shape(keys)
+        class_shapes[cls] = encode_shape(shapes[keys])
+        return encoded, values
+
+    # Each frame contains an iterator over the remaining values of an object
+    # or list, and the ID of the object (for detecting cycles).
+    stack = [(iter([root]), None)]
+    on_stack = set()
+    while stack:
+        values, frame_id = stack[-1]
+        for value in values:
+            if isinstance(value, str):
+                index = strings.get(value)
+                if index is not None:
+                    if index < 0x80:
+                        append(SMALL_STRING_REFS[index])
+                    else:
+                        append(bytes([TAG_STRING_REF]) + varint(index))
+                elif len(value) <= MAX_INTERNED_LENGTH:
+                    data = encode_string(TAG_NEW_STRING, value)
+                    # Strings sent as UTF-16 aren't added to the table.
+                    if data[0] == TAG_NEW_STRING:
+                        strings[value] = len(strings)
+                    append(data)
+                else:
+                    append(encode_string(TAG_STRING, value))
+                continue
+
+            if isinstance(value, Object):
+                value = value.__dict__
+            if isinstance(value, (Node, dict)):
+                value_id = id(value)
+                if value_id in on_stack:
+                    encoded, items = object_items(RECURSION_ERROR)
+                    value_id = None
+                else:
+                    if isinstance(value, Node):
+                        encoded, items = node_items(value)
+                    else:
+                        encoded, items = object_items(
+                            list(iter_dict_items(value)),
+                        )
+                    on_stack.add(value_id)
+                append(encoded)
+                stack.append((iter(items), value_id))
+                break
+
+            if isinstance(value, list):
+                if not value:
+                    append(EMPTY_LIST)
+                    continue
+                append(bytes([TAG_LIST]) + varint(len(value)))
+                stack.append((iter(value), None))
+                break
+            if value is None:
+                append(NULL)
+            elif value is True:
+                append(TRUE)
+            elif value is False:
+                append(FALSE)
+            elif isinstance(value, (int, float)):
+                append(encode_number(value))
+            elif isinstance(value, re.Pattern):
+                append(PATTERN)
+            else:
+                raise TypeError(
+                    f"Object of type {type(value).__name__} can't be "
+                    "represented in binary",
+                )
+        else:
+            stack.pop()
+            on_stack.discard(frame_id)
+
+        if len(pieces) >= FLUSH_PIECES:
+            out.write(b"".join(pieces))
+            pieces.clear()
+    out.write(b"".join(pieces))
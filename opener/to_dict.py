@@ -28,45 +28,63 @@
 # All modifications in this file are released under the same license
 # as the original.
 
-from esprima.visitor import Visited, Visitor
+from .nodes import Node
+from .to_json import iter_dict_items, iter_node_items
 
+from esprima.objects import Object
+import re
 
-def to_dict(node):
-    return ToDictVisitor().visit(node)
+RECURSION_ERROR = {"error": "Infinite recursion detected..."}
 
 
-class ToDictVisitor(Visitor):
-    map = {
-        "isAsync": "async",
-        "allowAwait": "await",
-    }
+def to_dict(root):
+    """Converts an AST to the dicts and lists of its JSON representation.
+    The tree is walked with an explicit stack, so it can be nested
+    arbitrarily deeply. An object that contains itself is replaced with
+    `RECURSION_ERROR` where it recurs.
+    """
+    result = []
+    # Each frame contains an iterator over the remaining (key, value) pairs
+    # of an object (or (None, value) pairs of a list), the dict or list
+    # they're added to, and the object's ID (for detecting cycles).
+    stack = [(iter([(None, root)]), result, None)]
+    on_stack = set()
+    while stack:
+        items, container, frame_id = stack[-1]
+        for key, value in items:
+            if isinstance(value, Node):
+                children = iter_node_items(value)
+            elif isinstance(value, Object):
+                value = value.__dict__
+                children = iter_dict_items(value)
+            elif isinstance(value, dict):
+                children = iter_dict_items(value)
+            elif isinstance(value, list):
+                children = ((None, elem) for elem in value)
+            else:
+                children = None
 
-    def visit_RecursionError(self, obj):
-        yield Visited({
-            "error": "Infinite recursion detected...",
-        })
+            value_id = None
+            if children is None:
+                # Regex patterns aren't needed by escodegen.
+                new_value = {} if isinstance(value, re.Pattern) else value
+            elif id(value) in on_stack:
+                new_value = dict(RECURSION_ERROR)
+                children = None
+            else:
+                new_value = [] if isinstance(value, list) else {}
+                if not isinstance(value, list):
+                    value_id = id(value)
+                    on_stack.add(value_id)
 
-    def visit_Object(self, obj):
-        obj = yield obj.__dict__
-        yield Visited(obj)
-
-    def visit_list(self, obj):
-        items = []
-        for item in obj:
-            v = yield item
-            items.append(v)
-        yield Visited(items)
-
-    visit_Array = visit_list
-
-    def visit_dict(self, obj):
-        items = []
-        for k, item in obj.items():
-            if not k.startswith("_"):
-                v = yield item
-                k = str(k)
-                items.append((self.map.get(k, k), v))
-        yield Visited(dict(items))
-
-    def visit_SRE_Pattern(self, obj):
-        yield Visited({})
+            if key is None:
+                container.append(new_value)
+            else:
+                container[key] = new_value
+            if children is not None:
+                stack.append((children, new_value, value_id))
+                break
+        else:
+            stack.pop()
+            on_stack.discard(frame_id)
+    return result[0]
@@ -0,0 +1,133 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+from .nodes import Node
+
+from esprima.objects import Object
+
+from json.encoder import encode_basestring_ascii
+from typing import TextIO
+import re
+
+# Writes to the output are batched into groups of this many pieces.
+FLUSH_PIECES = 8192
+
+KEY_MAP = {
+    "isAsync": "async",
+    "allowAwait": "await",
+}
+
+# Regex patterns aren't JSON-serializable, but escodegen shouldn't need them.
+PATTERN_PLACEHOLDER = encode_basestring_ascii(
+    "THIS_SHOULD_NOT_APPEAR_IN_GENERATED_CODE!",
+)
+
+RECURSION_ERROR_JSON = '{"error": "Infinite recursion detected..."}'
+
+
+def encode_scalar(value) -> str:
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value == float("inf"):
+            return "Infinity"
+        if value == -float("inf"):
+            return "-Infinity"
+        return float.__repr__(value)
+    if isinstance(value, re.Pattern):
+        return PATTERN_PLACEHOLDER
+    raise TypeError(
+        f"Object of type {type(value).__name__} is not JSON serializable",
+    )
+
+
+def iter_dict_items(obj: dict):
+    for key, value in obj.items():
+        if not key.startswith("_"):
+            yield KEY_MAP.get(key, key), value
+
+
+def iter_node_items(node: Node):
+    for key, value in node.items():
+        yield KEY_MAP.get(key, key), value
+
+
+def write_json(root, out: TextIO):
+    """Writes the JSON representation of an AST to `out`, without building an
+    intermediate dict like `to_dict()` does. The output is identical to that
+    of ``json.dump(to_dict(root), out)``.
+    """
+    pieces = []
+    append = pieces.append
+
+    # Each frame contains an iterator over the remaining (key, value) pairs
+    # of an object (or (None, value) pairs of a list), the closing bracket,
+    # the object's ID (for detecting cycles), and whether any items have been
+    # written yet.
+    stack = [[iter([(None, root)]), "", None, False]]
+    on_stack = set()
+    while stack:
+        frame = stack[-1]
+        for key, value in frame[0]:
+            if frame[3]:
+                append(", ")
+            frame[3] = True
+            if key is not None:
+                append(encode_basestring_ascii(key))
+                append(": ")
+
+            if isinstance(value, Node):
+                items = iter_node_items(value)
+            elif isinstance(value, Object):
+                value = value.__dict__
+                items = iter_dict_items(value)
+            elif isinstance(value, dict):
+                items = iter_dict_items(value)
+            else:
+                items = None
+            if items is not None:
+                if id(value) in on_stack:
+                    append(RECURSION_ERROR_JSON)
+                    continue
+                on_stack.add(id(value))
+                append("{")
+                stack.append([items, "}", id(value), False])
+                break
+            if isinstance(value, list):
+                append("[")
+                stack.append([((None, v) for v in value), "]", None, False])
+                break
+            append(encode_scalar(value))
+        else:
+            stack.pop()
+            append(frame[1])
+            on_stack.discard(frame[2])
+
+        if len(pieces) >= FLUSH_PIECES:
+            out.write("".join(pieces))
+            pieces.clear()
+    out.write("".join(pieces))
@@ -15,25 +15,67 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Opener. If not, see <https://www.gnu.org/licenses/>.
 
+from .budget import Budget
 from .defaults import DEFAULT_TEMP_PREFIX
 
-from esprima.visitor import Visitor as BaseVisitor
-from esprima.nodes import Node
-from esprima.nodes import (
+from .nodes import Node, child_nodes, replace_child_nodes, walk
+from .nodes import (
     AssignmentExpression, BinaryExpression, BlockStatement, CallExpression,
     ConditionalExpression, ExpressionStatement, Identifier, IfStatement,
     Literal, Property, StaticMemberExpression, VariableDeclaration,
     VariableDeclarator, UnaryExpression,
 )
+from .prescan import ScanIndex, subtree_nodes
 
+from abc import ABC, abstractmethod
 from functools import wraps
-from typing import Optional
+from typing import Callable, Optional
+
+
+class BlockStats:
+    """Statistics for a block processed by `Unsequence`."""
+    def __init__(
+        self, *,
+        node_type: str,
+        statements: int,
+        rounds: int,
+        processed: int,
+    ):
+        self.node_type = node_type
+        # Number of statements in the block before processing.
+        self.statements = statements
+        # Number of rounds needed to reach a fixed point.
+        self.rounds = rounds
+        # Number of times a statement was processed, across all rounds.
+        self.processed = processed
+
+
+# Temporaries in a subtree that's transformed separately are created with
+# this prefix and numbered from 1, and later renumbered to follow the
+# temporaries before the subtree (see `renumber()`). It's a private-use
+# character, which isn't valid in identifiers.
+TEMP_PREFIX = "\ue000"
 
 
 class State:
-    def __init__(self, temp_prefix=DEFAULT_TEMP_PREFIX):
+    def __init__(
+        self,
+        temp_prefix=DEFAULT_TEMP_PREFIX, *,
+        budget: Optional[Budget] = None,
+    ):
         self.id_num = 0
         self.temp_prefix = temp_prefix
+        self.block_stats: list[BlockStats] = []
+        # Number of nodes in subtrees that weren't visited, as no pass would
+        # change them.
+        self.skipped_nodes = 0
+        # The index of the tree being transformed (see ``prescan.py``).
+        self.index: Optional[ScanIndex] = None
+        self.budget = budget
+
+    @property
+    def budget_exhausted(self) -> bool:
+        return self.budget is not None and self.budget.exhausted
 
     def make_id_str(self) -> str:
         self.id_num += 1
@@ -43,35 +85,88 @@ class State:
         return Identifier(self.make_id_str())
 
 
-def is_const(node) -> bool:
-    class Visitor(BaseVisitor):
-        def __init__(self):
-            self.all_const = True
-
-        def visit_Object(self, node):
-            self.all_const = False
-
-        def visit_Literal(self, node):
-            pass
-
-        def visit_LogicalExpression(self, node):
-            return super().visit_Object(node)
-
-        def visit_BinaryExpression(self, node):
-            return super().visit_Object(node)
-
-        def visit_UnaryExpression(self, node):
-            return super().visit_Object(node)
-
-        def visit_ConditionalExpression(self, node):
-            return super().visit_Object(node)
+# Flags describing a subtree. They're computed by `analyze()` and cached in
+# each node's `_analysis` attribute, which is ignored when converting the AST
+# to a dict.
+CONST = 1
+USES_FUNCTION_CONTEXT = 2
+
+# Names of node classes that are constant if all of their children are.
+# (`BinaryExpression` is also used for logical expressions.)
+CONST_OPERATOR_CLASSES = frozenset([
+    "BinaryExpression",
+    "UnaryExpression",
+    "ConditionalExpression",
+])
+
+# Names of node classes whose flags don't depend on their children.
+LEAF_CLASSES = frozenset([
+    "FunctionExpression",
+    "ThisExpression",
+    "Identifier",
+])
+
+
+def compute_flags(node: Node) -> int:
+    """Computes the analysis flags for `node`. Unless `node` is an instance of
+    one of `LEAF_CLASSES`, every child of `node` must already have cached
+    flags.
+    """
+    name = type(node).__name__
+    if name == "FunctionExpression":
+        # Function expressions are constant, and have their own context.
+        return CONST
+    if name == "ThisExpression":
+        return USES_FUNCTION_CONTEXT
+    if name == "Identifier":
+        return USES_FUNCTION_CONTEXT if node.name == "arguments" else 0
+
+    all_const = True
+    flags = 0
+    for child in child_nodes(node):
+        child_flags = child._analysis
+        all_const = all_const and bool(child_flags & CONST)
+        flags |= child_flags & USES_FUNCTION_CONTEXT
+    # Note that `RegexLiteral` isn't constant, as each evaluation creates a
+    # new object.
+    if name == "Literal" or (name in CONST_OPERATOR_CLASSES and all_const):
+        flags |= CONST
+    return flags
+
+
+def analyze(node: Node) -> int:
+    """Returns the analysis flags for `node`. Flags are computed bottom-up,
+    in a single pass, for every node in the subtree that doesn't already have
+    cached flags.
+    """
+    flags = node._analysis
+    if flags is not None:
+        return flags
+    stack = [(node, False)]
+    while stack:
+        current, children_done = stack.pop()
+        if children_done or type(current).__name__ in LEAF_CLASSES:
+            current._analysis = compute_flags(current)
+            continue
+        stack.append((current, True))
+        for child in child_nodes(current):
+            if child._analysis is None:
+                stack.append((child, False))
+    return node._analysis
+
+
+def invalidate(node: Optional[Node]):
+    """Discards the cached analysis of `node`. This must be done whenever its
+    children are modified. The analyses of its ancestors are not discarded,
+    but since transformations are applied in pre-order, any ancestors that
+    have already been visited will not be analyzed again.
+    """
+    if node is not None:
+        node._analysis = None
 
-        def visit_FunctionExpression(self, node):
-            pass
 
-    visitor = Visitor()
-    visitor.visit(node)
-    return visitor.all_const
+def is_const(node) -> bool:
+    return bool(analyze(node) & CONST)
 
 
 def is_no_op(node) -> bool:
@@ -79,38 +174,69 @@ def is_no_op(node) -> bool:
 
 
 def uses_function_context(node) -> bool:
-    class Visitor(BaseVisitor):
-        def __init__(self):
-            self.uses_context = False
-
-        def visit_FunctionExpression(self, node):
-            pass
-
-        def visit_ThisExpression(self, node):
-            self.uses_context = True
-
-        def visit_Identifier(self, node):
-            if node.name == "arguments":
-                self.uses_context = True
-
-    visitor = Visitor()
-    visitor.visit(node)
-    return visitor.uses_context
+    return bool(analyze(node) & USES_FUNCTION_CONTEXT)
 
 
 def track_shallow_identity_difference(func):
     """Decorator that sets ``self._changed`` to ``True`` if the node returned
     by the wrapped method is different from the provided node (checked
     shallowly using the ``is`` operator).
+
+    If the wrapped method changes anything (including nodes deeper in the
+    tree, or the provided list of additions), the cached analysis of the
+    provided node is discarded, as it may have been modified in place.
     """
     @wraps(func)
-    def result(self, node, *args, **kwargs):
-        new_node = func(self, node, *args, **kwargs)
+    def result(self, node, additions, *args, **kwargs):
+        changed = self._changed
+        self._changed = False
+        num_additions = len(additions)
+        new_node = func(self, node, additions, *args, **kwargs)
         self._changed |= node is not new_node
+        if self._changed or len(additions) != num_additions:
+            invalidate(node)
+        self._changed |= changed
         return new_node
     return result
 
 
+def rename_temporaries(nodes: list[Node], rename: Callable[[int], str]):
+    """Renames every temporary created with `TEMP_PREFIX` in `nodes` to
+    ``rename(n)``, where `n` is its number.
+    """
+    # Nodes can appear more than once in the tree, but must only be renamed
+    # once.
+    for node in walk(nodes, unique=True):
+        if node.type == "Identifier":
+            name = node.name
+            if name.startswith(TEMP_PREFIX):
+                node.name = rename(int(name[len(TEMP_PREFIX):]))
+
+
+def renumber(nodes: list[Node], prefix: str, offset: int):
+    """Renames every temporary created with `TEMP_PREFIX` in `nodes` so that
+    it uses `prefix` and comes after the first `offset` temporaries.
+    """
+    rename_temporaries(nodes, lambda num: f"{prefix}{num + offset}")
+
+
+def flatten_slots(slots: list[list]) -> list[Node]:
+    """Returns the statements in a list of slots created by
+    `Unsequence.process_block`, in order.
+    """
+    result = []
+    stack = [iter(slots)]
+    while stack:
+        for slot in stack[-1]:
+            if slot and isinstance(slot[0], list):
+                stack.append(iter(slot))
+                break
+            result += slot
+        else:
+            stack.pop()
+    return result
+
+
 def conditional_to_if(
     node: ConditionalExpression,
     dest: str,
@@ -134,7 +260,49 @@ def conditional_to_if(
     )
 
 
-class Unsequence:
+class Pass(ABC):
+    """A transformation pass. `process_node()` is called on every node whose
+    type is in `node_types` (or on every node, if `node_types` is None), in
+    pre-order. It may modify the node's descendants, but not replace the node
+    itself.
+    """
+    node_types: Optional[frozenset[str]] = None
+    # The types of nodes for which `may_change()` can return true (or None,
+    # if it can return true for any node).
+    change_types: Optional[frozenset[str]] = None
+    # Whether the pass stops once the `Budget` is exhausted. Passes that do a
+    # bounded amount of work per node keep running.
+    budgeted = False
+
+    @abstractmethod
+    def process_node(self, node: Node):
+        pass
+
+    def may_change(self, node: Node) -> bool:
+        """Returns whether this pass might change anything because of `node`,
+        when processing it or one of its ancestors. If this is false for every
+        node in a subtree, the subtree isn't visited (see ``prescan.py``).
+        """
+        return True
+
+    def skip(self, nodes: list[Node]):
+        """Called with the nodes in a subtree that isn't visited, in
+        pre-order.
+        """
+
+
+class Unsequence(Pass):
+    node_types = frozenset(["Program", "BlockStatement", "SwitchCase"])
+    budgeted = True
+    change_types = frozenset([
+        "SequenceExpression",
+        "ExpressionStatement",
+        "ConditionalExpression",
+        "VariableDeclaration",
+        "IfStatement",
+        "ForStatement",
+    ])
+
     def __init__(self, state: State):
         self.state = state
         self._changed = False
@@ -145,28 +313,100 @@ class Unsequence:
         elif node.type == "SwitchCase":
             self.process_block(node, body_attr="consequent")
 
+    def may_change(self, node: Node) -> bool:
+        # Everything else is only changed when something in it changes.
+        if node.type == "SequenceExpression":
+            return True
+        if node.type == "ExpressionStatement":
+            expr = node.expression
+            return (
+                expr.type == "LogicalExpression" and
+                expr.operator in ["&&", "||"] or
+                expr.type == "ConditionalExpression" or
+                is_no_op(expr)
+            )
+        if node.type == "ConditionalExpression":
+            return node.alternate.type == "ConditionalExpression"
+        if node.type == "VariableDeclaration":
+            return len(node.declarations) > 1
+        if node.type == "IfStatement":
+            # Wrapped in a block to avoid dangling else ambiguity.
+            return node.consequent.type == "IfStatement"
+        if node.type == "ForStatement":
+            return (
+                node.update is not None and
+                node.body.type != "BlockStatement"
+            )
+        return False
+
+    def skip(self, nodes: list[Node]):
+        # Record the same statistics as if each block had been processed.
+        for node in nodes:
+            if node.type in self.node_types:
+                body = node.consequent if node.type == "SwitchCase" else (
+                    node.body
+                )
+                self.state.block_stats.append(BlockStats(
+                    node_type=node.type,
+                    statements=len(body),
+                    rounds=int(bool(body)),
+                    processed=len(body),
+                ))
+
     def process_block(self, node: Node, *, body_attr="body"):
-        while True:
-            self._changed = False
-            self.process_block_once(node, body_attr=body_attr)
-            if not self._changed:
+        # Each statement is stored in a "slot" (a single-element list). When
+        # processing a statement changes anything, its slot's contents are
+        # replaced with new slots for each of the resulting statements, which
+        # are processed again in the next round. Statements that didn't change
+        # are never processed again. The slots that need processing are
+        # always handled in source order, so temporaries are numbered the
+        # same way as if the entire block were processed in each round.
+        body = getattr(node, body_attr)
+        slots = [[child] for child in body]
+        worklist = slots
+        rounds = 0
+        processed = 0
+        changed = False
+        while worklist and not self.state.budget_exhausted:
+            rounds += 1
+            processed += len(worklist)
+            worklist, round_changed = self.process_slots(worklist)
+            changed |= round_changed
+
+        self.state.block_stats.append(BlockStats(
+            node_type=node.type,
+            statements=len(body),
+            rounds=rounds,
+            processed=processed,
+        ))
+        if changed:
+            setattr(node, body_attr, flatten_slots(slots))
+            invalidate(node)
+
+    def process_slots(self, slots: list[list]) -> tuple[list[list], bool]:
+        """Processes the statement in each slot. Returns a list of new slots
+        that need to be processed again, and whether any slots changed. Stops
+        early if the budget is exhausted.
+        """
+        budget = self.state.budget
+        new_slots = []
+        changed = False
+        for slot in slots:
+            # A single statement can take a while to process, so the clock is
+            # checked before each one.
+            if budget is not None and budget.check():
                 break
-
-    def process_block_once(self, node: Node, *, body_attr="body"):
-        children = []
-        for i, child in enumerate(getattr(node, body_attr)):
-            new_child = self.handle_statement(child, children)
+            additions = []
+            self._changed = False
+            new_child = self.handle_statement(slot[0], additions)
+            if not (self._changed or additions):
+                continue
             if new_child is not None:
-                children.append(new_child)
-
-        # It's possible for the two lengths to be equal, even when there
-        # are new additions, if there were an equal number of additions and
-        # deletions, but deletions imply that `self._changed` has already been
-        # set to `True`, as they involve `handle_statement()` returning a
-        # different node type (`None` rather than whatever statement type was
-        # passed in).
-        self._changed |= len(children) != len(getattr(node, body_attr))
-        setattr(node, body_attr, children)
+                additions.append(new_child)
+            slot[:] = [[child] for child in additions]
+            new_slots += slot
+            changed = True
+        return new_slots, changed
 
     @track_shallow_identity_difference
     def handle_statement(
@@ -174,6 +414,8 @@ class Unsequence:
         node: Node,
         additions: list[Node],
     ) -> Optional[Node]:
+        if self.state.budget is not None:
+            self.state.budget.spend()
         if node.type == "ExpressionStatement":
             return self.handle_expression_statement(node, additions)
 
@@ -200,6 +442,7 @@ class Unsequence:
             decl = node.declarations[0]
             if decl.init is not None:
                 decl.init = self.handle_expression(decl.init, additions)
+                invalidate(decl)
             return node
 
         if node.type == "IfStatement":
@@ -266,7 +509,10 @@ class Unsequence:
                 )
                 if node.body.type != "BlockStatement":
                     node.body = BlockStatement([node.body])
+                elif update_additions and self.state.index is not None:
+                    self.state.index.expand(node.body)
                 node.body.body += update_additions
+                invalidate(node.body)
             return node
 
         if node.type in ["ForOfStatement", "ForInStatement"]:
@@ -620,15 +866,15 @@ class Unsequence:
         ), additions)
 
 
-class Respelling:
+class Respelling(Pass):
+    change_types = frozenset(["UnaryExpression"])
+
+    def may_change(self, node: Node) -> bool:
+        return self.handle_child(node) is not node
+
     def process_node(self, node: Node):
-        for key, value in node.items():
-            if isinstance(value, list):
-                for i, elem in enumerate(value):
-                    if isinstance(elem, Node):
-                        value[i] = self.handle_child(elem)
-            elif isinstance(value, Node):
-                setattr(node, key, self.handle_child(value))
+        if replace_child_nodes(node, self.handle_child):
+            invalidate(node)
 
     def handle_child(self, node: Node) -> Node:
         if (
@@ -649,23 +895,36 @@ class Respelling:
         return node
 
 
-class IfBraces:
+LOOP_TYPES = frozenset([
+    "WhileStatement",
+    "DoWhileStatement",
+    "ForStatement",
+    "ForInStatement",
+    "ForOfStatement",
+])
+
+
+class IfBraces(Pass):
+    node_types = frozenset(["IfStatement"]) | LOOP_TYPES
+    change_types = node_types
+
+    def may_change(self, node: Node) -> bool:
+        if node.type == "IfStatement":
+            alternate = node.alternate
+            return (
+                self.handle_body(node.consequent) is not node.consequent or
+                alternate is not None and
+                self.handle_alternate(alternate) is not alternate
+            )
+        return self.handle_body(node.body) is not node.body
+
     def process_node(self, node: Node):
         if node.type == "IfStatement":
             node.consequent = self.handle_body(node.consequent)
             if node.alternate is not None:
                 node.alternate = self.handle_alternate(node.alternate)
             return
-
-        if node.type in [
-            "WhileStatement",
-            "DoWhileStatement",
-            "ForStatement",
-            "ForInStatement",
-            "ForOfStatement",
-        ]:
-            node.body = self.handle_body(node.body)
-            return
+        node.body = self.handle_body(node.body)
 
     def handle_body(self, node: Node):
         if node.type not in ["BlockStatement", "EmptyStatement"]:
@@ -678,15 +937,15 @@ class IfBraces:
         return self.handle_body(node)
 
 
-class FlattenInvoked:
+class FlattenInvoked(Pass):
+    change_types = frozenset(["CallExpression"])
+
+    def may_change(self, node: Node) -> bool:
+        return self.flatten_once(node) is not node
+
     def process_node(self, node: Node):
-        for key, value in node.items():
-            if isinstance(value, list):
-                for i, elem in enumerate(value):
-                    if isinstance(elem, Node):
-                        value[i] = self.flatten(elem)
-            elif isinstance(value, Node):
-                setattr(node, key, self.flatten(value))
+        if replace_child_nodes(node, self.flatten):
+            invalidate(node)
 
     def flatten(self, node: Node) -> Node:
         while True:
@@ -710,12 +969,21 @@ class FlattenInvoked:
         return node.callee.body.body[0].argument
 
 
-class LabelFunctionArray:
-    def process_node(self, node: Node):
-        if node.type == "VariableDeclarator":
-            self.process_declarator(node)
+class LabelFunctionArray(Pass):
+    node_types = frozenset(["VariableDeclarator"])
+    change_types = node_types
 
-    def process_declarator(self, node: VariableDeclarator):
+    def may_change(self, node: VariableDeclarator) -> bool:
+        if not (node.init is not None and node.init.type == "ArrayExpression"):
+            return False
+        # Holes are included so that `process_node()` fails the same way.
+        return any(
+            child is None or
+            child.type == "FunctionExpression" and child.id is None
+            for child in node.init.elements
+        )
+
+    def process_node(self, node: VariableDeclarator):
         if not (node.init is not None and node.init.type == "ArrayExpression"):
             return
         for i, child in enumerate(node.init.elements):
@@ -728,7 +996,13 @@ class LabelFunctionArray:
 
 # For debugging JS code: wraps a bunch of expressions in calls to `__wrap()`,
 # which can perform arbitrary processing.
-class AddWrapCalls:
+class AddWrapCalls(Pass):
+    node_types = frozenset([
+        "ReturnStatement",
+        "VariableDeclarator",
+        "AssignmentExpression",
+    ])
+
     def process_node(self, node: Node):
         if node.type == "ReturnStatement":
             node.argument = self.wrap(node.argument)
@@ -743,23 +1017,172 @@ class AddWrapCalls:
         return CallExpression(callee=Identifier("__wrap"), args=[expr])
 
 
-def transform(ast: Node, temp_prefix=DEFAULT_TEMP_PREFIX):
-    state = State(temp_prefix=temp_prefix)
-    passes = [
-        Unsequence(state),
-        Respelling(),
-        IfBraces(),
-        FlattenInvoked(),
-        LabelFunctionArray(),
-    ]
-
-    def process_node(node: Node):
-        for tf_pass in passes:
-            tf_pass.process_node(node)
-
-    class Visitor(BaseVisitor):
-        def visit_Object(self, node):
-            if isinstance(node, Node):
-                process_node(node)
-            return super().visit_Object(node)
-    Visitor().visit(ast)
+FUNCTION_TYPES = frozenset([
+    "FunctionDeclaration",
+    "FunctionExpression",
+    "ArrowFunctionExpression",
+])
+
+
+class Transformer:
+    """Applies every pass to a tree, in pre-order.
+
+    If `fragments` (a `fragments.FragmentCache`) is provided, function bodies
+    are looked up in and stored in it. If `profiler` (a
+    `profiling.Profiler`) is provided, the time spent in each pass is
+    recorded. If `state` has a `budget.Budget`, passes that are `budgeted`
+    are no longer applied once it's exhausted.
+    """
+    def __init__(self, state: State, *, fragments=None, profiler=None):
+        self.state = state
+        self.fragments = fragments
+        passes = [
+            Unsequence(state),
+            Respelling(),
+            IfBraces(),
+            FlattenInvoked(),
+            LabelFunctionArray(),
+        ]
+        if profiler is not None:
+            passes = profiler.wrap_passes(passes)
+        self.passes = passes
+        # Maps node types to the `process_node()` methods of the passes that
+        # handle them, in order. Filled in as each type is encountered.
+        self.dispatch: dict[str, list] = {}
+        # IDs of function bodies that haven't been visited yet. Bodies nested
+        # in a body that was too small to cache aren't added, as they're
+        # smaller.
+        self.function_bodies = set()
+        self.in_small_body = False
+        # Whether the budget has run out and `dispatch` no longer includes
+        # budgeted passes.
+        self.degraded = False
+
+    def process_node(self, node: Node):
+        handlers = self.dispatch.get(node.type)
+        if handlers is None:
+            exhausted = self.state.budget_exhausted
+            handlers = self.dispatch[node.type] = [
+                tf_pass.process_node for tf_pass in self.passes
+                if (
+                    tf_pass.node_types is None or
+                    node.type in tf_pass.node_types
+                ) and not (exhausted and tf_pass.budgeted)
+            ]
+        for handler in handlers:
+            handler(node)
+
+    def handles_function_bodies(self) -> bool:
+        """Whether `visit_function_body()` should be used for function
+        bodies.
+        """
+        return self.fragments is not None
+
+    def visit(self, root: Node):
+        budget = self.state.budget
+        if budget is not None:
+            budget.start()
+        self.state.index = ScanIndex(root, self.passes)
+        # Each iterator yields the children of a node that still need to be
+        # visited. Passes only change the node they're given and its
+        # descendants, so the children can be found as soon as the node is
+        # processed, but each child is only examined once the subtrees of
+        # its earlier siblings have been transformed.
+        stack = [self.visit_node(root)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            else:
+                stack.append(self.visit_node(child))
+        # The index keeps every node in the original tree alive.
+        self.state.index = None
+
+    def visit_node(self, node: Node):
+        """Processes `node` and returns an iterator over its children."""
+        if self.state.index.is_unmarked_root(node):
+            skipped = subtree_nodes(node)
+            self.function_bodies.discard(id(node))
+            for tf_pass in self.passes:
+                tf_pass.skip(skipped)
+            self.state.skipped_nodes += len(skipped)
+            return iter(())
+        budget = self.state.budget
+        if budget is not None and budget.spend() and not self.degraded:
+            # Dispatch again without the passes that are budgeted.
+            self.degraded = True
+            self.dispatch.clear()
+        if id(node) in self.function_bodies:
+            self.function_bodies.remove(id(node))
+            return self.visit_function_body(node)
+        if (
+            not self.in_small_body and
+            node.type in FUNCTION_TYPES and
+            node.body.type == "BlockStatement" and
+            self.handles_function_bodies()
+        ):
+            self.function_bodies.add(id(node.body))
+        self.process_node(node)
+        return iter(child_nodes(node))
+
+    def visit_small_body(self, node: BlockStatement):
+        self.in_small_body = True
+        self.process_node(node)
+        yield from child_nodes(node)
+        self.in_small_body = False
+
+    def visit_function_body(self, node: BlockStatement):
+        state = self.state
+        fragments = self.fragments
+        key = fragments.make_key(node)
+        if key is None:
+            yield from self.visit_small_body(node)
+            return
+
+        fragment = fragments.get(key)
+        if fragment is not None:
+            renumber(fragment.body, state.temp_prefix, state.id_num)
+            node.body = fragment.body
+            invalidate(node)
+            state.id_num += fragment.temporaries
+            state.block_stats += fragment.block_stats
+            return
+
+        # Function bodies can be nested, so this may already be numbering
+        # temporaries for an enclosing body.
+        prefix = state.temp_prefix
+        id_num = state.id_num
+        num_stats = len(state.block_stats)
+        state.temp_prefix = TEMP_PREFIX
+        state.id_num = 0
+        self.process_node(node)
+        yield from child_nodes(node)
+        # A body transformed after the budget ran out isn't fully transformed.
+        if not state.budget_exhausted:
+            fragments.put(
+                key,
+                body=node.body,
+                temporaries=state.id_num,
+                block_stats=state.block_stats[num_stats:],
+            )
+        renumber(node.body, prefix, id_num)
+        state.temp_prefix = prefix
+        state.id_num += id_num
+
+
+def transform(
+    ast: Node,
+    temp_prefix=DEFAULT_TEMP_PREFIX, *,
+    fragments=None,
+    profiler=None,
+    budget: Optional[Budget] = None,
+) -> State:
+    """Deobfuscates `ast`, a tree of compact nodes (see `nodes`), in place.
+    (`opener.transform()` also accepts esprima's nodes.) See `Transformer`
+    for a description of the optional arguments. If `budget` is provided,
+    the result may be only partially deobfuscated (see
+    `State.budget_exhausted`).
+    """
+    state = State(temp_prefix=temp_prefix, budget=budget)
+    Transformer(state, fragments=fragments, profiler=profiler).visit(ast)
+    return state
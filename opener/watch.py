@@ -0,0 +1,493 @@
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Watch mode (``--watch``): processes inputs again whenever they change.
+
+Inputs are processed like in streaming mode (see `pipeline.process_stream()`),
+where each top-level statement is transformed independently and its
+temporaries are numbered after those of the statements before it, so the
+output is the same. The top-level statements of each input are grouped into
+segments, and the code generated for each segment is kept, with its
+temporaries numbered from 1 with `transformations.TEMP_PREFIX`. When the
+input changes, the segments that lie entirely within the text it has in
+common with the previous version (at its start and at its end) are reused,
+and only the text between them is parsed, transformed, and generated again.
+The temporaries in each segment's code are then renumbered to follow those
+before it.
+
+Segments only end after a statement that no following code could continue
+(see `ends_safely()`), so each segment is parsed the same way on its own as
+it is as part of the whole script.
+"""
+
+from .batch import Input, Options, find_inputs
+from .cache import ResultCache
+from .codegen import CodegenWorker
+from .defaults import CODEGEN_PYTHON
+from .fragments import FragmentCache
+from .nodes import Node, parse_statements
+from .pipeline import process_stream, run_codegen, transform_statements
+from .transformations import TEMP_PREFIX
+
+from esprima.error_handler import Error, ErrorHandler
+from typing import Optional
+import io
+import os
+import os.path
+import re
+import sys
+import time
+
+# Statements are grouped into segments spanning at least this many characters
+# of source. Smaller segments mean less is processed again after a change,
+# but more requests are sent to codegen.js the first time.
+SEGMENT_SIZE = 16 * 1024
+
+# How often inputs are checked for changes, in seconds.
+POLL_INTERVAL = 0.25
+
+# Statements that end with a closing brace, but can't be continued by any
+# following code (unlike, e.g., an expression statement ending in a function
+# expression, which can be called by a parenthesized expression after it).
+# A `try` statement can only be continued if it has no `finally` block (see
+# `can_be_continued()`).
+SELF_DELIMITING_TYPES = {
+    "BlockStatement",
+    "ClassDeclaration",
+    "FunctionDeclaration",
+    "SwitchStatement",
+    "TryStatement",
+}
+
+# Statements that end with another statement (their `body`).
+TRAILING_BODY_TYPES = {
+    "ForInStatement",
+    "ForOfStatement",
+    "ForStatement",
+    "LabeledStatement",
+    "WhileStatement",
+    "WithStatement",
+}
+
+# The range of source spanned by a group of statements that will become a
+# segment, the statements, and whether the last one ends safely.
+Group = tuple[int, int, list[Node], bool]
+
+TEMPORARY_REGEX = re.compile(re.escape(TEMP_PREFIX) + r"([0-9]+)")
+
+
+def ends_safely(statement: Node, source: str, end: int) -> bool:
+    """Returns whether `statement`, which ends at index `end` in `source`,
+    would be parsed the same way regardless of what follows it.
+    """
+    if getattr(statement, "directive", None) is not None:
+        # Part of the directive prologue, which must stay in one segment.
+        return False
+    if can_be_continued(statement):
+        return False
+    return source[end - 1] == ";" or statement.type in SELF_DELIMITING_TYPES
+
+
+def can_be_continued(statement: Node) -> bool:
+    """Returns whether `statement` could be continued by a following clause:
+    an `if` statement without an `else` clause (or a statement that ends with
+    one, like ``while (a) if (b) c();``) by ``else``, or a `try` statement
+    without a `finally` block by ``finally``.
+    """
+    while True:
+        if statement.type == "IfStatement":
+            if statement.alternate is None:
+                return True
+            statement = statement.alternate
+        elif statement.type == "TryStatement":
+            return statement.finalizer is None
+        elif statement.type in TRAILING_BODY_TYPES:
+            statement = statement.body
+        else:
+            return False
+
+
+class Segment:
+    def __init__(
+        self,
+        start: int,
+        end: int, *,
+        safe: bool,
+        code: str,
+        temporaries: int,
+    ):
+        # The range of the source spanned by the segment's statements
+        # (including any whitespace and comments before them).
+        self.start = start
+        self.end = end
+        # Whether the last statement ends safely (see `ends_safely()`). Only
+        # the last segment of a script can end unsafely.
+        self.safe = safe
+        # The generated code, or an empty string if every statement was
+        # removed.
+        self.code = code
+        # The number of temporaries created while transforming it.
+        self.temporaries = temporaries
+        # `code`, with its temporaries renumbered to follow the first
+        # `offset` temporaries, if it has been rendered.
+        self.rendered: Optional[str] = None
+        self.offset = 0
+
+    def render(self, prefix: str, offset: int) -> str:
+        if self.rendered is None or self.offset != offset:
+            self.rendered = TEMPORARY_REGEX.sub(
+                lambda m: f"{prefix}{int(m[1]) + offset}",
+                self.code,
+            )
+            self.offset = offset
+        return self.rendered
+
+
+class IncrementalProcessor:
+    """Deobfuscates successive versions of a script, reusing the output of
+    the segments that didn't change. `worker` must be provided unless
+    `codegen` is `CODEGEN_PYTHON`.
+    """
+    def __init__(
+        self, *,
+        temp_prefix: str,
+        codegen: str,
+        worker: Optional[CodegenWorker],
+        fragments: Optional[FragmentCache] = None,
+        segment_size=SEGMENT_SIZE,
+    ):
+        self.temp_prefix = temp_prefix
+        self.codegen = codegen
+        self.worker = worker
+        self.fragments = fragments
+        self.segment_size = segment_size
+        # The last version of the script that was processed, and its
+        # segments.
+        self.source = ""
+        self.segments: list[Segment] = []
+        # The number of segments reused by the last call to `update()`.
+        self.reused = 0
+
+    def update(self, source: str) -> str:
+        """Processes a new version of the script and returns the output. If
+        `source` can't be parsed, the exception is raised, and the previous
+        version is kept.
+        """
+        if TEMP_PREFIX in source:
+            # The code of each segment couldn't be renumbered reliably.
+            out = io.StringIO()
+            process_stream(
+                source, out,
+                temp_prefix=self.temp_prefix,
+                codegen=self.codegen,
+                worker=self.worker,
+            )
+            self.source = ""
+            self.segments = []
+            self.reused = 0
+            return out.getvalue()
+
+        old = self.source
+        prefix = common_prefix_length(old, source)
+        suffix = common_suffix_length(
+            old, source, min(len(old), len(source)) - prefix,
+        )
+        head = []
+        for segment in self.segments:
+            # If the last segment doesn't end safely, what was added after
+            # it might continue it.
+            if segment.end > prefix or not segment.safe:
+                break
+            head.append(segment)
+        tail = []
+        for segment in reversed(self.segments[len(head):]):
+            if segment.start < len(old) - suffix:
+                break
+            tail.append(segment)
+        tail.reverse()
+
+        start = head[-1].end if head else 0
+        delta = len(source) - len(old)
+        end = tail[0].start + delta if tail else len(source)
+        # Everything is parsed before anything is transformed, so that
+        # syntax errors (common while a file is being edited) are found
+        # quickly.
+        groups = self.parse_range(
+            source, start, end,
+            require_safe_end=bool(tail),
+        )
+        if groups is None:
+            tail = []
+            groups = self.parse_range(
+                source, start, len(source),
+                require_safe_end=False,
+            )
+        new = [self.process_group(*group) for group in groups]
+
+        for segment in tail:
+            segment.start += delta
+            segment.end += delta
+        self.source = source
+        self.segments = head + new + tail
+        self.reused = len(head) + len(tail)
+        return self.render()
+
+    def parse_range(
+        self,
+        source: str,
+        start: int,
+        end: int, *,
+        require_safe_end: bool,
+    ) -> Optional[list[Group]]:
+        """Parses ``source[start:end]`` and groups its statements into
+        segments spanning at least `segment_size` characters (only the last
+        of which may end unsafely). If `require_safe_end` is true and the
+        code after `end` might be needed to parse the range correctly (or
+        vice versa), returns None.
+        """
+        text = source[start:end]
+        groups = []
+        body = []
+        group_start = 0
+        statement_end = 0
+        try:
+            for statement, statement_end in parse_statements(
+                text, directives=(start == 0),
+            ):
+                body.append(statement)
+                if statement_end - group_start < self.segment_size:
+                    continue
+                if not ends_safely(statement, text, statement_end):
+                    continue
+                groups.append(
+                    (start + group_start, start + statement_end, body, True),
+                )
+                body = []
+                group_start = statement_end
+        except Error as e:
+            # Errors at the end of the range (like an unexpected end of
+            # input) might be fixed by the code after it.
+            if require_safe_end and e.index >= len(text.rstrip()):
+                return None
+            raise relocate_error(e, source, start) from None
+        if body:
+            safe = ends_safely(body[-1], text, statement_end)
+            groups.append(
+                (start + group_start, start + statement_end, body, safe),
+            )
+        if not require_safe_end:
+            return groups
+        if groups:
+            # The last statement might continue into the code after `end`.
+            if not groups[-1][3]:
+                return None
+        elif start == 0:
+            # The code after `end` would start the script, so it could have
+            # a directive prologue.
+            return None
+        return groups
+
+    def process_group(
+        self,
+        start: int,
+        end: int,
+        body: list[Node],
+        safe: bool,
+    ) -> Segment:
+        ast, state = transform_statements(
+            body, TEMP_PREFIX, 0,
+            fragments=self.fragments,
+            profiler=None,
+            jobs=1,
+        )
+        if self.fragments is not None:
+            self.fragments.flush()
+        code = ""
+        if ast.body:
+            code = run_codegen(
+                ast,
+                codegen=self.codegen,
+                worker=self.worker,
+                profiler=None,
+            )
+        return Segment(
+            start, end,
+            safe=safe,
+            code=code,
+            temporaries=state.id_num,
+        )
+
+    def render(self) -> str:
+        parts = []
+        offset = 0
+        for segment in self.segments:
+            if segment.code:
+                parts.append(segment.render(self.temp_prefix, offset))
+            offset += segment.temporaries
+        # Like `process_stream()`, which leaves an empty line if every
+        # statement is removed.
+        return "\n".join(parts) + "\n"
+
+
+def relocate_error(error: Error, source: str, start: int) -> Error:
+    """Returns a copy of `error`, which was raised while parsing
+    ``source[start:]``, with its position in `source` instead.
+    """
+    line_start = source.rfind("\n", 0, start) + 1
+    column = error.column
+    if error.lineNumber == 1:
+        column += start - line_start
+    # The description isn't stored, but the message is "Line <n>: " followed
+    # by it.
+    description = error.message.split(": ", 1)[-1]
+    return ErrorHandler().createError(
+        start + error.index,
+        error.lineNumber + source.count("\n", 0, start),
+        column,
+        description,
+    )
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    length = min(len(a), len(b))
+    if a[:length] == b[:length]:
+        return length
+    # Binary search, comparing slices (which is fast) rather than characters.
+    low = 0
+    high = length
+    while high - low > 1:
+        mid = (low + high) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Returns the length of the longest common suffix of `a` and `b`, up to
+    `limit`.
+    """
+    if limit <= 0:
+        return 0
+    return common_prefix_length(a[:-limit-1:-1], b[:-limit-1:-1])
+
+
+class WatchedInput:
+    def __init__(self, item: Input, processor: IncrementalProcessor):
+        self.item = item
+        self.processor = processor
+        # The modification time and size of the file when it was last
+        # processed.
+        self.signature: Optional[tuple[int, int]] = None
+
+
+def file_signature(path: str) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def run_watch(args: list[str], options: Options, *, verbose=False):
+    """Processes every input in `args` (like `batch.run_batch()`), and then
+    processes each one again whenever it changes, until interrupted. New
+    inputs in watched directories (or matching watched glob patterns) are
+    picked up too.
+    """
+    worker = None
+    if options.codegen != CODEGEN_PYTHON:
+        worker = CodegenWorker(options.codegen_format)
+    # Function bodies are always cached, so that a change to one function in
+    # a large top-level statement doesn't require transforming the others
+    # again.
+    cache = ResultCache(options.cache_path or ":memory:", options.cache_size)
+    fragments = FragmentCache(cache)
+    watched: dict[str, WatchedInput] = {}
+    # Inputs that couldn't be watched because another input is written to
+    # the same path.
+    conflicts: set[str] = set()
+
+    def add_input(item: Input) -> Optional[WatchedInput]:
+        for other in watched.values():
+            if other.item.relpath == item.relpath:
+                if item.path not in conflicts:
+                    conflicts.add(item.path)
+                    print(
+                        f"Not watching {item.path}: {other.item.path} is "
+                        f"also written to {item.relpath}",
+                        file=sys.stderr,
+                    )
+                return None
+        processor = IncrementalProcessor(
+            temp_prefix=options.temp_prefix,
+            codegen=options.codegen,
+            worker=worker,
+            fragments=fragments,
+        )
+        watched[item.path] = WatchedInput(item, processor)
+        return watched[item.path]
+
+    def update(entry: WatchedInput, signature: tuple[int, int]):
+        item = entry.item
+        start = time.perf_counter()
+        out_path = os.path.join(options.output_dir, item.relpath)
+        try:
+            with open(item.path, encoding="utf8") as f:
+                source = f.read()
+            output = entry.processor.update(source)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, "w", encoding="utf8") as f:
+                f.write(output)
+        except Exception as e:
+            print(
+                f"FAILED {item.path}: {type(e).__name__}: {e}",
+                file=sys.stderr,
+            )
+        else:
+            message = f"updated {item.path}"
+            if verbose:
+                processor = entry.processor
+                message += (
+                    f" ({processor.reused} of {len(processor.segments)} "
+                    f"segments reused, {time.perf_counter() - start:.3f} s)"
+                )
+            print(message, file=sys.stderr)
+        # A failed input keeps its last output, and isn't processed again
+        # until it changes.
+        entry.signature = signature
+
+    print("Watching for changes (press Ctrl-C to stop)", file=sys.stderr)
+    try:
+        while True:
+            for item in find_inputs(args):
+                entry = watched.get(item.path)
+                if entry is None:
+                    entry = add_input(item)
+                    if entry is None:
+                        continue
+                signature = file_signature(item.path)
+                if signature is not None and signature != entry.signature:
+                    update(entry, signature)
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if worker is not None:
+            worker.close()
+        cache.close()
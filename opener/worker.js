@@ -0,0 +1,76 @@
+/*
+ * Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+ *
+ * This file is part of Opener.
+ *
+ * Opener is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Opener is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with Opener. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+// Request loop shared by Opener's long-lived Node.js workers (codegen.js and
+// parse.js). Requests are read from standard input and consist of a payload
+// split into chunks, each of which is prefixed with its length as a 32-bit
+// big-endian integer. A zero-length chunk ends the request. Each response
+// written to standard output consists of a status byte (0 on success, 1 on
+// failure) followed by a length-prefixed UTF-8 payload whose meaning depends
+// on the worker.
+
+const STATUS_OK = 0;
+const STATUS_ERROR = 1;
+
+function respond(status, text) {
+    const body = Buffer.from(text, "utf8");
+    const header = Buffer.alloc(5);
+    header[0] = status;
+    header.writeUInt32BE(body.length, 1);
+    process.stdout.write(Buffer.concat([header, body]));
+}
+
+// Calls `handleChunk` with each chunk of the payload of each request (as a
+// Buffer) as soon as it's received, and `handleEnd` at the end of each
+// request. `handleEnd` should call `respond()` once.
+function serveChunks(handleChunk, handleEnd) {
+    let buffer = Buffer.alloc(0);
+
+    process.stdin.on("data", data => {
+        buffer = buffer.length > 0 ? Buffer.concat([buffer, data]) : data;
+        let offset = 0;
+        while (buffer.length - offset >= 4) {
+            const length = buffer.readUInt32BE(offset);
+            if (buffer.length - offset - 4 < length) {
+                break;
+            }
+            offset += 4;
+            if (length === 0) {
+                handleEnd();
+                continue;
+            }
+            handleChunk(buffer.subarray(offset, offset + length));
+            offset += length;
+        }
+        buffer = buffer.subarray(offset);
+    });
+}
+
+// Calls `handleRequest` with the whole payload of each request, as a Buffer.
+// It should call `respond()` once.
+function serve(handleRequest) {
+    let chunks = [];
+    serveChunks(chunk => chunks.push(chunk), () => {
+        const payload = Buffer.concat(chunks);
+        chunks = [];
+        handleRequest(payload);
+    });
+}
+
+module.exports = {STATUS_OK, STATUS_ERROR, respond, serve, serveChunks};
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Checks that --watch produces the same output after an edit as processing
+the edited script from scratch, and that both match --stream.
+
+Usage: check_watch.py [--seed=<n>] [--edits=<n>] [<js-file-or-dir>...]
+
+Random edits (deleting, copying, and replacing text, and inserting
+statements) are applied to each input one after another, 20 by default;
+edits that make it invalid are undone after checking that it's rejected.
+After each edit, the output of the watch-mode processor that has seen every
+previous version is compared with that of a new processor and of
+`process_stream()` with several chunk sizes. The snippets from
+compare_codegen.py are always checked as well. Code is generated with
+opener/printer.py, so Node.js isn't needed.
+"""
+
+import os.path
+import sys
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, os.pardir))
+
+from compare_codegen import iter_inputs  # noqa: E402
+from opener.cache import ResultCache  # noqa: E402
+from opener.defaults import CODEGEN_PYTHON  # noqa: E402
+from opener.fragments import FragmentCache  # noqa: E402
+from opener.pipeline import process_stream  # noqa: E402
+from opener.watch import IncrementalProcessor  # noqa: E402
+import difflib  # noqa: E402
+import io  # noqa: E402
+import random  # noqa: E402
+
+TEMP_PREFIX = "_"
+CHUNK_SIZES = [1, 512, 64 * 1024]
+SEGMENT_SIZES = [1, 4096]
+INSERTED = [
+    "a = (b(), c);", "\nd()\n", "(e)", "var f = 1, g = (h(), i)",
+    "function j() { k.l((m(), n)); }", "if (o) p = function () {};",
+    "q: for (;;) { r = s ? (t(), u) : v; break q; }",
+]
+
+
+def edit(source: str, rng: random.Random) -> str:
+    n = len(source)
+    start = rng.randrange(n + 1)
+    end = min(n, start + rng.randrange(1, 200))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return source[:start] + source[end:]
+    if kind == 1:
+        other = rng.randrange(n + 1)
+        text = source[other:other + rng.randrange(1, 300)]
+        return source[:start] + text + source[start:]
+    if kind == 2:
+        # Insert a statement after a semicolon, which is usually the end of
+        # one.
+        start = source.find(";", start) + 1 or n
+        return source[:start] + rng.choice(INSERTED) + source[start:]
+    return source[:start] + rng.choice("a;(){},1") + source[start + 1:]
+
+
+def run_stream(source: str, chunk_size: int) -> str:
+    out = io.StringIO()
+    process_stream(
+        source, out,
+        temp_prefix=TEMP_PREFIX,
+        codegen=CODEGEN_PYTHON,
+        chunk_size=chunk_size,
+    )
+    return out.getvalue()
+
+
+def new_processor(segment_size: int, cache: ResultCache):
+    return IncrementalProcessor(
+        temp_prefix=TEMP_PREFIX,
+        codegen=CODEGEN_PYTHON,
+        worker=None,
+        fragments=FragmentCache(cache),
+        segment_size=segment_size,
+    )
+
+
+def compare_text(name: str, expected: str, actual: str) -> bool:
+    if actual == expected:
+        return True
+    print(f"MISMATCH {name}")
+    sys.stdout.writelines(difflib.unified_diff(
+        expected.splitlines(keepends=True),
+        actual.splitlines(keepends=True),
+        "expected", "actual", n=2,
+    ))
+    print()
+    return False
+
+
+def check(
+    name: str,
+    source: str,
+    edits: int,
+    rng: random.Random,
+    cache: ResultCache,
+) -> bool:
+    processors = [new_processor(size, cache) for size in SEGMENT_SIZES]
+    previous = None
+    for i in range(edits + 1):
+        if previous is not None:
+            source = edit(previous, rng)
+        version = f"{name} (edit {i})"
+        try:
+            expected = run_stream(source, CHUNK_SIZES[0])
+        except Exception:
+            # The processors should raise too, and keep the previous
+            # version, which the next edit is applied to.
+            for processor in processors:
+                try:
+                    processor.update(source)
+                except Exception:
+                    continue
+                print(f"MISMATCH {version}: only --watch accepts it")
+                return False
+            if previous is None:
+                return True
+            continue
+        previous = source
+        outputs = [
+            (f"--stream (chunk size {size})", run_stream(source, size))
+            for size in CHUNK_SIZES[1:]
+        ]
+        for size in SEGMENT_SIZES:
+            fresh = new_processor(size, cache)
+            outputs.append((
+                f"new (segment size {size})", fresh.update(source),
+            ))
+        for size, processor in zip(SEGMENT_SIZES, processors):
+            outputs.append((
+                f"--watch (segment size {size})", processor.update(source),
+            ))
+        for description, actual in outputs:
+            if not compare_text(f"{version}, {description}", expected, actual):
+                return False
+    return True
+
+
+def main():
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        print(__doc__.split("\n\n")[1])
+        return
+    seed = 0
+    edits = 20
+    paths = []
+    for arg in args:
+        if arg.startswith("--seed="):
+            seed = int(arg.partition("=")[2])
+        elif arg.startswith("--edits="):
+            edits = int(arg.partition("=")[2])
+        else:
+            paths.append(arg)
+    rng = random.Random(seed)
+    total = 0
+    failed = 0
+    with ResultCache(":memory:", 1 << 30) as cache:
+        for name, source in iter_inputs(paths):
+            total += 1
+            if not check(name, source, edits, rng, cache):
+                failed += 1
+    print(f"{total - failed}/{total} inputs match")
+    sys.exit(int(failed > 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Checks that opener/printer.py produces the same output as escodegen.
+
+Usage: compare_codegen.py [<js-file-or-dir>...]
+
+Each input is parsed, printed with both code generators (before and after
+deobfuscation), and any differences are reported. A set of built-in snippets
+covering formatting edge cases is always checked as well.
+"""
+
+import os.path
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from opener.codegen import CodegenWorker  # noqa: E402
+from opener.nodes import parse  # noqa: E402
+from opener.pipeline import run_codegen_js  # noqa: E402
+from opener.printer import generate  # noqa: E402
+from opener.transformations import transform  # noqa: E402
+import difflib  # noqa: E402
+
+SNIPPETS = [
+    # Strings and escapes.
+    r"""a = 'it\'s'; b = "say \"hi\""; c = "both ' and \"";""",
+    r"""a = "\0\x001\b\f\n\r\t\v\\ \u2028\u2029 \x7f\xa0\xe9\u0100";""",
+    r"""a = "\ud83d\ude00 \ud800 \u200c\u200d \u3000 \ufeff \u0660 \xdf";""",
+    r"""a = "\u00aa\u02c1\u0300\u0903 \u203f\u2160 \u180e\u4e00\uffff";""",
+    # Assigned after Unicode 9.0.0, so escaped by escodegen.
+    r"""a = "\u0860\u08b6";""",
+    r"""a = "</script>"; b = "/"; c = "${x}";""",
+    # Numbers.
+    "a = [0, 1, 10, 1.5, .5, 0.000001, 0.0000001, 1e21, 1e20, 123e-20];",
+    "a = [0x10, 010, 0b11, 0o17, 9007199254740993, 2e-7, 1.25e+30];",
+    "a = 1..toString(); b = 1.5.toFixed(); c = 0x10.x; d = 1e3.x;",
+    # Regular expressions.
+    r"a = /[/]\//g; b = /a/ instanceof c; d = a / /re/;",
+    # Operators and precedence.
+    "a = -(-b); c = +(+d); e = - -f; g = !(!h); i = typeof typeof j;",
+    "a = b - -c; d = e + +f; g = h++ + ++i; j = k-- - --l;",
+    "a = (b, c); d = (e = f); (g || h) && i; j = (k ? l : m) ? n : o;",
+    "a = b in c; for (var d = (e in f); ;) {} for (g = (h in i); ;) {}",
+    "for (var a = function () { return b in c; }; ;) {}",
+    "a = new B; c = new (D()); e = new F.G(); h = new (I.J())();",
+    "new (K().L); new (M.N()).O; new P()();",
+    "(function () {})(); (function f() {}()); !function () {}();",
+    "({}).a; ({ a: 1 }); ({ a: 1, b: 2 }.c); (class {}); a = class B {};",
+    "a = async function () {}; (async function () {}); async => async;",
+    "a = void 0; delete a[b]; a = (b, c)[d]; (a, b).c();",
+    "a = b < !--c; d = e / /f/; g = h - -i; j = k + ++l;",
+    # Statements.
+    "if (a) b(); else if (c) d(); else { e(); }",
+    "if (a) { b(); } else c();\nif (a) ; else ;",
+    "do a(); while (b); do { a(); } while (b);",
+    "for (;;) {} for (a in b) c(); for (var a in b) ; for (let a of b) {}",
+    "a: for (;;) { continue a; } b: { break b; } c: d();",
+    "switch (a) { case 1: b(); case 2: { c(); } default: d(); break; }",
+    "switch (a) {} switch (a) { case 1: }",
+    "try { a(); } catch (e) { b(); } finally { c(); }",
+    "try { a(); } catch (e) {} try {} finally {}",
+    "with (a) b(); with (a) { b(); } while (a) ; debugger;",
+    "function f(a, b = 1, ...c) { return; } function g() { 'use strict'; }",
+    "function* g() { yield; yield a; yield* b; }",
+    "async function h() { await a; await (b, c); }",
+    "var a, b = 1, c = { d: 2, e: 3 }; let [f, , g] = h;",
+    "const { i, j: k } = l; var m = { n: { o: 1, p: [2, 3] } };",
+    "var { a = 1, ...b } = c; var [d = 1, ...e] = f; var { g: { h } } = i;",
+    # Functions, objects, arrays, and classes.
+    "a = { b() {}, get c() {}, set d(e) {}, [f]: 1, 'g': 2, 3: 4, h };",
+    "a = { async b() {}, *c() {}, [e]() {} };",
+    "a = { b: function () { c(); } }; d({ e: function () {} });",
+    "a = [1, 2, [3, 4], [], [5], , ]; b = [, , c];",
+    "a = (b) => c; d = (e, f) => { g(); }; h = () => ({});",
+    "i = async (j) => k; l = async j => k; m = (n = 1, [o]) => p;",
+    "class A extends B { constructor() { super(); } static c() {} }",
+    "class A { get b() {} set b(c) {} static *d() {} async e() {} }",
+    "class A extends (B, C) {} class D extends E.F {}",
+    "a = `b${ c }d${ `e${ f }` }`; g`h${ i }`; j.k`l`; new M`n`;",
+    "a = function () { return new.target; };",
+]
+
+
+def iter_inputs(args: list[str]):
+    for i, snippet in enumerate(SNIPPETS):
+        yield f"<snippet {i}>", snippet
+    for arg in args:
+        paths = [arg]
+        if os.path.isdir(arg):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, dirs, files in os.walk(arg)
+                for name in files if name.endswith(".js")
+            )
+        for path in paths:
+            with open(path, encoding="utf8") as f:
+                yield path, f.read()
+
+
+def compare(name: str, ast, worker: CodegenWorker) -> bool:
+    try:
+        expected = run_codegen_js(ast, worker)
+    except Exception as e:
+        expected = f"<error: {type(e).__name__}>"
+    try:
+        actual = generate(ast)
+    except Exception as e:
+        actual = f"<error: {type(e).__name__}: {e}>"
+    if actual == expected:
+        return True
+    print(f"MISMATCH {name}")
+    sys.stdout.writelines(difflib.unified_diff(
+        expected.splitlines(keepends=True),
+        actual.splitlines(keepends=True),
+        "escodegen", "printer.py", n=2,
+    ))
+    print()
+    return False
+
+
+def main():
+    if "-h" in sys.argv[1:] or "--help" in sys.argv[1:]:
+        print(__doc__.split("\n\n")[1])
+        return
+    total = 0
+    failed = 0
+    with CodegenWorker() as worker:
+        for name, source in iter_inputs(sys.argv[1:]):
+            try:
+                ast = parse(source)
+            except Exception as e:
+                print(f"SKIPPED {name}: {e}")
+                continue
+            total += 1
+            if not compare(name, ast, worker):
+                failed += 1
+                continue
+            transform(ast)
+            total += 1
+            if not compare(f"{name} (deobfuscated)", ast, worker):
+                failed += 1
+    print(f"{total - failed}/{total} outputs match")
+    sys.exit(int(failed > 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021 taylor.fish <contact@taylor.fish>
+#
+# This file is part of Opener.
+#
+# Opener is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Opener is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Opener. If not, see <https://www.gnu.org/licenses/>.
+
+"""Checks that parsing in Node.js (opener/parse.js) produces the same AST as
+esprima-python.
+
+Usage: compare_parsers.py [<js-file-or-dir>...]
+
+Each input is parsed with both parsers and deobfuscated, and the JSON
+representations of the ASTs (before and after deobfuscation) and the
+deobfuscated code are compared, as are the error messages for inputs that
+both parsers reject. Inputs that only one parser accepts are listed
+separately, as the parsers support slightly different syntax (for example,
+esprima-python rejects regular expressions that Python can't compile, and
+only esprima-python supports rest properties in object patterns). The
+snippets from compare_codegen.py and a set of parser edge cases are always
+checked as well.
+"""
+
+import os.path
+import sys
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, os.pardir))
+
+from compare_codegen import iter_inputs  # noqa: E402
+from opener.node_parser import ParseWorker  # noqa: E402
+from opener.nodes import parse  # noqa: E402
+from opener.printer import generate  # noqa: E402
+from opener.to_json import write_json  # noqa: E402
+from opener.transformations import transform  # noqa: E402
+from typing import Optional  # noqa: E402
+import difflib  # noqa: E402
+import esprima  # noqa: E402
+import io  # noqa: E402
+import itertools  # noqa: E402
+
+PARSER_SNIPPETS = [
+    # Numbers that JSON can't represent exactly.
+    "a = [1e999, 0xffffffffffffffffff, 0o7777777777777777777777];",
+    "a = [1e21, 1.0, 5., .5e1, 017, 09, 0o17, 1e-7];",
+    "a = [123456789012345678901, 9007199254740993, 077777777777777777777];",
+    # Regular expressions.
+    r"a = [/a+/gi, /[\u{1f600}]/u, /a/y, /[/]\//];",
+    # Only accepted by parse.js, as Python can't compile it.
+    r"a = /(?<n>a)\k<n>/;",
+    # Strings containing astral characters and lone surrogates.
+    r"""a = ["😀", "😀", "\ud800", "\u{1f600}"];""",
+    "a = `x${b}\\n${`c${d}`}`; e = f`\\u{41}${g}`;",
+    # Directives, async functions, and patterns.
+    "'use strict'; 'another'; a();",
+    "async function f() {} a = async () => 1; b = async function () {};",
+    "[a, {b, c: [d = 1, ...e]}] = f; ({a = 1} = b); for ([a, b] of c) {}",
+    # Syntax errors.
+    "a = (;",
+    "var 1;",
+    "a = `b",
+    "a = /b",
+]
+
+
+def dump(ast) -> str:
+    out = io.StringIO()
+    write_json(ast, out)
+    return out.getvalue()
+
+
+def try_parse(func, source: str):
+    """Returns the AST, or an error message if the source can't be
+    parsed.
+    """
+    try:
+        return func(source)
+    except esprima.Error as e:
+        return f"<error: {e}>"
+
+
+def compare_text(name: str, expected: str, actual: str) -> bool:
+    if actual == expected:
+        return True
+    print(f"MISMATCH {name}")
+    sys.stdout.writelines(difflib.unified_diff(
+        expected.replace(", ", ",\n").splitlines(keepends=True),
+        actual.replace(", ", ",\n").splitlines(keepends=True),
+        "esprima-python", "parse.js", n=2,
+    ))
+    print()
+    return False
+
+
+def compare(name: str, source: str, worker: ParseWorker) -> Optional[bool]:
+    """Returns whether the results match, or None if only one parser accepts
+    the input.
+    """
+    expected = try_parse(parse, source)
+    actual = try_parse(worker.parse, source)
+    if isinstance(expected, str) and isinstance(actual, str):
+        return compare_text(name, expected, actual)
+    if isinstance(expected, str) or isinstance(actual, str):
+        parser = "parse.js" if isinstance(expected, str) else "esprima-python"
+        print(f"ONLY {parser} ACCEPTS {name}")
+        return None
+    if not compare_text(name, dump(expected), dump(actual)):
+        return False
+    transform(expected)
+    transform(actual)
+    return (
+        compare_text(f"{name} (deobfuscated)", dump(expected), dump(actual))
+        and compare_text(
+            f"{name} (code)", generate(expected), generate(actual),
+        )
+    )
+
+
+def main():
+    if "-h" in sys.argv[1:] or "--help" in sys.argv[1:]:
+        print(__doc__.split("\n\n")[1])
+        return
+    total = 0
+    failed = 0
+    one_sided = 0
+    inputs = itertools.chain((
+        (f"<parser snippet {i}>", snippet)
+        for i, snippet in enumerate(PARSER_SNIPPETS)
+    ), iter_inputs(sys.argv[1:]))
+    with ParseWorker() as worker:
+        for name, source in inputs:
+            result = compare(name, source, worker)
+            if result is None:
+                one_sided += 1
+                continue
+            total += 1
+            if not result:
+                failed += 1
+    print(
+        f"{total - failed}/{total} inputs match "
+        f"({one_sided} accepted by only one parser)",
+    )
+    sys.exit(int(failed > 0))
+
+
+if __name__ == "__main__":
+    main()